@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.translation import gettext_lazy as _
 
-from accounts.models import User, UserNotificationPreferences
+from accounts.models import EmailOutbox, User, UserNotificationPreferences
 
 
 @admin.register(User)
@@ -25,3 +25,12 @@ class UserAdmin(BaseUserAdmin):
 @admin.register(UserNotificationPreferences)
 class UserNotificationPreferencesAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ("subject", "domain", "status", "attempts", "created_at", "sent_at")
+    list_filter = ("status", "domain")
+    search_fields = ("subject", "domain")
+    date_hierarchy = "created_at"
+    readonly_fields = ("created_at", "sent_at", "attempts", "last_error")
@@ -0,0 +1,139 @@
+"""
+Personal data export (GDPR) of a user.
+
+The data is written as JSON lines files in a zip archive on disk, reading the
+rows by chunks so that the memory used does not grow with the data of the
+user. The archive is then downloaded through a signed link, valid for
+DATA_EXPORT_MAX_AGE seconds.
+"""
+
+import itertools
+import json
+import os
+import time
+import zipfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+
+from carpool.models import Vehicle
+from carpool.models.reservation import Reservation
+from carpool.models.ride import Ride
+from chat.models import ChatMessage
+
+# Number of rows fetched at once from the database
+EXPORT_CHUNK_SIZE = 1000
+
+SIGNING_SALT = "accounts.export"
+
+PROFILE_FIELDS = (
+    "username",
+    "email",
+    "first_name",
+    "last_name",
+    "date_joined",
+    "last_login",
+    "email_verified",
+    "preferred_language",
+)
+
+
+def export_path(user_pk):
+    return Path(settings.DATA_EXPORT_ROOT) / f"{user_pk}.zip"
+
+
+def export_sections(user):
+    """The querysets of the exported data of `user`, by file name."""
+    rides = Ride.objects.filter_user(user).order_by("-start_dt")
+    return {
+        "rides.jsonl": rides.values(
+            "uuid",
+            "is_driver",
+            "start_dt",
+            "end_dt",
+            "start_loc__fulltext",
+            "end_loc__fulltext",
+            "seats_offered",
+            "price",
+            "payment_method",
+            "comment",
+        ),
+        "reservations.jsonl": Reservation.objects.filter(user=user)
+        .order_by("created_at")
+        .values("ride_id", "status", "created_at"),
+        "chat_messages.jsonl": ChatMessage.objects.filter(sender=user)
+        .order_by("timestamp")
+        .values("chat_request__ride_id", "content", "timestamp", "read_at"),
+        "vehicles.jsonl": Vehicle.objects.filter(driver=user)
+        .order_by("pk")
+        .values("name", "description", "seats", "geqCO2_per_km"),
+    }
+
+
+def write_archive(user, path):
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        profile = {field: getattr(user, field) for field in PROFILE_FIELDS}
+        archive.writestr(
+            "profile.json",
+            json.dumps(profile, cls=DjangoJSONEncoder, ensure_ascii=False),
+        )
+        for name, rows in export_sections(user).items():
+            with archive.open(name, "w") as f:
+                for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                    line = json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False)
+                    f.write(line.encode() + b"\n")
+
+
+def write_export(user):
+    """Write the data export archive of `user` and return its path.
+
+    The archive is written next to its final path then moved, so that a
+    download never reads a partially written archive. It is removed if the
+    export fails.
+    """
+    path = export_path(user.pk)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+
+    try:
+        write_archive(user, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return path
+
+
+def make_download_token(user_pk):
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign(str(user_pk))
+
+
+def check_download_token(token):
+    """Return the user pk signed in `token`.
+
+    Raises signing.BadSignature (or SignatureExpired) if the token is invalid
+    or older than DATA_EXPORT_MAX_AGE.
+    """
+    return signing.TimestampSigner(salt=SIGNING_SALT).unsign(
+        token, max_age=settings.DATA_EXPORT_MAX_AGE
+    )
+
+
+def delete_expired_exports():
+    """Delete the archives whose download links have expired, return their number.
+
+    The partial archives left by an interrupted export are deleted as well.
+    """
+    root = Path(settings.DATA_EXPORT_ROOT)
+    if not root.exists():
+        return 0
+
+    deleted = 0
+    cutoff = time.time() - settings.DATA_EXPORT_MAX_AGE
+    for path in itertools.chain(root.glob("*.zip"), root.glob("*.tmp")):
+        if path.stat().st_mtime < cutoff:
+            path.unlink(missing_ok=True)
+            deleted += 1
+    return deleted
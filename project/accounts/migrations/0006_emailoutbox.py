@@ -0,0 +1,106 @@
+# Generated by Django 5.2.13 on 2026-10-18 20:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounts", "0005_user_username_trgm_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmailOutbox",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "from_email",
+                    models.CharField(blank=True, max_length=255, verbose_name="from"),
+                ),
+                ("to", models.JSONField(default=list, verbose_name="to")),
+                (
+                    "reply_to",
+                    models.JSONField(blank=True, default=list, verbose_name="reply to"),
+                ),
+                ("subject", models.TextField(verbose_name="subject")),
+                ("body", models.TextField(verbose_name="body")),
+                (
+                    "content_subtype",
+                    models.CharField(
+                        default="plain", max_length=10, verbose_name="content subtype"
+                    ),
+                ),
+                (
+                    "html_body",
+                    models.TextField(
+                        blank=True,
+                        help_text="HTML alternative of a plain text body.",
+                        verbose_name="HTML body",
+                    ),
+                ),
+                (
+                    "domain",
+                    models.CharField(
+                        db_index=True, max_length=255, verbose_name="domain"
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "Pending"),
+                            ("SENT", "Sent"),
+                            ("FAILED", "Failed"),
+                        ],
+                        default="PENDING",
+                        max_length=10,
+                        verbose_name="status",
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.PositiveSmallIntegerField(
+                        default=0, verbose_name="attempts"
+                    ),
+                ),
+                ("last_error", models.TextField(blank=True, verbose_name="last error")),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="created at"
+                    ),
+                ),
+                (
+                    "next_attempt_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        verbose_name="next attempt at",
+                    ),
+                ),
+                (
+                    "sent_at",
+                    models.DateTimeField(blank=True, null=True, verbose_name="sent at"),
+                ),
+            ],
+            options={
+                "verbose_name": "Outbox email",
+                "verbose_name_plural": "Outbox emails",
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("status", "PENDING")),
+                        fields=["next_attempt_at"],
+                        name="accounts_outbox_pending_idx",
+                    )
+                ],
+            },
+        ),
+    ]
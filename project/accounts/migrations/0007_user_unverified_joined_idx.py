@@ -0,0 +1,21 @@
+# Generated by Django 5.2.13 on 2026-10-18 20:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounts", "0006_emailoutbox"),
+        ("auth", "0012_alter_user_first_name_max_length"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                condition=models.Q(("email_verified", False)),
+                fields=["date_joined"],
+                name="accounts_unverified_joined_idx",
+            ),
+        ),
+    ]
@@ -2,7 +2,11 @@ from uuid import uuid4
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.db import models, transaction
+from django.db.models.functions import Upper
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
@@ -27,6 +31,21 @@ class User(AbstractUser):
         help_text=_("Preferred language for the user interface."),
     )
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Trigram index for the username__icontains searches of the moderators
+            GinIndex(
+                OpClass(Upper("username"), name="gin_trgm_ops"),
+                name="accounts_username_trgm_idx",
+            ),
+            # Accounts deleted by the delete_non_verified_accounts task
+            models.Index(
+                fields=["date_joined"],
+                condition=models.Q(email_verified=False),
+                name="accounts_unverified_joined_idx",
+            ),
+        ]
+
     @property
     def has_email_verify_cooldown(self):
         from datetime import timedelta
@@ -59,3 +78,145 @@ class UserNotificationPreferences(models.Model):
     ride_sharing_suggestion_notification = models.BooleanField(
         default=True, help_text="Receive notifications suggesting to share rides."
     )
+
+
+class EmailOutboxQuerySet(models.QuerySet):
+    def due(self):
+        """Pending emails whose (next) sending attempt is due."""
+        return self.filter(
+            status=EmailOutbox.Status.PENDING, next_attempt_at__lte=timezone.now()
+        )
+
+    def expired(self, sent_ttl, failed_ttl):
+        """Emails sent over `sent_ttl` ago, or failed and created over `failed_ttl` ago."""
+        now = timezone.now()
+        return self.filter(
+            models.Q(status=EmailOutbox.Status.SENT, sent_at__lt=now - sent_ttl)
+            | models.Q(
+                status=EmailOutbox.Status.FAILED, created_at__lt=now - failed_ttl
+            )
+        )
+
+
+class EmailOutboxManager(models.Manager.from_queryset(EmailOutboxQuerySet)):
+    def enqueue(self, email):
+        """Store an EmailMessage to be sent by the send_outbox_emails task.
+
+        The row is written in the current transaction, so the email is only sent
+        if the change that triggered it is committed.
+        """
+        return self.enqueue_many([email])[0]
+
+    def enqueue_many(self, emails):
+        from accounts.tasks import send_outbox_emails
+
+        entries = self.bulk_create([EmailOutbox.from_email_message(e) for e in emails])
+        if entries:
+            transaction.on_commit(send_outbox_emails.delay)
+        return entries
+
+    def claim(self, batch_size, lease):
+        """Lock a batch of due emails for `lease` (a timedelta) and return them.
+
+        The emails locked by another worker are skipped, and the claimed ones
+        are not due again before the end of the lease, in case the worker dies
+        before sending them.
+        """
+        with transaction.atomic():
+            entries = list(
+                self.due()
+                .select_for_update(skip_locked=True)
+                .order_by("next_attempt_at")[:batch_size]
+            )
+            self.filter(pk__in=[entry.pk for entry in entries]).update(
+                next_attempt_at=timezone.now() + lease
+            )
+        return entries
+
+
+class EmailOutbox(models.Model):
+    """An email waiting to be sent, or sent, by the send_outbox_emails task."""
+
+    class Status(models.TextChoices):
+        PENDING = "PENDING", _("Pending")
+        SENT = "SENT", _("Sent")
+        FAILED = "FAILED", _("Failed")
+
+    from_email = models.CharField(_("from"), max_length=255, blank=True)
+    to = models.JSONField(_("to"), default=list)
+    reply_to = models.JSONField(_("reply to"), default=list, blank=True)
+    subject = models.TextField(_("subject"))
+    body = models.TextField(_("body"))
+    content_subtype = models.CharField(
+        _("content subtype"), max_length=10, default="plain"
+    )
+    html_body = models.TextField(
+        _("HTML body"),
+        blank=True,
+        help_text=_("HTML alternative of a plain text body."),
+    )
+    # Domain of the first recipient, the sending rate is limited per domain
+    domain = models.CharField(_("domain"), max_length=255, db_index=True)
+
+    status = models.CharField(
+        _("status"), max_length=10, choices=Status.choices, default=Status.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(_("attempts"), default=0)
+    last_error = models.TextField(_("last error"), blank=True)
+    created_at = models.DateTimeField(_("created at"), default=timezone.now)
+    next_attempt_at = models.DateTimeField(_("next attempt at"), default=timezone.now)
+    sent_at = models.DateTimeField(_("sent at"), null=True, blank=True)
+
+    objects = EmailOutboxManager()
+
+    class Meta:
+        verbose_name = _("Outbox email")
+        verbose_name_plural = _("Outbox emails")
+        indexes = [
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=models.Q(status="PENDING"),
+                name="accounts_outbox_pending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} ({', '.join(self.to)})"
+
+    @classmethod
+    def from_email_message(cls, email):
+        if email.attachments:
+            raise ValueError("Emails with attachments cannot be queued.")
+        html_body = next(
+            (
+                content
+                for content, mimetype in getattr(email, "alternatives", [])
+                if mimetype == "text/html"
+            ),
+            "",
+        )
+        to = list(email.to)
+        return cls(
+            from_email=email.from_email or "",
+            to=to,
+            reply_to=list(email.reply_to),
+            subject=email.subject,
+            body=email.body,
+            content_subtype=email.content_subtype,
+            html_body=html_body,
+            domain=to[0].rpartition("@")[2].lower() if to else "",
+        )
+
+    def to_email_message(self):
+        email_class = EmailMultiAlternatives if self.html_body else EmailMessage
+        email = email_class(
+            subject=self.subject,
+            body=self.body,
+            from_email=self.from_email or None,
+            to=self.to,
+            reply_to=self.reply_to,
+        )
+        email.content_subtype = self.content_subtype
+        if self.html_body:
+            email.attach_alternative(self.html_body, "text/html")
+        return email
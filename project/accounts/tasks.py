@@ -1,19 +1,23 @@
 import os
-import json
+import time
 
 from celery import shared_task
 from django.contrib.auth import get_user_model
-from django.contrib.auth.forms import PasswordResetForm
-from django.core.mail import EmailMessage
+from django.core.cache import cache
+from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection
 from django.template.loader import render_to_string
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
 from django.utils.translation import gettext as _
-from django.utils import timezone
+from django.urls import reverse
+from django.utils import timezone, translation
 from datetime import timedelta
 from celery.utils.log import get_task_logger
 from django.conf import settings
+from django.db import models, transaction
 
+from accounts import export
+from accounts.models import EmailOutbox
 
 logger = get_task_logger(__name__)
 
@@ -55,9 +59,9 @@ def send_verification_email(
         },
     )
     email = EmailMessage(subject, message, to=[user_email])
-    email.send()
+    EmailOutbox.objects.enqueue(email)
 
-    logger.info(f"Sent verification email to {user_email}.")
+    logger.info(f"Queued verification email to {user_email}.")
 
 
 @shared_task
@@ -71,105 +75,59 @@ def send_password_reset_email(
 ):
     context["user"] = get_user_model().objects.get(pk=context["user"])
 
-    PasswordResetForm.send_mail(
-        None,
-        subject_template_name,
-        email_template_name,
-        context,
-        from_email,
-        to_email,
-        html_email_template_name,
-    )
+    # Same email as PasswordResetForm.send_mail, queued in the outbox
+    subject = render_to_string(subject_template_name, context)
+    subject = "".join(subject.splitlines())
+    body = render_to_string(email_template_name, context)
+    email = EmailMultiAlternatives(subject, body, from_email, [to_email])
+    if html_email_template_name is not None:
+        email.attach_alternative(
+            render_to_string(html_email_template_name, context), "text/html"
+        )
+    EmailOutbox.objects.enqueue(email)
 
-    logger.info(f"Sent password reset email to {to_email}.")
+    logger.info(f"Queued password reset email to {to_email}.")
 
 
 @shared_task(rate_limit="10/h")
-def send_email_export_data(user_pk):
-    from django.core import serializers
-
-    # Prepare the data for user in a json-like format
-
+def send_email_export_data(user_pk, site_base_url):
+    """
+    Write the data export archive of the user, and email them a link to
+    download it.
+    """
     user = get_user_model().objects.get(pk=user_pk)
-    rides_as_driver = user.rides_as_driver.all()
-    rides_as_rider = user.rides_as_rider.all()
-    rides = rides_as_driver | rides_as_rider
-    rides = rides.order_by("-start_dt")
-
-    serialized_users = serializers.serialize(
-        "json",
-        [user],
-        fields=[
-            "username",
-            "email",
-            "first_name",
-            "last_name",
-            "date_joined",
-            "last_login",
-            "email_verified",
-            "is_active",
-            "is_staff",
-            "is_superuser",
-        ],
-        use_natural_primary_keys=True,
+
+    start_time = time.time()
+    path = export.write_export(user)
+    logger.info(
+        f"Wrote the data export of {user.email} ({path.stat().st_size} bytes) "
+        f"in {time.time() - start_time:.2f}s."
     )
 
-    data = {
-        "user": json.loads(serialized_users)[0]["fields"],
-        "rides": {
-            "as_driver": json.loads(
-                serializers.serialize(
-                    "json",
-                    user.rides_as_driver.all(),
-                    fields=[
-                        "start_dt",
-                        "end_dt",
-                        "start_loc",
-                        "end_loc",
-                        "payment_method",
-                        "price",
-                        "comment",
-                        "steps",
-                    ],
+    with translation.override(user.preferred_language):
+        subject = "[INSAROULE] - " + _("Data export")
+        message = render_to_string(
+            "account/data_export_email.txt",
+            {
+                "user": user,
+                "link": site_base_url
+                + reverse(
+                    "accounts:export_download",
+                    kwargs={"token": export.make_download_token(user.pk)},
                 ),
-            ),
-            "as_rider": json.loads(
-                serializers.serialize(
-                    "json",
-                    user.rides_as_rider.all(),
-                    use_natural_primary_keys=True,
-                ),
-            ),
-        },
-    }
-
-    data_json = json.dumps(data, indent=4, ensure_ascii=False)
-
-    # Send the email with the data file attached to the email
-
-    subject = "[INSAROULE] - " + _("Data export")
-    message = render_to_string(
-        "account/data_export_email.txt",
-        {
-            "user": user,
-            "rides_count": rides.count(),
-        },
-    )
+                "max_age_days": settings.DATA_EXPORT_MAX_AGE // (24 * 3600),
+            },
+        )
 
-    email = EmailMessage(
-        subject,
-        message,
-        to=[user.email],
-    )
-    email.attach(
-        "data_export.json",
-        data_json,
-        "application/json",
-    )
+    EmailOutbox.objects.enqueue(EmailMessage(subject, message, to=[user.email]))
+    logger.info(f"Queued data export email to {user.email}.")
 
-    email.send()
 
-    logger.info(f"Sent data export email to {user.email}.")
+@shared_task
+def delete_expired_data_exports():
+    """Delete the data export archives whose download links have expired."""
+    deleted = export.delete_expired_exports()
+    logger.info(f"Deleted {deleted} expired data exports.")
 
 
 @shared_task
@@ -194,9 +152,13 @@ def send_forgot_username_email(
         },
     )
     email = EmailMessage(subject, message, to=[to_email])
-    email.send()
+    EmailOutbox.objects.enqueue(email)
 
-    logger.info(f"Sent forgot_username email to {to_email}.")
+    logger.info(f"Queued forgot_username email to {to_email}.")
+
+
+# Number of accounts deleted per transaction by delete_non_verified_accounts
+DELETE_BATCH_SIZE = 500
 
 
 @shared_task
@@ -206,13 +168,138 @@ def delete_non_verified_accounts():
     """
     logger.info("Deleting accounts whose email has not been verified for two weeks.")
 
-    for user in get_user_model().objects.all():
-        if not user.email_verified:
-            max_non_verified_time = timedelta(
-                days=settings.MAX_DAYS_NON_VERIFIED_ACCOUNT
+    start_time = time.time()
+    User = get_user_model()
+    cutoff = timezone.now() - timedelta(days=settings.MAX_DAYS_NON_VERIFIED_ACCOUNT)
+    pks = list(
+        User.objects.filter(email_verified=False, date_joined__lt=cutoff).values_list(
+            "pk", flat=True
+        )
+    )
+
+    deleted = 0
+    for i in range(0, len(pks), DELETE_BATCH_SIZE):
+        with transaction.atomic():
+            # Filtered again, in case an email was verified in the meantime
+            deleted += (
+                User.objects.filter(
+                    pk__in=pks[i : i + DELETE_BATCH_SIZE], email_verified=False
+                )
+                .delete()[1]
+                .get(User._meta.label, 0)
             )
-            if timezone.now() - user.date_joined > max_non_verified_time:
-                user.delete()
-                logger.info(
-                    "An account has been deleted since the email was not verified."
+
+    logger.info(
+        f"Deleted {deleted} non verified accounts in {time.time() - start_time:.2f}s."
+    )
+    return deleted
+
+
+# Outbox sending settings: emails claimed per run, how long a claimed email is
+# reserved to the worker (seconds), and the retries of the failed emails
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_LEASE = 10 * 60
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_BACKOFF_BASE = 60  # seconds, doubled at each attempt
+
+
+def take_domain_slot(domain):
+    """Count an email sent to `domain` this minute, return False above the limit.
+
+    The counters are kept in the Django cache, so the limit is shared by all
+    the workers using the same cache backend.
+    """
+    key = f"email_outbox:{domain}:{int(time.time() // 60)}"
+    cache.add(key, 0, 60)
+    try:
+        sent = cache.incr(key)
+    except ValueError:  # Expired in the meantime
+        sent = 1
+        cache.set(key, sent, 60)
+    return sent <= settings.EMAIL_OUTBOX_DOMAIN_RATE_LIMIT
+
+
+@shared_task
+def send_outbox_emails():
+    """
+    Send a batch of the pending emails of the outbox over a single SMTP
+    connection, and queue another run while there are emails left.
+    """
+    entries = EmailOutbox.objects.claim(
+        OUTBOX_BATCH_SIZE, timedelta(seconds=OUTBOX_LEASE)
+    )
+    if not entries:
+        return
+
+    start_time = time.time()
+    sent_pks = []
+    deferred = failed = 0
+    next_minute = timezone.now().replace(second=0, microsecond=0) + timedelta(minutes=1)
+
+    connection = get_connection()
+    try:
+        for entry in entries:
+            if not take_domain_slot(entry.domain):
+                # Throttled, sent next minute without counting an attempt
+                EmailOutbox.objects.filter(pk=entry.pk).update(
+                    next_attempt_at=next_minute
+                )
+                deferred += 1
+                continue
+
+            try:
+                connection.open()
+                connection.send_messages([entry.to_email_message()])
+            except Exception as e:
+                # The connection may be broken, it is opened again for the next email
+                connection.close()
+                failed += 1
+                attempts = entry.attempts + 1
+                logger.warning(
+                    f"Failed to send outbox email {entry.pk} "
+                    f"(attempt {attempts}/{OUTBOX_MAX_ATTEMPTS}): {e}"
+                )
+                EmailOutbox.objects.filter(pk=entry.pk).update(
+                    attempts=attempts,
+                    last_error=str(e),
+                    status=EmailOutbox.Status.FAILED
+                    if attempts >= OUTBOX_MAX_ATTEMPTS
+                    else EmailOutbox.Status.PENDING,
+                    next_attempt_at=timezone.now()
+                    + timedelta(seconds=OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1)),
                 )
+            else:
+                sent_pks.append(entry.pk)
+    finally:
+        connection.close()
+        if sent_pks:
+            EmailOutbox.objects.filter(pk__in=sent_pks).update(
+                status=EmailOutbox.Status.SENT,
+                sent_at=timezone.now(),
+                attempts=models.F("attempts") + 1,
+                last_error="",
+            )
+
+    duration = time.time() - start_time
+    logger.info(
+        f"Outbox: {len(sent_pks)} sent, {deferred} deferred, {failed} failed "
+        f"in {duration:.2f}s ({len(sent_pks) / max(duration, 0.001):.1f} emails/s)"
+    )
+
+    if len(entries) == OUTBOX_BATCH_SIZE:
+        send_outbox_emails.delay()
+
+
+@shared_task
+def delete_old_outbox_emails():
+    """Delete the sent and failed outbox emails kept past their retention period.
+
+    Their bodies hold personal data (links, chat messages), which must not be
+    kept longer than needed to investigate the delivery issues.
+    """
+    deleted = EmailOutbox.objects.expired(
+        sent_ttl=timedelta(days=settings.EMAIL_OUTBOX_SENT_RETENTION_DAYS),
+        failed_ttl=timedelta(days=settings.EMAIL_OUTBOX_FAILED_RETENTION_DAYS),
+    ).delete()[0]
+    logger.info(f"Deleted {deleted} old outbox emails.")
+    return deleted
@@ -1,12 +1,22 @@
+import os
+import tempfile
+import time
+from smtplib import SMTPException
+from unittest.mock import patch
+
 from django.utils import timezone
 from datetime import timedelta
-from django.test import TestCase
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage
+from django.test import TestCase, override_settings
 
 from accounts.tests.factories import UserFactory
 from django.contrib.auth import get_user_model
 from django.conf import settings
 
-from accounts import tasks
+from accounts import export, tasks
+from accounts.models import EmailOutbox
 
 
 class DeletingNonVerifiedAccountsTest(TestCase):
@@ -40,3 +50,169 @@ class DeletingNonVerifiedAccountsTest(TestCase):
         tasks.delete_non_verified_accounts()
         user = get_user_model().objects.filter(username="testuser")
         self.assertTrue(user.exists())
+
+    @patch("accounts.tasks.DELETE_BATCH_SIZE", 2)
+    def test_delete_non_verified_accounts_in_batches(self):
+        """Test that all the expired accounts are deleted, whatever the batch size."""
+        date_joined = timezone.now() - timedelta(
+            days=settings.MAX_DAYS_NON_VERIFIED_ACCOUNT + 1
+        )
+        for _i in range(5):
+            UserFactory(email_verified=False, date_joined=date_joined)
+        verified = UserFactory(email_verified=True, date_joined=date_joined)
+
+        self.assertEqual(tasks.delete_non_verified_accounts(), 5)
+        self.assertEqual(
+            list(get_user_model().objects.values_list("pk", flat=True)), [verified.pk]
+        )
+
+
+class SendForgotUsernameEmailTest(TestCase):
+    def test_email_queued_for_known_email(self):
+        user = UserFactory()
+        tasks.send_forgot_username_email(user.email)
+        self.assertEqual(
+            list(EmailOutbox.objects.values_list("to", flat=True)), [[user.email]]
+        )
+
+    def test_nothing_queued_for_unknown_email(self):
+        tasks.send_forgot_username_email("unknown@example.org")
+        self.assertFalse(EmailOutbox.objects.exists())
+
+
+class SendEmailExportDataTest(TestCase):
+    def test_export_written_and_link_queued(self):
+        user = UserFactory()
+        with tempfile.TemporaryDirectory() as export_root:
+            with override_settings(DATA_EXPORT_ROOT=export_root):
+                tasks.send_email_export_data(user.pk, "https://example.org")
+                self.assertTrue(export.export_path(user.pk).exists())
+
+        email = EmailOutbox.objects.get()
+        self.assertEqual(email.to, [user.email])
+        self.assertIn("https://example.org/", email.body)
+        self.assertFalse(email.html_body)
+
+
+class DataExportFilesTest(TestCase):
+    def setUp(self):
+        export_root = tempfile.TemporaryDirectory()
+        self.addCleanup(export_root.cleanup)
+        self.enterContext(override_settings(DATA_EXPORT_ROOT=export_root.name))
+
+    @patch("accounts.export.export_sections", side_effect=RuntimeError)
+    def test_failed_export_leaves_no_partial_archive(self, mock_sections):
+        user = UserFactory()
+        with self.assertRaises(RuntimeError):
+            export.write_export(user)
+
+        self.assertEqual(list(export.export_path(user.pk).parent.iterdir()), [])
+
+    def test_delete_expired_exports(self):
+        user = UserFactory()
+        path = export.write_export(user)
+        # Left by an export interrupted before it could clean up
+        tmp_path = export.export_path(UserFactory().pk).with_suffix(".tmp")
+        tmp_path.touch()
+
+        expired = time.time() - settings.DATA_EXPORT_MAX_AGE - 1
+        for expired_path in (path, tmp_path):
+            os.utime(expired_path, (expired, expired))
+        fresh_path = export.write_export(UserFactory())
+
+        self.assertEqual(export.delete_expired_exports(), 2)
+        self.assertEqual(list(path.parent.iterdir()), [fresh_path])
+
+
+class SendOutboxEmailsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def enqueue(self, to):
+        return EmailOutbox.objects.enqueue(EmailMessage("Subject", "Body", to=[to]))
+
+    def test_send_pending_emails(self):
+        entry = self.enqueue("someone@example.com")
+        tasks.send_outbox_emails()
+
+        self.assertEqual([email.to for email in mail.outbox], [["someone@example.com"]])
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, EmailOutbox.Status.SENT)
+        self.assertIsNotNone(entry.sent_at)
+
+        # Sent only once
+        tasks.send_outbox_emails()
+        self.assertEqual(len(mail.outbox), 1)
+
+    @patch(
+        "django.core.mail.backends.locmem.EmailBackend.send_messages",
+        side_effect=SMTPException("Connection refused"),
+    )
+    def test_failed_emails_are_retried(self, mock_send):
+        entry = self.enqueue("someone@example.com")
+        tasks.send_outbox_emails()
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, EmailOutbox.Status.PENDING)
+        self.assertEqual(entry.attempts, 1)
+        self.assertEqual(entry.last_error, "Connection refused")
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+
+        # Not due before the backoff
+        tasks.send_outbox_emails()
+        self.assertEqual(mock_send.call_count, 1)
+
+        EmailOutbox.objects.filter(pk=entry.pk).update(
+            attempts=tasks.OUTBOX_MAX_ATTEMPTS - 1, next_attempt_at=timezone.now()
+        )
+        tasks.send_outbox_emails()
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, EmailOutbox.Status.FAILED)
+
+    @override_settings(EMAIL_OUTBOX_DOMAIN_RATE_LIMIT=1)
+    def test_domain_rate_limit(self):
+        self.enqueue("first@example.com")
+        throttled = self.enqueue("second@example.com")
+        self.enqueue("someone@example.org")
+        tasks.send_outbox_emails()
+
+        self.assertEqual(
+            sorted(email.to[0] for email in mail.outbox),
+            ["first@example.com", "someone@example.org"],
+        )
+        throttled.refresh_from_db()
+        self.assertEqual(throttled.status, EmailOutbox.Status.PENDING)
+        self.assertEqual(throttled.attempts, 0)
+        self.assertGreater(throttled.next_attempt_at, timezone.now())
+
+
+class DeleteOldOutboxEmailsTest(TestCase):
+    def create(self, status, age_days):
+        date = timezone.now() - timedelta(days=age_days)
+        return EmailOutbox.objects.create(
+            to=["someone@example.com"],
+            subject="Subject",
+            body="Body",
+            domain="example.com",
+            status=status,
+            created_at=date,
+            sent_at=date if status == EmailOutbox.Status.SENT else None,
+        )
+
+    @override_settings(
+        EMAIL_OUTBOX_SENT_RETENTION_DAYS=7, EMAIL_OUTBOX_FAILED_RETENTION_DAYS=30
+    )
+    def test_delete_old_outbox_emails(self):
+        self.create(EmailOutbox.Status.SENT, 8)
+        self.create(EmailOutbox.Status.FAILED, 31)
+        kept = [
+            self.create(EmailOutbox.Status.SENT, 6),
+            self.create(EmailOutbox.Status.FAILED, 8),
+            self.create(EmailOutbox.Status.PENDING, 60),
+        ]
+
+        self.assertEqual(tasks.delete_old_outbox_emails(), 2)
+        self.assertEqual(
+            set(EmailOutbox.objects.values_list("pk", flat=True)),
+            {entry.pk for entry in kept},
+        )
@@ -1,11 +1,17 @@
+import io
+import tempfile
+import zipfile
 from unittest.mock import patch
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 from django.conf import settings
 
+from accounts import export
+from accounts.models import EmailOutbox
 from accounts.tests.factories import UserFactory
+from carpool.tests.factories import RideFactory
 
 
 class TestEmailVerify(TestCase):
@@ -19,22 +25,23 @@ class TestEmailVerify(TestCase):
         user.refresh_from_db()
         self.assertIsNotNone(user.last_verification_email_sent)
 
-    @patch("accounts.tasks.send_verification_email.delay")
-    def test_send_verification_email(self, mock_send):
+    def test_send_verification_email(self):
         """Test that the user can send email only if it has no cooldown."""
         user = UserFactory(email_verified=False)
         self.client.force_login(user)
 
         user.last_verification_email_sent = timezone.now()
         self.client.post(reverse("accounts:verify_email_send_token"))
-        self.assertTrue(mock_send.called)
+        self.assertEqual(
+            list(EmailOutbox.objects.values_list("to", flat=True)), [[user.email]]
+        )
 
         # Simulate a user with a cooldown period
         user.last_verification_email_sent = timezone.now()
         self.client.post(reverse("accounts:verify_email_send_token"))
         self.assertEqual(
-            mock_send.call_count, 1
-        )  # Should not call again if cooldown is active
+            EmailOutbox.objects.count(), 1
+        )  # Should not queue again if cooldown is active
 
 
 class TestLoginPreferredLanguage(TestCase):
@@ -117,4 +124,58 @@ class ForgotUsernameViewTest(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response.url, reverse("accounts:forgot_username_done"))
 
+        # Queued as for a known email, so the response does not tell them apart
         mock_send.assert_called_once_with(invalid_email)
+
+
+class DataExportViewTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.ride = RideFactory(driver=self.user)
+        export_root = tempfile.TemporaryDirectory()
+        self.addCleanup(export_root.cleanup)
+        self.enterContext(override_settings(DATA_EXPORT_ROOT=export_root.name))
+
+    def download_url(self, user_pk):
+        return reverse(
+            "accounts:export_download",
+            kwargs={"token": export.make_download_token(user_pk)},
+        )
+
+    def test_download_export(self):
+        export.write_export(self.user)
+        self.client.force_login(self.user)
+        r = self.client.get(self.download_url(self.user.pk))
+        self.assertEqual(r.status_code, 200)
+
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(r.streaming_content)))
+        self.assertEqual(
+            sorted(archive.namelist()),
+            [
+                "chat_messages.jsonl",
+                "profile.json",
+                "reservations.jsonl",
+                "rides.jsonl",
+                "vehicles.jsonl",
+            ],
+        )
+        self.assertIn(str(self.ride.pk), archive.read("rides.jsonl").decode())
+
+    def test_download_link_of_another_user(self):
+        other = UserFactory()
+        export.write_export(other)
+        self.client.force_login(self.user)
+        r = self.client.get(self.download_url(other.pk))
+        self.assertEqual(r.status_code, 404)
+
+    def test_download_invalid_or_expired_link(self):
+        export.write_export(self.user)
+        self.client.force_login(self.user)
+        r = self.client.get(
+            reverse("accounts:export_download", kwargs={"token": "invalid"})
+        )
+        self.assertEqual(r.status_code, 404)
+
+        with override_settings(DATA_EXPORT_MAX_AGE=-1):
+            r = self.client.get(self.download_url(self.user.pk))
+        self.assertEqual(r.status_code, 404)
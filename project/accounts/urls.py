@@ -22,6 +22,11 @@ urlpatterns = [
     path("delete/", profile.delete_profile, name="account_close"),
     path("email/change/", profile.email_change, name="email_change"),
     path("export/", profile.export, name="export"),
+    path(
+        "export/download/<str:token>/",
+        profile.export_download,
+        name="export_download",
+    ),
 ]
 
 # Email verification URLs
@@ -1,10 +1,15 @@
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.contrib.sites.shortcuts import get_current_site
+from django.core import signing
+from django.http import FileResponse, Http404
 from django.shortcuts import redirect, render
 from django.utils.translation import gettext as _
 from django.conf import settings
+from accounts import export as data_export
 from accounts.forms import EmailChangeForm, PasswordChangeForm
-# from accounts.tasks import send_email_export_data
+from accounts.tasks import send_email_export_data
+from carpool.models.ride import Ride
 
 from django.contrib.auth.views import PasswordChangeView as BasePasswordChangeView
 from django.urls import reverse_lazy
@@ -72,21 +77,38 @@ def email_change(request):
 def export(request):
     # Get all the rides for which the user is the driver
     # or has subscribed to
-    rides_as_driver = request.user.rides_as_driver.all()
-    rides_as_rider = request.user.rides_as_rider.all()
-
-    rides = rides_as_driver | rides_as_rider
-    rides = rides.order_by("-start_dt")
-    rides = [(ride.driver == request.user, ride) for ride in rides]
+    rides = Ride.objects.filter_user(request.user).order_by("-start_dt")
 
     if request.method == "POST":
-        # Trigger the task to send the email with the data export
-        # send_email_export_data.delay(request.user.pk)
-        # return redirect("accounts:me")
-        pass
-    # Get all the rides for which the user is the driver
+        # Trigger the task to send the email with the data export link
+        site_base_url = request.scheme + "://" + get_current_site(request).domain
+        send_email_export_data.delay(request.user.pk, site_base_url)
+        messages.success(
+            request,
+            _("Your data is being exported. You will receive an email with a link."),
+        )
+        return redirect("accounts:me")
+
     context = {
         "rides": rides,
         "dpo_email": settings.DPO_EMAIL,
     }
     return render(request, "account/data_export.html", context)
+
+
+@login_required
+def export_download(request, token):
+    """Download the data export archive of a signed, not expired, link."""
+    try:
+        user_pk = data_export.check_download_token(token)
+    except signing.BadSignature:
+        raise Http404("This link is invalid or has expired.")
+
+    # The link can only be used by the user whose data it is
+    path = data_export.export_path(user_pk)
+    if str(request.user.pk) != user_pk or not path.exists():
+        raise Http404("This link is invalid or has expired.")
+
+    return FileResponse(
+        path.open("rb"), as_attachment=True, filename="insaroule_data_export.zip"
+    )
@@ -5,6 +5,7 @@ from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib.sites.shortcuts import get_current_site
+from django.db import transaction
 from django.shortcuts import redirect, render
 from django.utils import timezone
 from django.utils.http import urlsafe_base64_decode
@@ -38,16 +39,17 @@ def verify_email_send_token(request):
     if request.method == "POST":
         # Send the verification email only if the user has no cooldown
 
-        send_verification_email.delay(
-            request.user.username,
-            request.user.pk,
-            request.user.email,
-            email_verify_token.make_token(request.user),
-            site_base_url=request.scheme + "://" + get_current_site(request).domain,
-        )
-
-        request.user.last_verification_email_sent = timezone.now()
-        request.user.save(update_fields=["last_verification_email_sent"])
+        with transaction.atomic():
+            send_verification_email(
+                request.user.username,
+                request.user.pk,
+                request.user.email,
+                email_verify_token.make_token(request.user),
+                site_base_url=request.scheme + "://" + get_current_site(request).domain,
+            )
+
+            request.user.last_verification_email_sent = timezone.now()
+            request.user.save(update_fields=["last_verification_email_sent"])
 
         return redirect("accounts:verify_email_sent")
 
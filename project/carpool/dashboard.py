@@ -0,0 +1,77 @@
+"""
+Snapshot of the back-office statistics, kept in the Django cache.
+
+The snapshot is rebuilt by compute_daily_statistics (and rebuild_statistics)
+and stored under a key holding its version, so the back-office views never
+query the statistics tables between two runs. The version is also used as the
+ETag of the views, letting the browsers revalidate with 304 responses.
+"""
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from carpool.models.statistics import MonthlyStatistics, Statistics
+
+VERSION_KEY = "statistics:snapshot:version"
+
+
+def snapshot_key(version):
+    return f"statistics:snapshot:{version}"
+
+
+def academic_year_months(now):
+    """(year, month) of the months of the current academic year, from September."""
+    start_year = now.year if now.month >= 9 else now.year - 1
+    return [(start_year, month) for month in range(9, 13)] + [
+        (start_year + 1, month) for month in range(1, 9)
+    ]
+
+
+def build_snapshot():
+    """Read the statistics tables and return the snapshot served by the views."""
+    statistics = Statistics.objects.get_solo()
+
+    months = academic_year_months(timezone.localtime())
+    monthly = {
+        (stat.year, stat.month): stat
+        for stat in MonthlyStatistics.objects.filter_by_academic_year(months[0][0])
+    }
+    monthly = [monthly.get(month) for month in months]
+
+    return {
+        "version": str(int(statistics.updated_at.timestamp() * 1_000_000)),
+        "updated_at": statistics.updated_at,
+        "totals": {
+            "total_users": statistics.total_users,
+            "total_rides": statistics.total_rides,
+            "total_distance": statistics.total_distance,
+            "total_co2": statistics.total_co2,
+        },
+        "monthly": {
+            "labels": [f"{month:02d}-{year}" for year, month in months],
+            "monthly_total_rides": [s.total_rides if s else 0 for s in monthly],
+            "monthly_total_users": [s.total_users if s else 0 for s in monthly],
+            "monthly_total_distance": [s.total_distance if s else 0 for s in monthly],
+            "monthly_total_co2": [s.total_co2 if s else 0 for s in monthly],
+        },
+    }
+
+
+def refresh_snapshot():
+    """Build a new snapshot and make it the current one."""
+    snapshot = build_snapshot()
+    previous_version = cache.get(VERSION_KEY)
+    cache.set(snapshot_key(snapshot["version"]), snapshot, None)
+    cache.set(VERSION_KEY, snapshot["version"], None)
+    if previous_version and previous_version != snapshot["version"]:
+        cache.delete(snapshot_key(previous_version))
+    return snapshot
+
+
+def get_snapshot():
+    """Return the current snapshot, built if the cache lost it."""
+    version = cache.get(VERSION_KEY)
+    snapshot = cache.get(snapshot_key(version)) if version else None
+    if snapshot is None:
+        snapshot = refresh_snapshot()
+    return snapshot
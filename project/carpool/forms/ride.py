@@ -1,14 +1,15 @@
 import datetime
 
 from django import forms
+from django.db import transaction
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.contrib.gis.geos import GEOSGeometry
 
 from carpool.models.ride import Ride
-from carpool.models import Step, Vehicle
+from carpool.models import Vehicle
 from carpool.mixins import BaseLocationMixin
-from carpool.utils import get_or_create_location
+from carpool.utils import get_or_create_locations
 from carpool.forms.location import LocationForm
 
 from django.conf import settings
@@ -169,34 +170,28 @@ class EditRideForm(forms.ModelForm):
         return valid and dep_valid and arr_valid
 
     def save(self, ride):
-        # Update or create departure location
-        d_data = self.departure.cleaned_data
-        departure = get_or_create_location(d_data)
-        ride.start_loc = departure
-
-        # Update or create arrival location
-        a_data = self.arrival.cleaned_data
-        arrival = get_or_create_location(a_data)
-        ride.end_loc = arrival
-
-        # Stopovers handling
-        ride.steps.clear()
-        for index, so_form in enumerate(self.stopovers.cleaned_data):
-            so_location = get_or_create_location(so_form)
-            step = Step.objects.create(order=index + 1, location=so_location)
-            ride.steps.add(step)
-
-        # Update ride fields
-        ride.geometry = self.cleaned_data["geometry"]
-        ride.duration = self.cleaned_data["duration"]
-        ride.start_dt = self.cleaned_data["start_dt"]
-        ride.end_dt = ride.start_dt + ride.duration
-        ride.price = self.cleaned_data["price"]
-        ride.comment = self.cleaned_data["comment"]
-        ride.payment_method = self.cleaned_data["payment_method"]
-        ride.seats_offered = self.cleaned_data["seats_offered"]
-
-        ride.save()
+        with transaction.atomic():
+            # Update or create the departure, arrival and stopovers locations at once
+            ride.start_loc, ride.end_loc, *stopovers = get_or_create_locations(
+                [
+                    self.departure.cleaned_data,
+                    self.arrival.cleaned_data,
+                    *self.stopovers.cleaned_data,
+                ]
+            )
+
+            # Update ride fields
+            ride.geometry = self.cleaned_data["geometry"]
+            ride.duration = self.cleaned_data["duration"]
+            ride.start_dt = self.cleaned_data["start_dt"]
+            ride.end_dt = ride.start_dt + ride.duration
+            ride.price = self.cleaned_data["price"]
+            ride.comment = self.cleaned_data["comment"]
+            ride.payment_method = self.cleaned_data["payment_method"]
+            ride.seats_offered = self.cleaned_data["seats_offered"]
+
+            ride.save()
+            Ride.objects.set_steps(ride, stopovers)
         return ride
 
 
@@ -0,0 +1,274 @@
+"""
+Local cache in front of the IGN autocompletion API.
+
+Lookups go through three layers, from the fastest to the slowest:
+- an in-process LRU cache of the last answered queries,
+- the GeocodingCacheEntry table, shared by all the processes,
+- a prefix index of the known addresses (our Location table and the past
+  results), used when enough known addresses start with the query.
+The API is only called by the caller when all of them miss.
+"""
+
+import bisect
+import itertools
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from carpool.models import Location
+from carpool.models.cache import GeocodingCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# Number of queries and time (in seconds) kept in the in-process cache
+MEMORY_CACHE_SIZE = 2048
+MEMORY_CACHE_TTL = 10 * 60
+# Time (in seconds) after which the prefix index is reloaded from the database
+PREFIX_INDEX_TTL = 60 * 60
+# Maximum number of addresses loaded from each source in the prefix index
+PREFIX_INDEX_MAX_ADDRESSES = 50000
+# The prefix index answers a query only if it knows at least this many matches
+PREFIX_INDEX_MIN_RESULTS = 5
+# Same as the default number of suggestions of the API
+MAX_RESULTS = 10
+# Shorter queries match too many addresses to be answered by the prefix index
+PREFIX_INDEX_MIN_QUERY_LENGTH = 3
+
+
+def normalize_query(text):
+    """Lowercase, remove accents and punctuation and collapse whitespaces.
+
+    The result is truncated to the length of the cache keys.
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[\W_]+", " ", text.lower()).split())[:255]
+
+
+def location_result(fulltext, street, city, zipcode, lat, lng):
+    """Build a result shaped like the ones of carpool.ign.parse_completion.
+
+    As in there, `value` is "lat/lng" while the custom properties latitude and
+    longitude hold the API x (longitude) and y (latitude).
+    """
+    return {
+        "fulltext": fulltext,
+        "value": f"{lat}/{lng}",
+        "customProperties": {
+            "street": street,
+            "city": city,
+            "zipcode": zipcode,
+            "latitude": lng,
+            "longitude": lat,
+        },
+    }
+
+
+def is_city(result):
+    return not result["customProperties"].get("street")
+
+
+class LRUCache:
+    """A thread safe least recently used cache whose items expire after `ttl` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class PrefixIndex:
+    """Known addresses searchable by the prefix of their normalized label.
+
+    Labels are kept in a sorted list, so a prefix search is a bisection
+    followed by a scan of the matching range. Street addresses are indexed
+    with and without their house number, "12 rue x" is found by "rue x".
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._results = {}
+        self._lock = threading.Lock()
+        self.loaded_at = None
+        self.loading = False
+
+    @staticmethod
+    def index_keys(result):
+        label = normalize_query(result["fulltext"])
+        number, _, rest = label.partition(" ")
+        if number.isdigit() and rest:
+            return [label, rest]
+        return [label]
+
+    def _add(self, result):
+        if result["fulltext"] in self._results:
+            return
+        self._results[result["fulltext"]] = result
+        for key in self.index_keys(result):
+            bisect.insort(self._keys, (key, result["fulltext"]))
+
+    def add(self, results):
+        with self._lock:
+            for result in results:
+                self._add(result)
+
+    def reset(self, results):
+        keys = []
+        by_fulltext = {}
+        for result in results:
+            if result["fulltext"] in by_fulltext:
+                continue
+            by_fulltext[result["fulltext"]] = result
+            keys.extend((key, result["fulltext"]) for key in self.index_keys(result))
+        # Sorting once is much faster than inserting the keys one by one
+        keys.sort()
+        with self._lock:
+            self._keys = keys
+            self._results = by_fulltext
+            self.loaded_at = time.monotonic()
+
+    def start_loading(self):
+        """Mark the index as being reloaded, return False if it already was."""
+        with self._lock:
+            if self.loading:
+                return False
+            self.loading = True
+            return True
+
+    def is_stale(self):
+        return self.loaded_at is None or (
+            time.monotonic() - self.loaded_at > PREFIX_INDEX_TTL
+        )
+
+    def search(self, prefix, limit=MAX_RESULTS):
+        """Return the results whose label starts with `prefix` (normalized)."""
+        matches = {}
+        with self._lock:
+            start = bisect.bisect_left(self._keys, (prefix,))
+            for key, fulltext in itertools.islice(self._keys, start, None):
+                if not key.startswith(prefix) or len(matches) >= limit:
+                    break
+                matches[fulltext] = self._results[fulltext]
+        # Cities first, like the API results
+        return sorted(matches.values(), key=lambda result: not is_city(result))
+
+
+memory_cache = LRUCache(MEMORY_CACHE_SIZE, MEMORY_CACHE_TTL)
+prefix_index = PrefixIndex()
+
+
+def get_cache_ttl():
+    return timedelta(days=settings.GEOCODING_CACHE_TTL_DAYS)
+
+
+def load_prefix_index():
+    """(Re)load the prefix index from the known locations and cached results."""
+    results = [
+        location_result(**location)
+        for location in Location.objects.order_by("-pk").values(
+            "fulltext", "street", "city", "zipcode", "lat", "lng"
+        )[:PREFIX_INDEX_MAX_ADDRESSES]
+    ]
+    for entry_results in (
+        GeocodingCacheEntry.objects.filter_fresh(get_cache_ttl())
+        .order_by("-last_used_at")
+        .values_list("results", flat=True)[:PREFIX_INDEX_MAX_ADDRESSES]
+    ):
+        results.extend(entry_results)
+    prefix_index.reset(results)
+
+
+def _load_prefix_index_in_background():
+    try:
+        load_prefix_index()
+    except Exception:
+        logger.exception("Failed to load the geocoding prefix index")
+    finally:
+        prefix_index.loading = False
+        # The thread has its own database connection, don't leak it
+        connection.close()
+
+
+def refresh_prefix_index():
+    """Reload the prefix index in a background thread, unless one already is.
+
+    Meanwhile the lookups keep searching the stale (or still empty) index,
+    loading it takes too long to be done while answering a request.
+    """
+    if prefix_index.start_loading():
+        threading.Thread(target=_load_prefix_index_in_background, daemon=True).start()
+
+
+def lookup_memory(text):
+    """Results of `text` if they are in the in-process cache, else None.
+
+    Does not touch the database, so it can be called from async code.
+    """
+    return memory_cache.get(normalize_query(text))
+
+
+def lookup(text):
+    """Results of `text` from the local caches, or None if the API must be called."""
+    query = normalize_query(text)
+    results = memory_cache.get(query)
+    if results is not None:
+        return results
+
+    entry = GeocodingCacheEntry.objects.get_fresh(query, get_cache_ttl())
+    if entry is not None:
+        memory_cache.set(query, entry.results)
+        return entry.results
+
+    if len(query) < PREFIX_INDEX_MIN_QUERY_LENGTH:
+        return None
+    if prefix_index.is_stale():
+        refresh_prefix_index()
+    results = prefix_index.search(query)
+    if len(results) >= PREFIX_INDEX_MIN_RESULTS:
+        memory_cache.set(query, results)
+        return results
+    return None
+
+
+def store(text, results):
+    """Save the API results of `text` in all the local caches."""
+    query = normalize_query(text)
+    now = timezone.now()
+    GeocodingCacheEntry.objects.update_or_create(
+        key=query,
+        defaults={"results": results, "created_at": now, "last_used_at": now},
+    )
+    memory_cache.set(query, results)
+    prefix_index.add(results)
@@ -0,0 +1,269 @@
+"""
+Async client for the IGN Géoplateforme APIs (data.geopf.fr).
+
+The autocompletion and routing API views call these functions directly from
+the event loop. Connections are pooled and kept alive in a client shared by
+all the requests of an event loop, and the calls are rate limited in-process
+by a token bucket per API, using the GEOCODAGE_TASK_RATE_LIMIT and
+ROUTING_TASK_RATE_LIMIT settings (per worker process).
+
+The routing calls go through a circuit breaker, shared by all the processes,
+so that an IGN outage fails fast instead of piling up slow requests. The
+transient routing errors are retried a few times with a short backoff, awaited
+so that the event loop keeps serving the other requests meanwhile.
+
+API doc: https://geoservices.ign.fr/documentation/services/services-geoplateforme
+"""
+
+import asyncio
+import time
+import weakref
+
+import httpx
+from django.conf import settings
+from django.core.cache import cache
+
+COMPLETION_URL = "https://data.geopf.fr/geocodage/completion/"
+ROUTING_URL = "https://data.geopf.fr/navigation/itineraire"
+
+COMPLETION_TIMEOUT = 5  # seconds
+ROUTING_TIMEOUT = 30  # seconds
+
+ROUTING_PROFILE = "car"
+ROUTING_OPTIMIZATION = "fastest"
+
+# Transient errors of the routing API, worth a retry
+ROUTING_TRANSIENT_STATUS_CODES = (502, 503, 504)
+ROUTING_MAX_RETRIES = 2
+ROUTING_BACKOFF_BASE = 0.5  # seconds, doubled on each retry
+ROUTING_UNAVAILABLE = {
+    "error": "IGN routing service unavailable",
+    "status_code": None,
+}
+
+# One client per event loop, as httpx clients cannot be shared between loops
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    """Return the HTTP client shared by the requests of the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+        _clients[loop] = client
+    return client
+
+
+def parse_rate(rate):
+    """Parse a Celery like rate limit ("50/s", "5/m", "100/h") in requests per second."""
+    count, _, unit = rate.partition("/")
+    period = {"s": 1, "m": 60, "h": 3600}[unit or "s"]
+    return float(count) / period
+
+
+class TokenBucket:
+    """Allow `rate` calls per second on average, with bursts of up to `rate` calls.
+
+    Only used from the event loop thread, so it does not need any lock.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    async def acquire(self):
+        """Wait until a call is allowed."""
+        self._refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= 1
+
+
+class CircuitBreaker:
+    """Fail fast once an API failed `threshold` times without any success.
+
+    The state is kept in the Django cache, so it is shared by all the processes
+    using the same cache backend. The circuit opens for `reset_timeout` seconds,
+    then the next calls reach the API again. Failures older than `reset_timeout`
+    seconds are forgotten.
+    """
+
+    def __init__(self, name, threshold, reset_timeout):
+        self.failures_key = f"ign:{name}:failures"
+        self.open_key = f"ign:{name}:open"
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+
+    def is_open(self):
+        return cache.get(self.open_key, False)
+
+    def record_success(self):
+        cache.delete(self.failures_key)
+
+    def record_failure(self):
+        cache.add(self.failures_key, 0, self.reset_timeout)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:  # Expired in the meantime
+            failures = 1
+            cache.set(self.failures_key, failures, self.reset_timeout)
+        if failures >= self.threshold:
+            cache.set(self.open_key, True, self.reset_timeout)
+            cache.delete(self.failures_key)
+
+    async def ais_open(self):
+        return await cache.aget(self.open_key, False)
+
+    async def arecord_success(self):
+        await cache.adelete(self.failures_key)
+
+    async def arecord_failure(self):
+        await cache.aadd(self.failures_key, 0, self.reset_timeout)
+        try:
+            failures = await cache.aincr(self.failures_key)
+        except ValueError:
+            failures = 1
+            await cache.aset(self.failures_key, failures, self.reset_timeout)
+        if failures >= self.threshold:
+            await cache.aset(self.open_key, True, self.reset_timeout)
+            await cache.adelete(self.failures_key)
+
+
+completion_bucket = TokenBucket(parse_rate(settings.GEOCODAGE_TASK_RATE_LIMIT))
+routing_bucket = TokenBucket(parse_rate(settings.ROUTING_TASK_RATE_LIMIT))
+routing_breaker = CircuitBreaker(
+    "routing",
+    threshold=settings.IGN_CIRCUIT_BREAKER_THRESHOLD,
+    reset_timeout=settings.IGN_CIRCUIT_BREAKER_RESET_TIMEOUT,
+)
+
+
+def completion_params(query):
+    return {"text": query, "terr": "METROPOLE", "type": "StreetAddress"}
+
+
+def parse_completion(query, data):
+    """Convert an autocompletion API response to the results sent to the widgets."""
+    result = []
+    for geocoding_result in (data or {}).get("results") or []:
+        content = {
+            "fulltext": geocoding_result["fulltext"],
+            "value": f"{geocoding_result['y']}/{geocoding_result['x']}",
+            "customProperties": {
+                "street": geocoding_result.get("street", ""),
+                "city": geocoding_result.get("city", ""),
+                "zipcode": geocoding_result.get("zipcode", ""),
+                "latitude": geocoding_result["x"],
+                "longitude": geocoding_result["y"],
+            },
+        }
+
+        # Prioritize exact city results matching the query
+        if geocoding_result.get("street", "") == "" and geocoding_result.get(
+            "city", ""
+        ).lower().startswith(query.lower()):
+            result.insert(0, content)
+        else:
+            result.append(content)
+    return result
+
+
+def routing_params(start, end, intermediates):
+    """
+    Args:
+        start (str): Starting point coordinates, format "lon,lat" (e.g. "-1.68365,48.110899")
+        end (str): Ending point coordinates, format "lon,lat" (e.g. "-1.466824,47.297116")
+        intermediates (list): Intermediate point coordinates, format ["lon,lat", ...].
+    """
+    return {
+        "resource": "bdtopo-osrm",
+        "start": start,
+        "end": end,
+        "intermediates": "|".join(intermediates) if intermediates else None,
+        "profile": ROUTING_PROFILE,
+        "optimization": ROUTING_OPTIMIZATION,
+        "geometryFormat": "geojson",
+        "getSteps": "true",
+        "getBbox": "true",
+        "distanceUnit": "kilometer",
+        "timeUnit": "hour",
+        "crs": "EPSG:4326",
+    }
+
+
+async def autocomplete(query):
+    """Return the autocompletion results of `query`.
+
+    Raises httpx.HTTPError if the API cannot be reached or fails.
+    """
+    await completion_bucket.acquire()
+    response = await get_client().get(
+        COMPLETION_URL, params=completion_params(query), timeout=COMPLETION_TIMEOUT
+    )
+    response.raise_for_status()
+    return parse_completion(query, response.json())
+
+
+async def route(start, end, intermediates):
+    """Return the routing API response (JSON) or error information.
+
+    The transient errors (timeouts, connection errors and 502/503/504
+    responses) are retried up to ROUTING_MAX_RETRIES times, unless the circuit
+    breaker opened in the meantime.
+    """
+    params = {
+        key: value
+        for key, value in routing_params(start, end, intermediates).items()
+        if value is not None
+    }
+    for attempt in range(ROUTING_MAX_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(ROUTING_BACKOFF_BASE * 2 ** (attempt - 1))
+        if await routing_breaker.ais_open():
+            return ROUTING_UNAVAILABLE
+
+        await routing_bucket.acquire()
+        try:
+            response = await get_client().get(
+                ROUTING_URL, params=params, timeout=ROUTING_TIMEOUT
+            )
+        except httpx.TransportError as e:
+            # Timeouts and connection errors
+            await routing_breaker.arecord_failure()
+            error = {"error": str(e), "status_code": None}
+            continue
+        except httpx.HTTPError as e:
+            await routing_breaker.arecord_failure()
+            return {"error": str(e), "status_code": None}
+
+        if response.status_code not in ROUTING_TRANSIENT_STATUS_CODES:
+            break
+        await routing_breaker.arecord_failure()
+        error = {
+            "error": "IGN routing service unavailable after retries",
+            "status_code": None,
+        }
+    else:
+        return error
+
+    await routing_breaker.arecord_success()
+    if response.status_code != 200:
+        return {
+            "error": "Failed to fetch routing information",
+            "status_code": response.status_code,
+            "details": response.text,
+        }
+    return response.json()
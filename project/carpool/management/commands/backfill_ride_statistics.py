@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from carpool.models.ride import Ride
+
+
+class Command(BaseCommand):
+    help = "Compute the stored distance and CO2 saved of the rides missing them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Also recompute the rides that already have them",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of rides updated per query",
+        )
+
+    def handle(self, *args, **options):
+        # Rides counted in the statistics are recomputed by rebuild_statistics
+        rides = Ride.objects.filter(counted_in_statistics=False)
+        if not options["all"]:
+            rides = rides.filter(distance_km__isnull=True)
+
+        pks = list(rides.order_by("pk").values_list("pk", flat=True))
+        batch_size = options["batch_size"]
+        for i in range(0, len(pks), batch_size):
+            Ride.objects.filter(pk__in=pks[i : i + batch_size]).refresh_statistics()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Computed the statistics of {len(pks)} rides.")
+        )
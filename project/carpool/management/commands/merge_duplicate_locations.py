@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, Value, When
+
+from carpool.models import Location, Step, location_hash
+from carpool.models.ride import Ride
+
+
+def repoint(queryset, field, duplicates):
+    """Point `field` of the rows of `queryset` to the kept locations."""
+    return queryset.filter(**{f"{field}__in": duplicates}).update(
+        **{
+            field: Case(
+                *[
+                    When(**{field: duplicate}, then=Value(kept))
+                    for duplicate, kept in duplicates.items()
+                ]
+            )
+        }
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Set the address hash of the locations missing it, and merge the "
+        "duplicate locations into the first one with the same hash"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of locations handled per transaction",
+        )
+
+    def handle(self, *args, **options):
+        pks = list(
+            Location.objects.filter(address_hash__isnull=True)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+
+        merged = 0
+        batch_size = options["batch_size"]
+        for i in range(0, len(pks), batch_size):
+            with transaction.atomic():
+                locations = list(
+                    Location.objects.filter(pk__in=pks[i : i + batch_size])
+                )
+                for location in locations:
+                    location.address_hash = location_hash(
+                        location.fulltext,
+                        location.street,
+                        location.zipcode,
+                        location.city,
+                        location.lat,
+                        location.lng,
+                    )
+                kept = dict(
+                    Location.objects.filter(
+                        address_hash__in={
+                            location.address_hash for location in locations
+                        }
+                    ).values_list("address_hash", "pk")
+                )
+
+                # The first location of each hash is kept, the others are merged into it
+                hashed = []
+                duplicates = {}
+                for location in locations:
+                    if location.address_hash in kept:
+                        duplicates[location.pk] = kept[location.address_hash]
+                    else:
+                        kept[location.address_hash] = location.pk
+                        hashed.append(location)
+
+                Location.objects.bulk_update(hashed, ["address_hash"])
+                if duplicates:
+                    repoint(Ride.objects.all(), "start_loc", duplicates)
+                    repoint(Ride.objects.all(), "end_loc", duplicates)
+                    repoint(Step.objects.all(), "location", duplicates)
+                    Location.objects.filter(pk__in=duplicates).delete()
+                merged += len(duplicates)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Hashed {len(pks) - merged} locations and merged {merged} duplicates."
+            )
+        )
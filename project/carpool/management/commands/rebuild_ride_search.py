@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from carpool.models.ride import Ride
+from carpool.models.search import RideSearchEntry
+
+
+class Command(BaseCommand):
+    help = "Rebuild the ride search entries used by the rides list and map"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Also rebuild the entries of past rides",
+        )
+
+    def handle(self, *args, **options):
+        rides = Ride.objects.all()
+        if not options["all"]:
+            rides = rides.filter_upcoming()
+
+        RideSearchEntry.objects.refresh_rides(rides)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt {rides.count()} ride search entries.")
+        )
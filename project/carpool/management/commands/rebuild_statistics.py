@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from carpool import dashboard
+from carpool.models.ride import Ride
+from carpool.models.statistics import MonthlyStatistics, Statistics
+
+
+class Command(BaseCommand):
+    help = "Recompute the statistics of some months, then the overall statistics"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "months",
+            nargs="*",
+            metavar="YYYY-MM",
+            help="Months to rebuild",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Rebuild every month with rides",
+        )
+
+    def handle(self, *args, **options):
+        if options["all"]:
+            months = (
+                Ride.objects.annotate(
+                    year=ExtractYear("start_dt"), month=ExtractMonth("start_dt")
+                )
+                .values_list("year", "month")
+                .distinct()
+                .order_by("year", "month")
+            )
+        elif options["months"]:
+            try:
+                months = [
+                    tuple(int(part) for part in month.split("-"))
+                    for month in options["months"]
+                ]
+            except ValueError as e:
+                raise CommandError("Months must be given as YYYY-MM.") from e
+            if any(len(month) != 2 or not 1 <= month[1] <= 12 for month in months):
+                raise CommandError("Months must be given as YYYY-MM.")
+        else:
+            raise CommandError("Give the months to rebuild, or --all.")
+
+        for year, month in months:
+            statistics = MonthlyStatistics.objects.rebuild(year, month)
+            self.stdout.write(
+                f"{year}-{month:02d}: {statistics.total_rides} rides, "
+                f"{statistics.total_distance:.2f} km, {statistics.total_co2:.2f} kg CO2"
+            )
+        Statistics.objects.rebuild()
+        dashboard.refresh_snapshot()
+
+        self.stdout.write(self.style.SUCCESS("Rebuilt the statistics."))
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.13 on 2026-10-18 19:33
+
+import django.contrib.gis.db.models.fields
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("carpool", "0011_alter_ride_payment_method"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="ride",
+            index=django.contrib.postgres.indexes.GistIndex(
+                django.db.models.functions.comparison.Cast(
+                    "geometry",
+                    django.contrib.gis.db.models.fields.LineStringField(
+                        geography=True, srid=4326
+                    ),
+                ),
+                name="carpool_ride_geography_idx",
+            ),
+        ),
+    ]
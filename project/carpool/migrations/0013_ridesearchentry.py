@@ -0,0 +1,172 @@
+# Generated by Django 5.2.13 on 2026-10-18 19:35
+
+import django.contrib.gis.db.models.fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+import django.db.models.functions.comparison
+import multiselectfield.db.fields
+from django.contrib.gis.geos import Point
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def populate_search_entries(apps, schema_editor):
+    Ride = apps.get_model("carpool", "Ride")
+    RideSearchEntry = apps.get_model("carpool", "RideSearchEntry")
+
+    entries = []
+    rides = Ride.objects.select_related("start_loc", "end_loc", "driver")
+    for ride in rides.iterator(chunk_size=500):
+        booked_seats = ride.rider.count()
+        values = {}
+        for prefix, location in (("start", ride.start_loc), ("end", ride.end_loc)):
+            values[f"{prefix}_point"] = (
+                Point(float(location.lng), float(location.lat), srid=4326)
+                if location
+                else None
+            )
+            values[f"{prefix}_fulltext"] = location.fulltext if location else ""
+            values[f"{prefix}_city"] = location.city if location else ""
+        entries.append(
+            RideSearchEntry(
+                ride=ride,
+                start_dt=ride.start_dt,
+                end_dt=ride.end_dt,
+                start_date=timezone.localdate(ride.start_dt) if ride.start_dt else None,
+                duration=ride.duration,
+                steps_count=ride.steps.count(),
+                seats_offered=ride.seats_offered,
+                booked_seats=booked_seats,
+                remaining_seats=ride.seats_offered - booked_seats,
+                price=ride.price,
+                payment_method=ride.payment_method,
+                geometry=ride.geometry.simplify(1e-4, preserve_topology=True)
+                if ride.geometry
+                else None,
+                driver_name=ride.driver.username,
+                **values,
+            )
+        )
+    RideSearchEntry.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("carpool", "0012_ride_geography_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RideSearchEntry",
+            fields=[
+                (
+                    "ride",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="search_entry",
+                        serialize=False,
+                        to="carpool.ride",
+                        verbose_name="ride",
+                    ),
+                ),
+                (
+                    "start_dt",
+                    models.DateTimeField(null=True, verbose_name="start date and time"),
+                ),
+                (
+                    "end_dt",
+                    models.DateTimeField(null=True, verbose_name="end date and time"),
+                ),
+                ("start_date", models.DateField(null=True, verbose_name="start date")),
+                ("duration", models.DurationField(null=True, verbose_name="duration")),
+                (
+                    "start_point",
+                    django.contrib.gis.db.models.fields.PointField(
+                        null=True, srid=4326, verbose_name="start point"
+                    ),
+                ),
+                (
+                    "start_fulltext",
+                    models.CharField(max_length=100, verbose_name="start label"),
+                ),
+                (
+                    "start_city",
+                    models.CharField(max_length=100, verbose_name="start city"),
+                ),
+                (
+                    "end_point",
+                    django.contrib.gis.db.models.fields.PointField(
+                        null=True, srid=4326, verbose_name="end point"
+                    ),
+                ),
+                (
+                    "end_fulltext",
+                    models.CharField(max_length=100, verbose_name="end label"),
+                ),
+                ("end_city", models.CharField(max_length=100, verbose_name="end city")),
+                (
+                    "steps_count",
+                    models.PositiveIntegerField(default=0, verbose_name="steps"),
+                ),
+                (
+                    "seats_offered",
+                    models.PositiveIntegerField(verbose_name="seats offered"),
+                ),
+                (
+                    "booked_seats",
+                    models.PositiveIntegerField(verbose_name="booked seats"),
+                ),
+                (
+                    "remaining_seats",
+                    models.IntegerField(verbose_name="remaining seats"),
+                ),
+                ("price", models.FloatField(null=True, verbose_name="price")),
+                (
+                    "payment_method",
+                    multiselectfield.db.fields.MultiSelectField(
+                        blank=True,
+                        choices=[
+                            ("CASH", "Cash"),
+                            ("LYF", "Lyf Pay"),
+                            ("WIRE", "Wire Transfer"),
+                            ("LYDIA", "Lydia"),
+                        ],
+                        max_length=100,
+                        verbose_name="payment method",
+                    ),
+                ),
+                (
+                    "geometry",
+                    django.contrib.gis.db.models.fields.LineStringField(
+                        null=True, srid=4326, verbose_name="simplified geometry"
+                    ),
+                ),
+                (
+                    "driver_name",
+                    models.CharField(max_length=150, verbose_name="driver"),
+                ),
+            ],
+            options={
+                "verbose_name": "Ride search entry",
+                "verbose_name_plural": "Ride search entries",
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("remaining_seats__gt", 0)),
+                        fields=["start_date", "start_dt"],
+                        name="carpool_search_available_idx",
+                    ),
+                    django.contrib.postgres.indexes.GistIndex(
+                        django.db.models.functions.comparison.Cast(
+                            "geometry",
+                            django.contrib.gis.db.models.fields.LineStringField(
+                                geography=True, srid=4326
+                            ),
+                        ),
+                        name="carpool_search_geography_idx",
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(populate_search_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.13 on 2026-10-18 19:41
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("carpool", "0013_ridesearchentry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GeocodingCacheEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "key",
+                    models.CharField(max_length=255, unique=True, verbose_name="key"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="created at"
+                    ),
+                ),
+                (
+                    "last_used_at",
+                    models.DateTimeField(
+                        db_index=True,
+                        default=django.utils.timezone.now,
+                        verbose_name="last used at",
+                    ),
+                ),
+                ("hits", models.PositiveIntegerField(default=0, verbose_name="hits")),
+                ("results", models.JSONField(default=list, verbose_name="results")),
+            ],
+            options={
+                "verbose_name": "Geocoding cache entry",
+                "verbose_name_plural": "Geocoding cache entries",
+            },
+        ),
+    ]
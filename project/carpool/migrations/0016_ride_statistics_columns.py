@@ -0,0 +1,63 @@
+# Generated by Django 5.2.13 on 2026-10-18 19:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def reset_statistics(apps, schema_editor):
+    """The rides are now added to the statistics once counted.
+
+    Reset the totals so the next daily run counts all the past rides once,
+    instead of adding them to the totals they are already part of.
+    """
+    totals = {"total_rides": 0, "total_distance": 0.0, "total_co2": 0.0}
+    apps.get_model("carpool", "Statistics").objects.update(**totals)
+    apps.get_model("carpool", "MonthlyStatistics").objects.update(**totals)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("carpool", "0015_routecacheentry"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ride",
+            name="co2_saved_kg",
+            field=models.FloatField(
+                blank=True,
+                help_text="CO2 saved by the riders, stored when the ride is counted",
+                null=True,
+                verbose_name="CO2 saved (kg)",
+            ),
+        ),
+        migrations.AddField(
+            model_name="ride",
+            name="counted_in_statistics",
+            field=models.BooleanField(
+                default=False,
+                help_text="Whether the ride is included in the statistics",
+                verbose_name="counted in statistics",
+            ),
+        ),
+        migrations.AddField(
+            model_name="ride",
+            name="distance_km",
+            field=models.FloatField(
+                blank=True,
+                help_text="Length of the route, stored when the ride is counted",
+                null=True,
+                verbose_name="distance (km)",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ride",
+            index=models.Index(
+                condition=models.Q(("counted_in_statistics", False)),
+                fields=["end_dt"],
+                name="carpool_ride_uncounted_idx",
+            ),
+        ),
+        migrations.RunPython(reset_statistics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.13 on 2026-10-18 19:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("carpool", "0016_ride_statistics_columns"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="ride",
+            name="co2_saved_kg",
+            field=models.FloatField(
+                blank=True,
+                help_text="CO2 saved by the riders, kept up to date when the ride changes",
+                null=True,
+                verbose_name="CO2 saved (kg)",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="ride",
+            name="distance_km",
+            field=models.FloatField(
+                blank=True,
+                help_text="Length of the route, kept up to date when the ride changes",
+                null=True,
+                verbose_name="distance (km)",
+            ),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.13 on 2026-10-18 20:18
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_seats_remaining(apps, schema_editor):
+    Ride = apps.get_model("carpool", "Ride")
+    riders = (
+        Ride.rider.through.objects.filter(ride=OuterRef("pk"))
+        .values("ride")
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    Ride.objects.update(
+        seats_remaining=F("seats_offered") - Coalesce(Subquery(riders), 0)
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("carpool", "0017_ride_statistics_help_texts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ride",
+            name="seats_remaining",
+            field=models.IntegerField(
+                default=1,
+                editable=False,
+                help_text="Seats offered minus the riders, kept up to date by the bookings",
+                verbose_name="seats remaining",
+            ),
+        ),
+        migrations.RunPython(count_seats_remaining, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.13 on 2026-10-18 20:21
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("carpool", "0018_ride_seats_remaining"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="location",
+            name="address_hash",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                help_text="Hash of the normalized address and rounded coordinates, used to reuse the existing locations",
+                max_length=64,
+                null=True,
+                unique=True,
+                verbose_name="address hash",
+            ),
+        ),
+        migrations.AddField(
+            model_name="location",
+            name="point",
+            field=django.contrib.gis.db.models.fields.PointField(
+                blank=True,
+                editable=False,
+                help_text="Geographical point of the location, set from its coordinates",
+                null=True,
+                srid=4326,
+                verbose_name="point",
+            ),
+        ),
+        # The address hashes are set by the merge_duplicate_locations command
+        migrations.RunSQL(
+            "UPDATE carpool_location SET point = ST_SetSRID(ST_MakePoint(lng, lat), 4326)",
+            migrations.RunSQL.noop,
+        ),
+    ]
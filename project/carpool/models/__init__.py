@@ -1,7 +1,26 @@
+import hashlib
+
+from django.contrib.gis.db import models
+from django.contrib.gis.geos import Point
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
 from django.utils.translation import gettext_lazy as _
 
+# Decimal places of the coordinates in the location hashes (~1 m)
+LOCATION_HASH_PRECISION = 5
+
+
+def location_hash(fulltext, street, zipcode, city, lat, lng):
+    """Hash of a location, the same for the addresses differing by case or spaces."""
+    parts = [
+        " ".join(str(part or "").split()).casefold()
+        for part in (fulltext, street, zipcode, city)
+    ]
+    parts += [
+        f"{float(lat):.{LOCATION_HASH_PRECISION}f}",
+        f"{float(lng):.{LOCATION_HASH_PRECISION}f}",
+    ]
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
 
 class Location(models.Model):
     fulltext = models.CharField(
@@ -43,12 +62,48 @@ class Location(models.Model):
         validators=[MinValueValidator(-180), MaxValueValidator(180)],
     )
 
+    point = models.PointField(
+        verbose_name=_("point"),
+        help_text=_("Geographical point of the location, set from its coordinates"),
+        srid=4326,  # WGS84
+        null=True,
+        blank=True,
+        editable=False,
+    )
+
+    address_hash = models.CharField(
+        verbose_name=_("address hash"),
+        help_text=_(
+            "Hash of the normalized address and rounded coordinates, "
+            "used to reuse the existing locations"
+        ),
+        max_length=64,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+    )
+
+    def save(self, *args, **kwargs):
+        self.point = Point(float(self.lng), float(self.lat), srid=4326)
+        # So the locations created here are also found by get_or_create_location
+        self.address_hash = location_hash(
+            self.fulltext, self.street, self.zipcode, self.city, self.lat, self.lng
+        )
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return (
             f"Location({self.fulltext if self.fulltext else f'{self.lat}, {self.lng}'})"
         )
 
 
+class StepQuerySet(models.QuerySet):
+    def orphaned(self):
+        """Steps no longer attached to any ride."""
+        return self.filter(rides__isnull=True)
+
+
 class Step(models.Model):
     location = models.ForeignKey(
         verbose_name=_("localisation"),
@@ -63,6 +118,8 @@ class Step(models.Model):
         validators=[MinValueValidator(1)],
     )
 
+    objects = StepQuerySet.as_manager()
+
     def __str__(self):
         return f"Step({self.location}, order={self.order})"
 
@@ -0,0 +1,80 @@
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class CacheEntryQuerySet(models.QuerySet):
+    def filter_fresh(self, ttl):
+        """Entries created less than `ttl` (a timedelta) ago."""
+        return self.filter(created_at__gte=timezone.now() - ttl)
+
+
+class CacheEntryManager(models.Manager.from_queryset(CacheEntryQuerySet)):
+    def get_fresh(self, key, ttl):
+        """Return the fresh entry stored under `key` and mark it as used, or None."""
+        entry = self.filter_fresh(ttl).filter(key=key).first()
+        if entry is not None:
+            self.filter(pk=entry.pk).update(
+                last_used_at=timezone.now(), hits=models.F("hits") + 1
+            )
+        return entry
+
+    def evict(self, ttl, max_entries):
+        """Delete expired entries, then the least recently used above `max_entries`.
+
+        Returns the number of deleted entries.
+        """
+        deleted = self.filter(created_at__lt=timezone.now() - ttl).delete()[0]
+        overflow = list(
+            self.order_by("-last_used_at").values_list("pk", flat=True)[max_entries:]
+        )
+        if overflow:
+            deleted += self.filter(pk__in=overflow).delete()[0]
+        return deleted
+
+
+class CacheEntry(models.Model):
+    """Base model of the persistent caches in front of the IGN APIs."""
+
+    key = models.CharField(verbose_name=_("key"), max_length=255, unique=True)
+
+    created_at = models.DateTimeField(
+        verbose_name=_("created at"),
+        default=timezone.now,
+    )
+
+    last_used_at = models.DateTimeField(
+        verbose_name=_("last used at"),
+        default=timezone.now,
+        db_index=True,
+    )
+
+    hits = models.PositiveIntegerField(verbose_name=_("hits"), default=0)
+
+    objects = CacheEntryManager()
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.key})"
+
+
+class GeocodingCacheEntry(CacheEntry):
+    """Autocompletion results of a normalized address query."""
+
+    results = models.JSONField(verbose_name=_("results"), default=list)
+
+    class Meta:
+        verbose_name = _("Geocoding cache entry")
+        verbose_name_plural = _("Geocoding cache entries")
+
+
+class RouteCacheEntry(CacheEntry):
+    """Routing API response of rounded waypoints, as zlib compressed JSON."""
+
+    response = models.BinaryField(verbose_name=_("response"))
+
+    class Meta:
+        verbose_name = _("Route cache entry")
+        verbose_name_plural = _("Route cache entries")
@@ -1,16 +1,170 @@
 from uuid import uuid4
 
+from django.conf import settings
 from django.contrib.gis.db import models
+from django.contrib.gis.db.models.functions import Length, LineLocatePoint
+from django.contrib.gis.measure import D
+from django.contrib.postgres.indexes import GistIndex
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import (
+    Case,
+    Count,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    OuterRef,
+    Prefetch,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, Coalesce
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from multiselectfield import MultiSelectField
 
+from carpool.models import Step, Vehicle
 
-class RideManager(models.Manager):
+
+def geography(field_name):
+    """Cast a WGS84 LineString column to geography.
+
+    Distances on geography are expressed in meters, and the expression matches
+    the functional GiST index declared on the model so ST_DWithin can use it.
+    """
+    return Cast(field_name, models.LineStringField(geography=True, srid=4326))
+
+
+def riders_count():
+    """Number of riders of the ride of the outer query."""
+    return Coalesce(
+        Subquery(
+            Ride.rider.through.objects.filter(ride=OuterRef("pk"))
+            .values("ride")
+            .annotate(count=Count("*"))
+            .values("count")
+        ),
+        0,
+    )
+
+
+def co2_saved_kg(distance_km):
+    """CO2 saved by the riders of the ride of the outer query, over `distance_km`."""
+    vehicle_co2_per_km = Vehicle.objects.filter(pk=OuterRef("vehicle")).values(
+        co2_per_km=Case(
+            When(
+                Q(geqCO2_per_km__isnull=True) | Q(geqCO2_per_km=0),
+                then=Value(settings.AVERAGE_CO2_EMISSION_PER_KM),
+            ),
+            default=F("geqCO2_per_km"),
+            output_field=FloatField(),
+        )
+    )
+    return ExpressionWrapper(
+        riders_count() * distance_km * Subquery(vehicle_co2_per_km) / 1000,
+        output_field=FloatField(),
+    )
+
+
+class RideQuerySet(models.QuerySet):
+    def filter_upcoming(self):
+        """
+        Function to filter upcoming rides.
+        An upcoming ride is defined as a ride that starts today or in the future.
+        (date part only, time is ignored)
+        """
+        return self.filter(
+            start_dt__date__gte=timezone.now().date(),
+        )
+
+    def filter_user(self, user):
+        """Rides driven or joined by `user`, annotated with is_driver."""
+        return self.filter(
+            Q(driver=user) | Q(pk__in=user.rides_as_rider.values("pk"))
+        ).annotate(
+            is_driver=Case(When(driver=user, then=Value(True)), default=Value(False))
+        )
+
+    def with_card_data(self):
+        """Fetch everything the ride card displays along with the rides."""
+        return self.select_related("start_loc", "end_loc").annotate(
+            steps_count=Count("steps", distinct=True),
+            booked_seats_count=Count("rider", distinct=True),
+        )
+
+    def with_detail_data(self):
+        """Fetch everything the ride detail page displays along with the rides."""
+        return self.select_related(
+            "driver", "vehicle", "start_loc", "end_loc"
+        ).prefetch_related(
+            "rider",
+            Prefetch(
+                "steps",
+                queryset=Step.objects.select_related("location").order_by("order"),
+            ),
+        )
+
+    def refresh_statistics(self):
+        """Recompute the stored distance_km and co2_saved_kg of the rides.
+
+        Runs a single UPDATE. The spheroid length of the route is expensive, so
+        it is computed when a ride is written rather than when it is read.
+        """
+        distance_km = Length("geometry", spheroid=True) / 1000.0
+        return self.update(
+            distance_km=distance_km, co2_saved_kg=co2_saved_kg(distance_km)
+        )
+
+    def refresh_co2(self):
+        """Recompute the stored co2_saved_kg of the rides from their riders.
+
+        Only the riders changed, so the stored distance_km is reused instead of
+        computing the spheroid length of the route again.
+        """
+        return self.update(co2_saved_kg=co2_saved_kg(F("distance_km")))
+
+    def refresh_seats_remaining(self):
+        """Recompute the stored seats_remaining of the rides from their riders.
+
+        The rides are locked before counting their riders, so that the count
+        includes the seats booked concurrently by RideManager.book_seat.
+        """
+        with transaction.atomic():
+            list(self.select_for_update().values_list("pk", flat=True))
+            return self.update(seats_remaining=F("seats_offered") - riders_count())
+
+    def filter_corridor(self, departure=None, arrival=None, radius=None):
+        """Filter rides whose route passes near the given points.
+
+        `departure` and `arrival` are WGS84 points, either can be omitted.
+        A ride matches if its geometry passes within `radius` (defaults to
+        RIDE_SEARCH_RADIUS_KM) of each given point. When both points are given,
+        the departure must also be projected before the arrival along the route,
+        so rides going the opposite way are excluded.
+        """
+        if radius is None:
+            radius = D(km=settings.RIDE_SEARCH_RADIUS_KM)
+
+        rides = self.alias(geography=geography("geometry"))
+        if departure is not None:
+            rides = rides.filter(geography__dwithin=(departure, radius))
+        if arrival is not None:
+            rides = rides.filter(geography__dwithin=(arrival, radius))
+
+        if departure is not None and arrival is not None:
+            # Only evaluated on the rides kept by the indexed predicates above
+            rides = rides.alias(
+                departure_fraction=LineLocatePoint("geometry", departure),
+                arrival_fraction=LineLocatePoint("geometry", arrival),
+            ).filter(departure_fraction__lt=F("arrival_fraction"))
+        return rides
+
+
+class RideManager(models.Manager.from_queryset(RideQuerySet)):
     def count_shared_ride(self, user1, user2):
         """Return the number of rides shared between two users.
         A ride is "shared" if:
@@ -31,6 +185,77 @@ class RideManager(models.Manager):
             .count()
         )
 
+    def book_seat(self, ride, user):
+        """Add `user` to the riders of `ride` if a seat is left.
+
+        The seat is taken by a single conditional UPDATE of the stored
+        seats_remaining, which locks the ride until the end of the transaction,
+        so concurrent bookings cannot overbook it. Returns whether the seat was
+        booked.
+
+        The rider is inserted directly in the through table: rider.add would
+        send m2m_changed, whose handler recounts the seats remaining under a
+        lock although the UPDATE above already took the seat. Only the search
+        entry and the CO2 saved are refreshed then.
+        """
+        from carpool.models.search import RideSearchEntry
+
+        with transaction.atomic():
+            booked = self.filter(pk=ride.pk, seats_remaining__gt=0).update(
+                seats_remaining=F("seats_remaining") - 1
+            )
+            if booked:
+                Ride.rider.through.objects.create(ride=ride, user=user)
+                # As rider.add does, drop the riders prefetched on the instance
+                getattr(ride, "_prefetched_objects_cache", {}).pop("rider", None)
+                ride.refresh_from_db(fields=["seats_remaining"])
+                RideSearchEntry.objects.refresh(ride)
+                if not ride.counted_in_statistics:
+                    self.filter(pk=ride.pk).refresh_co2()
+        return bool(booked)
+
+    def set_steps(self, ride, locations):
+        """Make `locations` the steps of `ride`, in this order.
+
+        The current steps are diffed against the new ones: the unchanged steps
+        are kept, the new ones are created at once with bulk_create and the
+        removed ones are deleted, so that no orphaned step is left behind.
+        """
+        wanted = [(order, location.pk) for order, location in enumerate(locations, 1)]
+        with transaction.atomic():
+            current = {
+                (step.order, step.location_id): step for step in ride.steps.all()
+            }
+            removed = [step for key, step in current.items() if key not in wanted]
+            added = [
+                Step(order=order, location_id=location_pk)
+                for order, location_pk in wanted
+                if (order, location_pk) not in current
+            ]
+
+            if removed:
+                ride.steps.remove(*removed)
+                Step.objects.filter(
+                    pk__in=[step.pk for step in removed]
+                ).orphaned().delete()
+            if added:
+                Step.objects.bulk_create(added)
+                ride.steps.add(*added)
+
+    def count_in_statistics(self, rides):
+        """Mark `rides` as counted in the statistics.
+
+        Their stored distance and CO2 saved are computed first if missing.
+        Returns the stored values of each ride, as dicts with the start_dt,
+        distance_km and co2_saved_kg keys.
+        """
+        rides.filter(distance_km__isnull=True).refresh_statistics()
+        values = list(rides.values("pk", "start_dt", "distance_km", "co2_saved_kg"))
+        self.filter(pk__in=[ride["pk"] for ride in values]).update(
+            counted_in_statistics=True
+        )
+        return values
+
     def safe_delete(self, ride) -> bool:
         """Soft delete rides delete the ride only if has no riders or if the ride has ended."""
         if ride.rider.count() == 0 or ride.has_ended:
@@ -38,16 +263,6 @@ class RideManager(models.Manager):
             return True
         return False
 
-    def filter_upcoming(self):
-        """
-        Function to filter upcoming rides.
-        An upcoming ride is defined as a ride that starts today or in the future.
-        (date part only, time is ignored)
-        """
-        return self.filter(
-            start_dt__date__gte=timezone.now().date(),
-        )
-
 
 class Ride(models.Model):
     class PaymentMethod(models.TextChoices):
@@ -151,6 +366,13 @@ class Ride(models.Model):
         default=1,
     )
 
+    seats_remaining = models.IntegerField(
+        verbose_name=_("seats remaining"),
+        help_text=_("Seats offered minus the riders, kept up to date by the bookings"),
+        default=1,
+        editable=False,
+    )
+
     vehicle = models.ForeignKey(
         verbose_name=_("vehicle"),
         to="carpool.Vehicle",
@@ -180,6 +402,26 @@ class Ride(models.Model):
         blank=True,
     )
 
+    distance_km = models.FloatField(
+        verbose_name=_("distance (km)"),
+        help_text=_("Length of the route, kept up to date when the ride changes"),
+        null=True,
+        blank=True,
+    )
+
+    co2_saved_kg = models.FloatField(
+        verbose_name=_("CO2 saved (kg)"),
+        help_text=_("CO2 saved by the riders, kept up to date when the ride changes"),
+        null=True,
+        blank=True,
+    )
+
+    counted_in_statistics = models.BooleanField(
+        verbose_name=_("counted in statistics"),
+        help_text=_("Whether the ride is included in the statistics"),
+        default=False,
+    )
+
     objects = RideManager()
 
     @property
@@ -188,7 +430,7 @@ class Ride(models.Model):
 
     @property
     def remaining_seats(self):
-        return self.seats_offered - self.rider.count()
+        return self.seats_remaining
 
     @property
     def is_full(self):
@@ -198,6 +440,19 @@ class Ride(models.Model):
     def booked_seats(self):
         return self.rider.count()
 
+    def save(self, *args, **kwargs):
+        # seats_remaining is only written by the bookings, so that saving a
+        # stale instance cannot give back a seat booked in the meantime
+        if self._state.adding:
+            self.seats_remaining = self.seats_offered
+        elif kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "seats_remaining"
+            ]
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse("carpool:detail", kwargs={"pk": self.pk})
 
@@ -205,6 +460,15 @@ class Ride(models.Model):
         permissions = [
             ("view_ride_statistics", "Can view ride statistics"),
         ]
+        indexes = [
+            GistIndex(geography("geometry"), name="carpool_ride_geography_idx"),
+            # Rides waiting to be counted by the daily statistics task
+            models.Index(
+                fields=["end_dt"],
+                condition=Q(counted_in_statistics=False),
+                name="carpool_ride_uncounted_idx",
+            ),
+        ]
 
     def clean(self):
         # Check that seats_oferred is lower or equal to vehicle.seats
@@ -0,0 +1,152 @@
+from django.contrib.gis.db import models
+from django.contrib.gis.geos import Point
+from django.contrib.postgres.indexes import GistIndex
+from django.db import transaction
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from multiselectfield import MultiSelectField
+
+from carpool.models.ride import Ride, RideQuerySet, geography
+from project.cache import invalidate
+
+# Tolerance (in degrees, ~10 m) used to simplify the stored route geometry
+GEOMETRY_SIMPLIFY_TOLERANCE = 1e-4
+
+# Cache namespace of the pages and fragments rendered from the search entries
+CACHE_NAMESPACE = "rides"
+
+
+def location_values(prefix, location):
+    """Denormalized columns of a ride start or end location."""
+    if location is None:
+        return {f"{prefix}_point": None, f"{prefix}_fulltext": "", f"{prefix}_city": ""}
+    return {
+        f"{prefix}_point": Point(float(location.lng), float(location.lat), srid=4326),
+        f"{prefix}_fulltext": location.fulltext,
+        f"{prefix}_city": location.city,
+    }
+
+
+class RideSearchEntryQuerySet(RideQuerySet):
+    def filter_upcoming(self):
+        """Same as Ride.objects.filter_upcoming() but on the indexed start_date."""
+        return self.filter(start_date__gte=timezone.localdate())
+
+    def filter_available(self):
+        """Rides that still have at least one seat left."""
+        return self.filter(remaining_seats__gt=0)
+
+
+class RideSearchEntryManager(models.Manager.from_queryset(RideSearchEntryQuerySet)):
+    def refresh(self, ride):
+        """Create or update the search entry of the given ride."""
+        booked_seats = ride.rider.count()
+        geometry = ride.geometry
+        if geometry:
+            geometry = geometry.simplify(
+                GEOMETRY_SIMPLIFY_TOLERANCE, preserve_topology=True
+            )
+
+        with transaction.atomic():
+            entry, _ = self.update_or_create(
+                ride=ride,
+                defaults={
+                    "start_dt": ride.start_dt,
+                    "end_dt": ride.end_dt,
+                    "start_date": timezone.localdate(ride.start_dt)
+                    if ride.start_dt
+                    else None,
+                    "duration": ride.duration,
+                    **location_values("start", ride.start_loc),
+                    **location_values("end", ride.end_loc),
+                    "steps_count": ride.steps.count(),
+                    "seats_offered": ride.seats_offered,
+                    "booked_seats": booked_seats,
+                    "remaining_seats": ride.seats_offered - booked_seats,
+                    "price": ride.price,
+                    "payment_method": ride.payment_method,
+                    "geometry": geometry,
+                    "driver_name": ride.driver.username,
+                },
+            )
+            invalidate(CACHE_NAMESPACE)
+        return entry
+
+    def refresh_rides(self, rides):
+        for ride in rides.select_related("start_loc", "end_loc", "driver"):
+            self.refresh(ride)
+
+
+class RideSearchEntry(models.Model):
+    """
+    Denormalized read model of a ride used by the rides list and map.
+
+    It holds everything those pages display so they can be served by a single
+    indexed query on this table, without joins nor aggregations. Entries are
+    kept up to date by the signals in carpool.signals.
+    """
+
+    ride = models.OneToOneField(
+        Ride,
+        verbose_name=_("ride"),
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="search_entry",
+    )
+
+    start_dt = models.DateTimeField(verbose_name=_("start date and time"), null=True)
+    end_dt = models.DateTimeField(verbose_name=_("end date and time"), null=True)
+    start_date = models.DateField(verbose_name=_("start date"), null=True)
+    duration = models.DurationField(verbose_name=_("duration"), null=True)
+
+    start_point = models.PointField(verbose_name=_("start point"), null=True)
+    start_fulltext = models.CharField(verbose_name=_("start label"), max_length=100)
+    start_city = models.CharField(verbose_name=_("start city"), max_length=100)
+
+    end_point = models.PointField(verbose_name=_("end point"), null=True)
+    end_fulltext = models.CharField(verbose_name=_("end label"), max_length=100)
+    end_city = models.CharField(verbose_name=_("end city"), max_length=100)
+
+    steps_count = models.PositiveIntegerField(verbose_name=_("steps"), default=0)
+
+    seats_offered = models.PositiveIntegerField(verbose_name=_("seats offered"))
+    booked_seats = models.PositiveIntegerField(verbose_name=_("booked seats"))
+    remaining_seats = models.IntegerField(verbose_name=_("remaining seats"))
+
+    price = models.FloatField(verbose_name=_("price"), null=True)
+    payment_method = MultiSelectField(
+        verbose_name=_("payment method"),
+        choices=Ride.PaymentMethod.choices,
+        blank=True,
+        max_length=100,
+    )
+
+    geometry = models.LineStringField(
+        verbose_name=_("simplified geometry"),
+        srid=4326,
+        null=True,
+    )
+
+    driver_name = models.CharField(verbose_name=_("driver"), max_length=150)
+
+    objects = RideSearchEntryManager()
+
+    class Meta:
+        verbose_name = _("Ride search entry")
+        verbose_name_plural = _("Ride search entries")
+        indexes = [
+            models.Index(
+                fields=["start_date", "start_dt"],
+                condition=Q(remaining_seats__gt=0),
+                name="carpool_search_available_idx",
+            ),
+            GistIndex(geography("geometry"), name="carpool_search_geography_idx"),
+        ]
+
+    def __str__(self):
+        return f"RideSearchEntry({self.start_city} -> {self.end_city}, {self.start_dt})"
+
+    def get_absolute_url(self):
+        return reverse("carpool:detail", kwargs={"pk": self.pk})
@@ -1,14 +1,43 @@
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
+class StatisticsManager(models.Manager):
+    def get_solo(self):
+        """Return the only Statistics record, created if needed."""
+        statistics = self.first()
+        if statistics is None:
+            statistics = self.create()
+        return statistics
+
+    def add(self, rides, distance, co2):
+        """Add the totals of newly counted rides to the overall statistics."""
+        self.filter(pk=self.get_solo().pk).update(
+            total_rides=models.F("total_rides") + rides,
+            total_distance=models.F("total_distance") + distance,
+            total_co2=models.F("total_co2") + co2,
+            updated_at=timezone.now(),
+        )
+
+    def rebuild(self):
+        """Recompute the overall totals from the monthly statistics."""
+        totals = MonthlyStatistics.objects.aggregate(
+            total_rides=models.Sum("total_rides", default=0),
+            total_distance=models.Sum("total_distance", default=0.0),
+            total_co2=models.Sum("total_co2", default=0.0),
+        )
+        self.filter(pk=self.get_solo().pk).update(**totals, updated_at=timezone.now())
+
+
 class Statistics(models.Model):
     """
     Model used to store overall statistics about the application.
 
     Used to avoid recalculating statistics on each request to the back-office.
-    This model contains only 1 record that is updated daily by a Celery task.
+    This model contains only 1 record that is updated daily by a Celery task,
+    which adds the rides that ended since its last run.
     """
 
     # Last time the statistics were updated
@@ -20,6 +49,8 @@ class Statistics(models.Model):
     total_distance = models.FloatField(default=0.0)
     total_co2 = models.FloatField(default=0.0)
 
+    objects = StatisticsManager()
+
     class Meta:
         verbose_name = _("Statistic")
         verbose_name_plural = _("Statistics")
@@ -35,13 +66,42 @@ class MonthlyStatisticsManager(models.Manager):
             | models.Q(year=start_year + 1, month__lt=9)
         )
 
+    def add(self, year, month, rides, distance, co2):
+        """Add the totals of newly counted rides to the statistics of a month."""
+        statistics, _ = self.get_or_create(year=year, month=month)
+        self.filter(pk=statistics.pk).update(
+            total_rides=models.F("total_rides") + rides,
+            total_distance=models.F("total_distance") + distance,
+            total_co2=models.F("total_co2") + co2,
+        )
+
+    def rebuild(self, year, month):
+        """Recompute the statistics of a month from its rides.
+
+        The distance and CO2 saved of the rides of the month that have ended
+        are computed again first.
+        """
+        from carpool.models.ride import Ride
+
+        rides = Ride.objects.filter(start_dt__year=year, start_dt__month=month)
+        ended = rides.filter(end_dt__lt=timezone.now())
+        ended.refresh_statistics()
+        Ride.objects.count_in_statistics(ended)
+        totals = rides.filter(counted_in_statistics=True).aggregate(
+            total_rides=models.Count("pk"),
+            total_distance=models.Sum("distance_km", default=0.0),
+            total_co2=models.Sum("co2_saved_kg", default=0.0),
+        )
+        return self.update_or_create(year=year, month=month, defaults=totals)[0]
+
 
 class MonthlyStatistics(models.Model):
     """
     Monthly statistics about the application usage.
 
-    This model is updated monthly by a Celery task. The current month statistics
-    is updated daily by the same Celery task that updates the overall statistics.
+    The rides are added to the statistics of the month they started in, once
+    they have ended, by the daily Celery task that updates the overall
+    statistics. The rebuild_statistics command recomputes any month.
     """
 
     month = models.IntegerField(
@@ -0,0 +1,69 @@
+"""
+Persistent cache of the IGN routing API responses.
+
+Drivers publish the same commutes again and again, so the responses are
+stored under their waypoints rounded to ROUTE_CACHE_PRECISION decimal places
+(about 11 m with the default of 4), the routing profile and the optimization.
+Only successful responses are cached, compressed with zlib.
+"""
+
+import hashlib
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from carpool import ign
+from carpool.models.cache import RouteCacheEntry
+
+
+def round_point(point, precision):
+    """Round the coordinates of a "lon,lat" point to `precision` decimal places."""
+    lon, lat = (float(coordinate) for coordinate in point.split(","))
+    return f"{lon:.{precision}f},{lat:.{precision}f}"
+
+
+def make_key(start, end, intermediates):
+    """Cache key of a route, or None if a waypoint cannot be parsed."""
+    precision = settings.ROUTE_CACHE_PRECISION
+    try:
+        waypoints = [round_point(p, precision) for p in [start, *intermediates, end]]
+    except ValueError:
+        return None
+    raw = "|".join([ign.ROUTING_PROFILE, ign.ROUTING_OPTIMIZATION, *waypoints])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def get_cache_ttl():
+    return timedelta(days=settings.ROUTE_CACHE_TTL_DAYS)
+
+
+def lookup(start, end, intermediates):
+    """Cached routing API response of the route, or None."""
+    key = make_key(start, end, intermediates)
+    if key is None:
+        return None
+    entry = RouteCacheEntry.objects.get_fresh(key, get_cache_ttl())
+    if entry is None:
+        return None
+    return json.loads(zlib.decompress(entry.response))
+
+
+def store(start, end, intermediates, response):
+    """Save a routing API response, unless it is an error."""
+    key = make_key(start, end, intermediates)
+    if key is None or "error" in response:
+        return
+    now = timezone.now()
+    RouteCacheEntry.objects.update_or_create(
+        key=key,
+        defaults={
+            "response": zlib.compress(
+                json.dumps(response, separators=(",", ":")).encode()
+            ),
+            "created_at": now,
+            "last_used_at": now,
+        },
+    )
@@ -0,0 +1,133 @@
+# Keep the RideSearchEntry read model (and the pages cached from it), the stored
+# ride statistics (distance and CO2 saved) and seats remaining in sync with the
+# rides they are derived from
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from accounts.models import User
+from carpool.models import Vehicle
+from carpool.models.reservation import Reservation
+from carpool.models.ride import Ride
+from carpool.models.search import CACHE_NAMESPACE, RideSearchEntry
+from project.cache import invalidate
+
+
+@receiver(post_save, sender=Ride)
+def refresh_search_entry_on_ride_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    RideSearchEntry.objects.refresh(instance)
+
+
+# Ride fields the stored distance and CO2 saved depend on
+STATISTICS_FIELDS = {"geometry", "vehicle"}
+
+
+@receiver(post_save, sender=Ride)
+def refresh_statistics_on_ride_save(
+    sender, instance, raw=False, update_fields=None, **kwargs
+):
+    if raw or instance.counted_in_statistics:
+        return
+    if update_fields is not None and not STATISTICS_FIELDS & set(update_fields):
+        return
+    Ride.objects.filter(pk=instance.pk).refresh_statistics()
+
+
+@receiver(post_save, sender=Ride)
+def refresh_seats_remaining_on_ride_save(
+    sender, instance, created, raw=False, update_fields=None, **kwargs
+):
+    # A new ride has all its seats offered left (see Ride.save)
+    if created or raw:
+        return
+    if update_fields is not None and "seats_offered" not in update_fields:
+        return
+    Ride.objects.filter(pk=instance.pk).refresh_seats_remaining()
+    instance.refresh_from_db(fields=["seats_remaining"])
+
+
+@receiver(post_save, sender=Vehicle)
+def refresh_statistics_on_vehicle_save(sender, instance, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    Ride.objects.filter(
+        vehicle=instance, counted_in_statistics=False
+    ).refresh_statistics()
+
+
+# Ride many-to-many relations mirrored in the search entries
+M2M_FIELDS = {
+    Ride.rider.through: "rider",
+    Ride.steps.through: "steps",
+}
+
+
+def refresh_search_entries_on_m2m_change(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    """Refresh the search entries of rides whose riders or steps changed.
+
+    The stored CO2 saved and seats remaining of the rides also change with
+    their riders.
+    """
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            RideSearchEntry.objects.refresh(instance)
+            if sender is Ride.rider.through:
+                Ride.objects.filter(pk=instance.pk).refresh_seats_remaining()
+                instance.refresh_from_db(fields=["seats_remaining"])
+                if not instance.counted_in_statistics:
+                    Ride.objects.filter(pk=instance.pk).refresh_co2()
+        return
+
+    # Changed from the other side (e.g. user.rides_as_rider), instance is not a ride
+    if action == "pre_clear":
+        # pk_set is not provided on clear, remember the rides before they go
+        instance._cleared_ride_pks = list(
+            Ride.objects.filter(**{M2M_FIELDS[sender]: instance}).values_list(
+                "pk", flat=True
+            )
+        )
+    elif action in ("post_add", "post_remove", "post_clear"):
+        if action == "post_clear":
+            pk_set = instance.__dict__.pop("_cleared_ride_pks", [])
+        rides = Ride.objects.filter(pk__in=pk_set)
+        RideSearchEntry.objects.refresh_rides(rides)
+        if sender is Ride.rider.through:
+            rides.refresh_seats_remaining()
+            rides.filter(counted_in_statistics=False).refresh_co2()
+
+
+for through in M2M_FIELDS:
+    m2m_changed.connect(refresh_search_entries_on_m2m_change, sender=through)
+
+
+@receiver(post_save, sender=Reservation)
+def refresh_search_entry_on_reservation_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    RideSearchEntry.objects.refresh(instance.ride)
+
+
+@receiver(post_save, sender=User)
+def refresh_search_entries_on_driver_save(
+    sender, instance, created, raw=False, update_fields=None, **kwargs
+):
+    if created or raw:
+        return
+    # Logins only save last_login, don't touch the search entries then
+    if update_fields is not None and "username" not in update_fields:
+        return
+    updated = (
+        RideSearchEntry.objects.filter(ride__driver=instance)
+        .exclude(driver_name=instance.username)
+        .update(driver_name=instance.username)
+    )
+    if updated:
+        invalidate(CACHE_NAMESPACE)
+
+
+@receiver(post_delete, sender=RideSearchEntry)
+def invalidate_cache_on_search_entry_delete(sender, instance, **kwargs):
+    invalidate(CACHE_NAMESPACE)
@@ -1,27 +1,19 @@
-import time
-import requests
+from collections import defaultdict
+
 from celery import shared_task
 from celery.utils.log import get_task_logger
-from requests.exceptions import RequestException, Timeout, ConnectionError
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.contrib.gis.db.models.functions import Length
 from django.core.mail import EmailMessage
-from django.db.models import (
-    Count,
-    ExpressionWrapper,
-    F,
-    FloatField,
-    Sum,
-    When,
-    Case,
-    Q,
-    Value,
-)
+from django.db import transaction
 from django.template.loader import render_to_string
 from django.utils import timezone, translation
 from django.utils.translation import gettext as _
 
+from accounts.models import EmailOutbox
+from carpool import dashboard
+from carpool.models import Step
+from carpool.models.cache import GeocodingCacheEntry, RouteCacheEntry
 from carpool.models.reservation import Reservation
 from carpool.models.ride import Ride
 from carpool.models.statistics import MonthlyStatistics, Statistics
@@ -29,279 +21,93 @@ from carpool.models.statistics import MonthlyStatistics, Statistics
 logger = get_task_logger(__name__)
 
 
-"""
-We wanted to use the adresse.data.gouv.fr API, but the service is migrating
-to a new API at data.geopf.fr.
-The documentation for the new API can be found here:
-https://geoservices.ign.fr/documentation/services/services-geoplateforme/geocodage
-"""
-
-API_BASE_URL = "https://data.geopf.fr/geocodage/search"
-
-
-@shared_task(rate_limit=settings.GEOCODAGE_TASK_RATE_LIMIT)
-def get_autocompletion(query):
-    """A Celery task to get latitude and longitude for a given query.
-    This is a placeholder function that should be implemented with actual logic.
-
-    API doc: https://geoservices.ign.fr/documentation/services/services-geoplateforme/autocompletion
-    """
-    r = requests.get(
-        f"https://data.geopf.fr/geocodage/completion/?text={query}&terr=METROPOLE&type=StreetAddress",
-        timeout=5,
+@shared_task
+def evict_geocoding_cache():
+    """Delete the expired and least recently used geocoding cache entries."""
+    deleted = GeocodingCacheEntry.objects.evict(
+        ttl=timezone.timedelta(days=settings.GEOCODING_CACHE_TTL_DAYS),
+        max_entries=settings.GEOCODING_CACHE_MAX_ENTRIES,
     )
-    result = []
-    if r.status_code == 200:
-        data = r.json()
-        if data and "results" in data:
-            geocoding_results = data["results"]
-            if geocoding_results:
-                for geocoding_result in geocoding_results:
-                    content =  {
-                        "fulltext": geocoding_result["fulltext"],
-                        "value": f"{geocoding_result['y']}/{geocoding_result['x']}",
-                        "customProperties": {
-                            "street": geocoding_result.get("street", ""),
-                            "city": geocoding_result.get("city", ""),
-                            "zipcode": geocoding_result.get("zipcode", ""),
-                            "latitude": geocoding_result["x"],
-                            "longitude": geocoding_result["y"],
-                        },
-                    }
-
-                    # Prioritize exact city results matching the query
-                    if geocoding_result.get("street", "") == "" and geocoding_result.get("city", "").lower().startswith(query.lower()):
-                        result.insert(0, content)
-                    else:
-                        result.append(content)
-    return result
-
-
-@shared_task(rate_limit=settings.ROUTING_TASK_RATE_LIMIT)
-def get_routing(start, end, intermediates):
-    """
-    Celery task to get routing information between two points using the IGN routing API.
-
-    Args:
-        start (str): Starting point coordinates, format "lon,lat" (e.g. "-1.68365,48.110899")
-        end (str): Ending point coordinates, format "lon,lat" (e.g. "-1.466824,47.297116")
-        intermediates (list, optional): List of intermediate point coordinates, format ["lon,lat", ...]. Defaults to None.
-
-    Returns:
-        dict: Routing result (JSON) or error information.
-    """
+    logger.info(f"Evicted {deleted} geocoding cache entries.")
 
-    base_url = "https://data.geopf.fr/navigation/itineraire"
-    logger.error(f"[IGN Routing] Requesting route from {start} to {end}")
-    logger.error(f"[IGN Routing] Intermediates: {intermediates}")
-
-    params = {
-        "resource": "bdtopo-osrm",
-        "start": start,
-        "end": end,
-        "intermediates": "|".join(intermediates) if intermediates else None,
-        "profile": "car",
-        "optimization": "fastest",
-        "geometryFormat": "geojson",
-        "getSteps": "true",
-        "getBbox": "true",
-        "distanceUnit": "kilometer",
-        "timeUnit": "hour",
-        "crs": "EPSG:4326",
-    }
 
-    # Configuration
-    TIMEOUT = 60  # seconds
-    MAX_RETRIES = 3
-    BACKOFF_BASE = 2  # exponential backoff base
+@shared_task
+def evict_route_cache():
+    """Delete the expired and least recently used route cache entries."""
+    deleted = RouteCacheEntry.objects.evict(
+        ttl=timezone.timedelta(days=settings.ROUTE_CACHE_TTL_DAYS),
+        max_entries=settings.ROUTE_CACHE_MAX_ENTRIES,
+    )
+    logger.info(f"Evicted {deleted} route cache entries.")
 
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            start_time = time.time()
-            response = requests.get(base_url, params=params, timeout=TIMEOUT)
 
-            duration = round(time.time() - start_time, 2)
+@shared_task
+def delete_orphaned_steps():
+    """Delete the steps no longer attached to any ride."""
+    deleted = Step.objects.orphaned().delete()[1].get("carpool.Step", 0)
+    logger.info(f"Deleted {deleted} orphaned steps.")
+    return deleted
 
-            logger.info(
-                f"[IGN Routing] Call #{attempt} ({duration}s) - "
-                f"status={response.status_code} start={start} end={end}"
-            )
 
-            if response.status_code == 200:
-                return response.json()
-
-            elif response.status_code in (502, 503, 504):
-                # Transient error → retry
-                if attempt < MAX_RETRIES:
-                    wait = BACKOFF_BASE**attempt
-                    logger.warning(
-                        f"[IGN Routing] Temporary error {response.status_code}, "
-                        f"retrying in {wait}s (attempt {attempt}/{MAX_RETRIES})"
-                    )
-                    time.sleep(wait)
-                    continue
-                else:
-                    break
-
-            else:
-                # Permanent error (e.g., 400, 404)
-                logger.error(
-                    f"[IGN Routing] Failed (HTTP {response.status_code}): {response.text[:200]}"
-                )
-                return {
-                    "error": "Failed to fetch routing information",
-                    "status_code": response.status_code,
-                    "details": response.text,
-                }
-
-        except (Timeout, ConnectionError) as e:
-            # Retry on network timeout or connectivity issues
-            if attempt < MAX_RETRIES:
-                wait = BACKOFF_BASE**attempt
-                logger.warning(
-                    f"[IGN Routing] Network error: {e}. Retrying in {wait}s..."
-                )
-                time.sleep(wait)
-                continue
-            else:
-                logger.error("[IGN Routing] Network error after retries")
-                return {"error": str(e), "status_code": None}
-
-        except RequestException as e:
-            logger.error("[IGN Routing] Unexpected request error")
-            return {"error": str(e), "status_code": None}
-
-    # If all retries failed
-    return {
-        "error": "IGN routing service unavailable after retries",
-        "status_code": None,
-    }
+# Number of rides counted per transaction by compute_daily_statistics
+STATISTICS_BATCH_SIZE = 500
 
 
 @shared_task
 def compute_daily_statistics():
     """
-    Compute daily statistics for total rides (Statistics model).
-    Compute the current month statistics if not already done (MonthlyStatistics model).
+    Add the rides that ended since the last run to the statistics.
+
+    The distance and CO2 saved of each ride are computed and stored once, then
+    added to the Statistics and MonthlyStatistics totals, so the cost of a run
+    does not grow with the number of past rides.
     """
 
-    logger.info("Computing daily statistics for total rides.")
+    logger.info("Computing daily statistics for the rides that ended.")
 
-    rides = (
-        Ride.objects.annotate(
-            distance_km=ExpressionWrapper(
-                Length("geometry", spheroid=True) / 1000.0,
-                output_field=FloatField(),
-            ),
-            rider_count=Count("rider", distinct=True),
-        )
-        .annotate(
-            effective_co2_per_km=Case(
-                When(
-                    Q(vehicle__geqCO2_per_km__isnull=True)
-                    | Q(vehicle__geqCO2_per_km=0),
-                    then=Value(settings.AVERAGE_CO2_EMISSION_PER_KM),
-                ),
-                default=F("vehicle__geqCO2_per_km"),
-                output_field=FloatField(),
-            ),
-        )
-        .annotate(
-            spared_co2_kg=ExpressionWrapper(
-                F("rider_count") * F("distance_km") * F("effective_co2_per_km") / 1000,
-                output_field=FloatField(),
+    now = timezone.now()
+    rides = Ride.objects.filter(end_dt__lt=now, counted_in_statistics=False)
+    pks = list(rides.values_list("pk", flat=True))
+
+    for i in range(0, len(pks), STATISTICS_BATCH_SIZE):
+        with transaction.atomic():
+            counted = Ride.objects.count_in_statistics(
+                Ride.objects.filter(
+                    pk__in=pks[i : i + STATISTICS_BATCH_SIZE],
+                    counted_in_statistics=False,
+                )
             )
-        )
-    )
 
-    totals = rides.aggregate(
-        total_distance=Sum("distance_km"),
-        total_co2=Sum("spared_co2_kg"),
-    )
+            months = defaultdict(lambda: [0, 0.0, 0.0])
+            for ride in counted:
+                start_dt = timezone.localtime(ride["start_dt"])
+                totals = months[(start_dt.year, start_dt.month)]
+                totals[0] += 1
+                totals[1] += ride["distance_km"] or 0
+                totals[2] += ride["co2_saved_kg"] or 0
+
+            for (year, month), (count, distance, co2) in months.items():
+                MonthlyStatistics.objects.add(year, month, count, distance, co2)
+            Statistics.objects.add(
+                len(counted),
+                sum(totals[1] for totals in months.values()),
+                sum(totals[2] for totals in months.values()),
+            )
 
-    total_rides = rides.count()
+    # The users are not counted per month, the current month gets the total
     total_users = get_user_model().objects.count()
-    total_distance = totals["total_distance"] or 0
-    total_co2 = totals["total_co2"] or 0
-
-    logger.info(
-        "Computing daily statistics: %d rides, %d users, %.2f km, %.2f kg CO2",
-        total_rides,
-        total_users,
-        total_distance,
-        total_co2,
+    Statistics.objects.filter(pk=Statistics.objects.get_solo().pk).update(
+        total_users=total_users, updated_at=now
     )
-
-    # --- Daily Statistics ---
-    if Statistics.objects.count() == 0:
-        logger.info("No statistics found, creating the first entry.")
-        Statistics.objects.create(
-            total_rides=total_rides,
-            total_users=total_users,
-            total_distance=total_distance,
-            total_co2=total_co2,
-        )
-    else:
-        logger.info("Updating existing statistics entry.")
-        s = Statistics.objects.first()
-        s.total_rides = total_rides
-        s.total_users = total_users
-        s.total_distance = total_distance
-        s.total_co2 = total_co2
-        s.save()
-
-    # --- Monthly Statistics ---
-    now = timezone.now()
-    logger.info("Checking monthly statistics for %d-%d", now.year, now.month)
-
-    month_stats, created = MonthlyStatistics.objects.get_or_create(
-        month=now.month,
-        year=now.year,
-        defaults={
-            "total_rides": 0,
-            "total_users": 0,
-            "total_distance": 0,
-            "total_co2": 0,
-        },
-    )
-
-    current_month_rides = (
-        Ride.objects.filter(start_dt__year=now.year, start_dt__month=now.month)
-        .annotate(distance_km=Length("geometry", spheroid=True) / 1000.0)
-        .annotate(
-            effective_co2_per_km=Case(
-                When(
-                    Q(vehicle__geqCO2_per_km__isnull=True)
-                    | Q(vehicle__geqCO2_per_km=0),
-                    then=Value(settings.AVERAGE_CO2_EMISSION_PER_KM),
-                ),
-                default=F("vehicle__geqCO2_per_km"),
-                output_field=FloatField(),
-            ),
-        )
-        .annotate(
-            spared_co2_kg=ExpressionWrapper(
-                Count("rider", distinct=True)
-                * F("distance_km")
-                * F("effective_co2_per_km")
-                / 1000,
-                output_field=FloatField(),
-            )
-        )
-    )
-
-    month_totals = current_month_rides.aggregate(
-        total_distance=Sum("distance_km"), total_co2=Sum("spared_co2_kg")
+    MonthlyStatistics.objects.get_or_create(year=now.year, month=now.month)
+    MonthlyStatistics.objects.filter(year=now.year, month=now.month).update(
+        total_users=total_users
     )
 
-    month_stats.total_rides = current_month_rides.count()
-    month_stats.total_users = get_user_model().objects.count()
-    month_stats.total_distance = month_totals["total_distance"] or 0
-    month_stats.total_co2 = month_totals["total_co2"] or 0
-    month_stats.save()
+    dashboard.refresh_snapshot()
 
     logger.info(
-        "Monthly statistics updated successfully for %d-%d", now.year, now.month
+        "Daily statistics updated: %d rides counted, %d users", len(pks), total_users
     )
 
 
@@ -342,7 +148,7 @@ def send_email_incoming_reservation_to_driver(site_base_url, reservation_pk):
     )
 
     email.content_subtype = "html"
-    email.send(fail_silently=False)
+    EmailOutbox.objects.enqueue(email)
 
 
 @shared_task
@@ -374,8 +180,8 @@ def send_email_confirmed_ride(reservation_pk):
         to=[reservation.user.email],
     )
 
-    email.send(fail_silently=False)
-    logger.info(f"Sent ride confirmation email to {reservation.user.email}.")
+    EmailOutbox.objects.enqueue(email)
+    logger.info(f"Queued ride confirmation email to {reservation.user.email}.")
 
 
 @shared_task
@@ -407,8 +213,8 @@ def send_email_declined_ride(reservation_pk):
         to=[reservation.user.email],
     )
 
-    email.send(fail_silently=False)
-    logger.info(f"Sent ride decline email to {reservation.user.email}.")
+    EmailOutbox.objects.enqueue(email)
+    logger.info(f"Queued ride decline email to {reservation.user.email}.")
 
 
 @shared_task
@@ -452,5 +258,5 @@ def send_email_suggest_ride_sharing(ride_pk, similar_rides_pks, requester_pk):
     email.content_subtype = "html"
     email.reply_to = [requester.email]
 
-    email.send(fail_silently=False)
-    logger.info(f"Sent ride sharing suggestion email to {ride.driver.email}.")
+    EmailOutbox.objects.enqueue(email)
+    logger.info(f"Queued ride sharing suggestion email to {ride.driver.email}.")
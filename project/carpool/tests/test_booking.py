@@ -0,0 +1,89 @@
+import threading
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from accounts.tests.factories import UserFactory
+from carpool.models.ride import Ride
+from carpool.models.search import RideSearchEntry
+from carpool.tests.factories import RideFactory
+
+
+class BookSeatTestCase(TestCase):
+    def setUp(self):
+        self.ride = RideFactory(seats_offered=1, driver=UserFactory())
+
+    def test_book_last_seat(self):
+        user = UserFactory()
+        self.assertTrue(Ride.objects.book_seat(self.ride, user))
+        self.assertEqual(list(self.ride.rider.all()), [user])
+        self.assertEqual(self.ride.seats_remaining, 0)
+
+        self.assertFalse(Ride.objects.book_seat(self.ride, UserFactory()))
+        self.assertEqual(self.ride.rider.count(), 1)
+
+    def test_book_seat_queries(self):
+        user = UserFactory()
+        with CaptureQueriesContext(connection) as refresh_queries:
+            RideSearchEntry.objects.refresh(self.ride)
+
+        # The savepoint, the seat UPDATE, the rider INSERT, the seats_remaining
+        # reload, the CO2 saved UPDATE and the savepoint release, on top of the
+        # search entry refresh: the seats are not recounted under a lock
+        with self.assertNumQueries(len(refresh_queries) + 6):
+            self.assertTrue(Ride.objects.book_seat(self.ride, user))
+
+        entry = RideSearchEntry.objects.get(ride=self.ride)
+        self.assertEqual(entry.booked_seats, 1)
+        self.assertEqual(entry.remaining_seats, 0)
+        self.assertEqual(self.ride.seats_remaining, 0)
+
+    def test_seats_remaining_follows_riders_and_seats_offered(self):
+        user = UserFactory()
+        self.ride.rider.add(user)
+        self.ride.seats_offered = 3
+        self.ride.save()
+        self.assertEqual(self.ride.seats_remaining, 2)
+
+        # From the other side of the relation
+        user.rides_as_rider.remove(self.ride)
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.seats_remaining, 3)
+
+    def test_stale_instance_does_not_give_back_a_seat(self):
+        stale = Ride.objects.get(pk=self.ride.pk)
+        Ride.objects.book_seat(self.ride, UserFactory())
+
+        stale.price = 5
+        stale.save()
+        stale.refresh_from_db()
+        self.assertEqual(stale.seats_remaining, 0)
+
+
+class BookSeatConcurrencyTestCase(TransactionTestCase):
+    def test_parallel_bookings_do_not_overbook(self):
+        ride = RideFactory(seats_offered=2, driver=UserFactory())
+        users = UserFactory.create_batch(8)
+        barrier = threading.Barrier(len(users))
+        results = []
+
+        def book(user):
+            try:
+                barrier.wait()
+                results.append(
+                    Ride.objects.book_seat(Ride.objects.get(pk=ride.pk), user)
+                )
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=book, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 2)
+        ride.refresh_from_db()
+        self.assertEqual(ride.rider.count(), 2)
+        self.assertEqual(ride.seats_remaining, 0)
@@ -0,0 +1,156 @@
+from unittest.mock import AsyncMock, patch
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.tests.factories import UserFactory
+from carpool import geocoding
+from carpool.models.cache import GeocodingCacheEntry
+from carpool.tests.factories import LocationFactory
+
+
+def result(fulltext, street="", city="Rennes"):
+    return geocoding.location_result(fulltext, street, city, "35000", 48.1, -1.6)
+
+
+class NormalizeQueryTestCase(SimpleTestCase):
+    def test_normalize_query(self):
+        self.assertEqual(
+            geocoding.normalize_query("  12, Rue de l'Église  "), "12 rue de l eglise"
+        )
+
+
+class LRUCacheTestCase(SimpleTestCase):
+    def test_least_recently_used_is_evicted(self):
+        cache = geocoding.LRUCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_items_expire(self):
+        cache = geocoding.LRUCache(maxsize=2, ttl=-1)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+
+class PrefixIndexTestCase(SimpleTestCase):
+    def test_search(self):
+        index = geocoding.PrefixIndex()
+        index.reset(
+            [
+                result("12 Rue de la Paix 35000 Rennes", street="Rue de la Paix"),
+                result("Rennes"),
+                result("Redon", city="Redon"),
+            ]
+        )
+        index.add([result("Rue de Nantes 35000 Rennes", street="Rue de Nantes")])
+
+        labels = [r["fulltext"] for r in index.search("ren")]
+        self.assertEqual(labels, ["Rennes"])
+        # Street addresses are also found without their house number
+        labels = [r["fulltext"] for r in index.search("rue de")]
+        self.assertEqual(
+            labels, ["12 Rue de la Paix 35000 Rennes", "Rue de Nantes 35000 Rennes"]
+        )
+        self.assertEqual(index.search("brest"), [])
+
+
+class GeocodingCacheTestCase(TestCase):
+    def setUp(self):
+        geocoding.memory_cache.clear()
+        # Loaded empty, so the lookups don't reload it in a background thread
+        geocoding.prefix_index.reset([])
+
+    def test_store_and_lookup(self):
+        self.assertIsNone(geocoding.lookup("Rue de la Paix"))
+
+        results = [result("Rue de la Paix 35000 Rennes", street="Rue de la Paix")]
+        geocoding.store("Rue de la Paix", results)
+        self.assertEqual(geocoding.lookup_memory("rue de la paix"), results)
+
+        # From the database once the in-process cache is empty
+        geocoding.memory_cache.clear()
+        self.assertEqual(geocoding.lookup("RUE DE LA PAIX"), results)
+        self.assertEqual(GeocodingCacheEntry.objects.get().hits, 1)
+
+    def test_expired_entries_are_ignored(self):
+        GeocodingCacheEntry.objects.create(
+            key="rennes",
+            results=[result("Rennes")],
+            created_at=timezone.now() - timezone.timedelta(days=365),
+        )
+        self.assertIsNone(geocoding.lookup("Rennes"))
+
+    def test_prefix_index_seeded_from_locations(self):
+        for i in range(geocoding.PREFIX_INDEX_MIN_RESULTS):
+            LocationFactory(fulltext=f"{i} Avenue des Buttes de Coesmes 35700 Rennes")
+        geocoding.load_prefix_index()
+
+        results = geocoding.lookup("avenue des buttes")
+        self.assertEqual(len(results), geocoding.PREFIX_INDEX_MIN_RESULTS)
+        # Not enough known addresses to answer without the API
+        self.assertIsNone(geocoding.lookup("boulevard"))
+
+    @patch("carpool.geocoding.threading.Thread")
+    def test_stale_prefix_index_is_reloaded_in_background(self, mock_thread):
+        geocoding.prefix_index.loaded_at = None
+        self.addCleanup(setattr, geocoding.prefix_index, "loading", False)
+
+        # The stale index is searched right away, without waiting for the reload
+        self.assertIsNone(geocoding.lookup("avenue"))
+        self.assertIsNone(geocoding.lookup("boulevard"))
+        mock_thread.assert_called_once_with(
+            target=geocoding._load_prefix_index_in_background, daemon=True
+        )
+        mock_thread.return_value.start.assert_called_once_with()
+
+    def test_evict(self):
+        now = timezone.now()
+        for i in range(3):
+            GeocodingCacheEntry.objects.create(
+                key=f"query {i}", last_used_at=now - timezone.timedelta(hours=i)
+            )
+        GeocodingCacheEntry.objects.create(
+            key="expired", created_at=now - timezone.timedelta(days=365)
+        )
+
+        deleted = GeocodingCacheEntry.objects.evict(
+            ttl=timezone.timedelta(days=30), max_entries=2
+        )
+        self.assertEqual(deleted, 2)
+        self.assertEqual(
+            set(GeocodingCacheEntry.objects.values_list("key", flat=True)),
+            {"query 0", "query 1"},
+        )
+
+
+class AutocompletionViewTestCase(TestCase):
+    def setUp(self):
+        geocoding.memory_cache.clear()
+        geocoding.prefix_index.reset([])
+        self.client.force_login(UserFactory(email_verified=True))
+
+    @patch("carpool.views.api.ign.autocomplete", new_callable=AsyncMock)
+    def test_cached_query_does_not_call_the_api(self, mock_autocomplete):
+        results = [result("Rennes")]
+        geocoding.store("Rennes", results)
+
+        r = self.client.get(reverse("carpool:completion"), {"text": "rennes"})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()["results"], results)
+        self.assertFalse(mock_autocomplete.called)
+
+    @patch("carpool.views.api.ign.autocomplete", new_callable=AsyncMock)
+    def test_api_results_are_cached(self, mock_autocomplete):
+        results = [result("Rennes")]
+        mock_autocomplete.return_value = results
+
+        r = self.client.get(reverse("carpool:completion"), {"text": "Rennes"})
+        self.assertEqual(r.json()["results"], results)
+        mock_autocomplete.assert_called_once_with("Rennes")
+        self.assertEqual(GeocodingCacheEntry.objects.get().key, "rennes")
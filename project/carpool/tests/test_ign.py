@@ -0,0 +1,171 @@
+import time
+from unittest.mock import patch
+
+import httpx
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from carpool import ign
+
+COMPLETION_RESPONSE = {
+    "status": "OK",
+    "results": [
+        {
+            "fulltext": "Rue de Rennes 35510 Cesson-Sévigné",
+            "street": "Rue de Rennes",
+            "city": "Cesson-Sévigné",
+            "zipcode": "35510",
+            "x": -1.6,
+            "y": 48.1,
+        },
+        {
+            "fulltext": "Rennes",
+            "street": "",
+            "city": "Rennes",
+            "zipcode": "35000",
+            "x": -1.68,
+            "y": 48.11,
+        },
+    ],
+}
+
+
+class RateLimitTestCase(SimpleTestCase):
+    def test_parse_rate(self):
+        self.assertEqual(ign.parse_rate("50/s"), 50)
+        self.assertEqual(ign.parse_rate("6/m"), 0.1)
+        self.assertEqual(ign.parse_rate("10"), 10)
+
+    async def test_token_bucket(self):
+        bucket = ign.TokenBucket(rate=20)
+        for _ in range(20):
+            await bucket.acquire()
+
+        # The burst is spent, the next call waits for a token
+        start = time.monotonic()
+        await bucket.acquire()
+        self.assertGreater(time.monotonic() - start, 0.02)
+
+
+class AutocompleteTestCase(SimpleTestCase):
+    def test_parse_completion(self):
+        results = ign.parse_completion("renn", COMPLETION_RESPONSE)
+        # The city matching the query comes first
+        self.assertEqual(results[0]["fulltext"], "Rennes")
+        self.assertEqual(results[0]["value"], "48.11/-1.68")
+        self.assertEqual(ign.parse_completion("renn", {}), [])
+
+    async def test_autocomplete(self):
+        def handler(request):
+            self.assertEqual(request.url.params["text"], "renn")
+            return httpx.Response(200, json=COMPLETION_RESPONSE)
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with patch("carpool.ign.get_client", return_value=client):
+            results = await ign.autocomplete("renn")
+        self.assertEqual(len(results), 2)
+
+    async def test_autocomplete_error(self):
+        client = httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda request: httpx.Response(503))
+        )
+        with (
+            patch("carpool.ign.get_client", return_value=client),
+            self.assertRaises(httpx.HTTPError),
+        ):
+            await ign.autocomplete("renn")
+
+    async def test_shared_client(self):
+        self.assertIs(ign.get_client(), ign.get_client())
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.breaker = ign.CircuitBreaker("test", threshold=2, reset_timeout=60)
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.is_open())
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.is_open())
+
+    def test_success_resets_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.is_open())
+
+    async def test_async(self):
+        await self.breaker.arecord_failure()
+        await self.breaker.arecord_failure()
+        self.assertTrue(await self.breaker.ais_open())
+
+
+class RouteTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        # Don't let the rate limit of the previous tests sleep
+        ign.routing_bucket.tokens = ign.routing_bucket.capacity
+
+    def mock_client(self, *responses):
+        responses = iter(responses)
+        return httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda request: next(responses))
+        )
+
+    async def test_transient_error_is_retried(self):
+        client = self.mock_client(
+            httpx.Response(503), httpx.Response(200, json={"distance": 10})
+        )
+        with (
+            patch("carpool.ign.get_client", return_value=client),
+            patch("carpool.ign.asyncio.sleep") as mock_sleep,
+        ):
+            result = await ign.route("-1.68,48.11", "-1.46,47.29", [])
+        self.assertEqual(result, {"distance": 10})
+        mock_sleep.assert_awaited_once_with(ign.ROUTING_BACKOFF_BASE)
+
+    async def test_network_error_is_retried(self):
+        responses = iter(
+            [
+                httpx.ConnectTimeout("timed out"),
+                httpx.Response(200, json={"distance": 10}),
+            ]
+        )
+
+        def handler(request):
+            response = next(responses)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with (
+            patch("carpool.ign.get_client", return_value=client),
+            patch("carpool.ign.asyncio.sleep") as mock_sleep,
+        ):
+            result = await ign.route("-1.68,48.11", "-1.46,47.29", [])
+        self.assertEqual(result, {"distance": 10})
+        mock_sleep.assert_awaited_once_with(ign.ROUTING_BACKOFF_BASE)
+
+    async def test_gives_up_after_retries(self):
+        client = self.mock_client(
+            *[httpx.Response(503)] * (ign.ROUTING_MAX_RETRIES + 1)
+        )
+        with (
+            patch("carpool.ign.get_client", return_value=client),
+            patch("carpool.ign.asyncio.sleep"),
+        ):
+            result = await ign.route("-1.68,48.11", "-1.46,47.29", [])
+        self.assertIsNone(result["status_code"])
+        self.assertIn("error", result)
+
+    async def test_open_circuit_fails_fast(self):
+        for _ in range(ign.routing_breaker.threshold):
+            await ign.routing_breaker.arecord_failure()
+
+        with patch("carpool.ign.get_client") as mock_client:
+            result = await ign.route("-1.68,48.11", "-1.46,47.29", [])
+        self.assertEqual(result, ign.ROUTING_UNAVAILABLE)
+        self.assertFalse(mock_client.called)
@@ -1,6 +1,14 @@
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-from carpool.tests.factories import RideFactory
+from carpool.models import Location, Step
+from carpool.models.ride import Ride
+from carpool.models.search import RideSearchEntry
+from carpool.tasks import delete_orphaned_steps
+from carpool.tests.factories import LocationFactory, RideFactory
+from carpool.utils import get_or_create_location, get_or_create_locations
 from accounts.tests.factories import UserFactory
 
 
@@ -34,3 +42,158 @@ class ModelTestCase(TestCase):
         
         self.assertEqual(ride.remaining_seats, 0)
         self.assertTrue(ride.is_full)
+
+
+class RideSearchEntryTestCase(TestCase):
+    def setUp(self):
+        self.driver = UserFactory()
+        self.ride = RideFactory(seats_offered=2, driver=self.driver)
+
+    def get_entry(self):
+        return RideSearchEntry.objects.get(ride=self.ride)
+
+    def test_entry_created_with_ride(self):
+        entry = self.get_entry()
+        self.assertEqual(entry.start_city, self.ride.start_loc.city)
+        self.assertEqual(entry.end_city, self.ride.end_loc.city)
+        self.assertEqual(entry.driver_name, self.driver.username)
+        self.assertEqual(entry.remaining_seats, 2)
+        self.assertAlmostEqual(entry.start_point.y, float(self.ride.start_loc.lat))
+
+    def test_entry_updated_on_ride_save(self):
+        self.ride.price = 12
+        self.ride.save()
+        self.assertEqual(self.get_entry().price, 12)
+
+    def test_entry_updated_on_riders_change(self):
+        user = UserFactory()
+        self.ride.rider.add(user)
+        self.assertEqual(self.get_entry().remaining_seats, 1)
+
+        # From the other side of the relation
+        user.rides_as_rider.clear()
+        self.assertEqual(self.get_entry().remaining_seats, 2)
+
+    def test_entry_updated_on_steps_change(self):
+        step = Step.objects.create(location=LocationFactory(), order=1)
+        self.ride.steps.add(step)
+        self.assertEqual(self.get_entry().steps_count, 1)
+
+    def test_entry_updated_on_driver_rename(self):
+        self.driver.username = "new_name"
+        self.driver.save()
+        self.assertEqual(self.get_entry().driver_name, "new_name")
+
+    def test_entry_deleted_with_ride(self):
+        self.ride.delete()
+        self.assertFalse(RideSearchEntry.objects.exists())
+
+
+class LocationTestCase(TestCase):
+    data = {
+        "fulltext": "1 Rue de la Paix 75002 Paris",
+        "street": "1 Rue de la Paix",
+        "zipcode": "75002",
+        "city": "Paris",
+        "latitude": 48.8691,
+        "longitude": 2.3316,
+    }
+
+    def test_get_or_create_location_reuses_same_address(self):
+        location = get_or_create_location(self.data)
+        self.assertEqual(location.point.coords, (2.3316, 48.8691))
+
+        same = get_or_create_location(
+            {**self.data, "fulltext": "1 rue de la  Paix 75002 Paris"}
+        )
+        self.assertEqual(same.pk, location.pk)
+        self.assertEqual(Location.objects.count(), 1)
+
+    def test_get_or_create_location_reuses_saved_location(self):
+        location = Location.objects.create(
+            fulltext=self.data["fulltext"],
+            street=self.data["street"],
+            zipcode=self.data["zipcode"],
+            city=self.data["city"],
+            lat=self.data["latitude"],
+            lng=self.data["longitude"],
+        )
+        self.assertIsNotNone(location.address_hash)
+
+        self.assertEqual(get_or_create_location(self.data).pk, location.pk)
+        self.assertEqual(Location.objects.count(), 1)
+
+    def test_merge_duplicate_locations(self):
+        fields = {
+            "fulltext": self.data["fulltext"],
+            "street": self.data["street"],
+            "zipcode": self.data["zipcode"],
+            "city": self.data["city"],
+            "lat": self.data["latitude"],
+            "lng": self.data["longitude"],
+        }
+        # As the locations created before the address hash was added
+        kept = LocationFactory(**fields)
+        Location.objects.update(address_hash=None)
+        duplicate = LocationFactory(**{**fields, "city": "PARIS"})
+        Location.objects.update(address_hash=None)
+        ride = RideFactory(driver=UserFactory(), start_loc=duplicate, end_loc=kept)
+        step = Step.objects.create(location=duplicate, order=1)
+
+        call_command("merge_duplicate_locations", batch_size=1)
+
+        self.assertEqual(list(Location.objects.values_list("pk", flat=True)), [kept.pk])
+        ride.refresh_from_db()
+        step.refresh_from_db()
+        self.assertEqual(ride.start_loc_id, kept.pk)
+        self.assertEqual(step.location_id, kept.pk)
+        self.assertIsNotNone(Location.objects.get().address_hash)
+
+
+class StepsTestCase(TestCase):
+    def setUp(self):
+        self.ride = RideFactory(driver=UserFactory())
+
+    def stopovers(self, count):
+        return [
+            {
+                "fulltext": f"Stopover {i}",
+                "zipcode": "69000",
+                "city": "Lyon",
+                "latitude": 45.75 + i / 100,
+                "longitude": 4.85,
+            }
+            for i in range(count)
+        ]
+
+    def test_set_steps_diffs_the_current_steps(self):
+        first, second, third = LocationFactory.create_batch(3)
+        Ride.objects.set_steps(self.ride, [first, second])
+        kept = self.ride.steps.get(order=1)
+
+        Ride.objects.set_steps(self.ride, [first, third])
+
+        steps = list(self.ride.steps.order_by("order"))
+        self.assertEqual([step.location for step in steps], [first, third])
+        self.assertEqual(steps[0].pk, kept.pk)
+        self.assertFalse(Step.objects.orphaned().exists())
+
+    def test_set_steps_constant_number_of_queries(self):
+        def count_queries(stopovers):
+            ride = RideFactory(driver=self.ride.driver)
+            with CaptureQueriesContext(connection) as ctx:
+                locations = get_or_create_locations(stopovers)
+                Ride.objects.set_steps(ride, locations)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(
+            count_queries(self.stopovers(1)), count_queries(self.stopovers(5)[1:])
+        )
+        self.assertEqual(Step.objects.count(), 5)
+
+    def test_delete_orphaned_steps(self):
+        Ride.objects.set_steps(self.ride, [LocationFactory()])
+        Step.objects.create(location=LocationFactory(), order=1)
+
+        self.assertEqual(delete_orphaned_steps(), 1)
+        self.assertEqual(Step.objects.count(), 1)
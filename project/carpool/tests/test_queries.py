@@ -0,0 +1,104 @@
+from django.contrib.gis.geos import LineString
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts.tests.factories import UserFactory
+from carpool.models import Step
+from carpool.models.reservation import Reservation
+from carpool.tests.factories import LocationFactory, RideFactory
+
+
+class QueryBudgetMixin:
+    """
+    Check that the number of queries run by a view does not depend on the
+    amount of data it displays.
+    """
+
+    sizes = (1, 10, 500)
+
+    def assertConstantQueries(self, url, seed):
+        """
+        Request `url` after each call to `seed(count)`, which must add `count`
+        objects to the page, until `sizes` objects have been created.
+        """
+        counts = {}
+        seeded = 0
+        for size in self.sizes:
+            seed(size - seeded)
+            seeded = size
+            with CaptureQueriesContext(connection) as queries:
+                r = self.client.get(url)
+            self.assertEqual(r.status_code, 200)
+            counts[size] = len(queries)
+        self.assertEqual(
+            len(set(counts.values())), 1, f"Queries count per size: {counts}"
+        )
+
+
+def route():
+    # Rennes -> Le Mans
+    return LineString((-1.6778, 48.1173), (0.1996, 48.0061), srid=4326)
+
+
+def add_step(ride):
+    ride.steps.add(Step.objects.create(location=LocationFactory(), order=1))
+
+
+class CarpoolViewsQueriesTestCase(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = UserFactory(email_verified=True)
+        self.driver = UserFactory(email_verified=True)
+        self.client.force_login(self.user)
+
+    def test_rides_list(self):
+        def seed(count):
+            for ride in RideFactory.create_batch(count, driver=self.driver):
+                add_step(ride)
+
+        self.assertConstantQueries(reverse("carpool:list"), seed)
+
+    def test_my_rides(self):
+        def seed(count):
+            for ride in RideFactory.create_batch(
+                count, driver=self.user, seats_offered=2
+            ):
+                add_step(ride)
+                ride.rider.add(self.driver)
+            for ride in RideFactory.create_batch(count, driver=self.driver):
+                add_step(ride)
+                Reservation.objects.create(user=self.user, ride=ride)
+
+        self.assertConstantQueries(reverse("carpool:my-rides"), seed)
+
+    def test_ride_detail(self):
+        ride = RideFactory(driver=self.driver, seats_offered=8, geometry=route())
+
+        def seed(count):
+            for i in range(count):
+                ride.steps.add(
+                    Step.objects.create(location=LocationFactory(), order=i + 1)
+                )
+                ride.rider.add(UserFactory())
+
+        url = reverse("carpool:detail", kwargs={"pk": ride.pk})
+        self.assertConstantQueries(url, seed)
+
+    def test_ride_delete(self):
+        self.client.force_login(self.driver)
+        ride = RideFactory(driver=self.driver, geometry=route())
+
+        def seed(count):
+            for user in UserFactory.create_batch(count):
+                ride.rider.add(user)
+
+        url = reverse("carpool:delete", kwargs={"pk": ride.pk})
+        self.assertConstantQueries(url, seed)
+
+    def test_rides_map_index(self):
+        def seed(count):
+            RideFactory.create_batch(count, driver=self.driver, geometry=route())
+
+        url = reverse("carpool:map_index") + "?bbox=-180,-90,180,90"
+        self.assertConstantQueries(url, seed)
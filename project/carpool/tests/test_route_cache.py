@@ -0,0 +1,74 @@
+from unittest.mock import AsyncMock, patch
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.tests.factories import UserFactory
+from carpool import route_cache
+from carpool.models.cache import RouteCacheEntry
+
+START = "-1.68361,48.110899"
+END = "-1.466824,47.297116"
+ROUTE = {
+    "distance": 112.5,
+    "duration": 1.3,
+    "geometry": {"type": "LineString", "coordinates": [[-1.68, 48.11], [-1.46, 47.29]]},
+}
+
+
+@override_settings(ROUTE_CACHE_PRECISION=4)
+class MakeKeyTestCase(SimpleTestCase):
+    def test_close_waypoints_share_a_key(self):
+        self.assertEqual(
+            route_cache.make_key(START, END, []),
+            route_cache.make_key("-1.683612,48.1108991", END, []),
+        )
+        self.assertNotEqual(
+            route_cache.make_key(START, END, []),
+            route_cache.make_key("-1.6837,48.110899", END, []),
+        )
+
+    def test_intermediates_are_part_of_the_key(self):
+        self.assertNotEqual(
+            route_cache.make_key(START, END, []),
+            route_cache.make_key(START, END, ["-1.5,47.8"]),
+        )
+
+    def test_invalid_waypoint(self):
+        self.assertIsNone(route_cache.make_key("rennes", END, []))
+
+
+class RouteCacheTestCase(TestCase):
+    def test_store_and_lookup(self):
+        self.assertIsNone(route_cache.lookup(START, END, []))
+        route_cache.store(START, END, [], ROUTE)
+        self.assertEqual(route_cache.lookup(START, END, []), ROUTE)
+        self.assertEqual(RouteCacheEntry.objects.get().hits, 1)
+
+    def test_errors_are_not_stored(self):
+        route_cache.store(START, END, [], {"error": "Timeout", "status_code": None})
+        self.assertFalse(RouteCacheEntry.objects.exists())
+
+    def test_expired_entries_are_ignored(self):
+        route_cache.store(START, END, [], ROUTE)
+        RouteCacheEntry.objects.update(
+            created_at=timezone.now() - timezone.timedelta(days=365)
+        )
+        self.assertIsNone(route_cache.lookup(START, END, []))
+
+
+class RoutingViewTestCase(TestCase):
+    def setUp(self):
+        self.client.force_login(UserFactory(email_verified=True))
+
+    @patch("carpool.views.api.ign.route", new_callable=AsyncMock)
+    def test_repeated_route_calls_the_api_once(self, mock_route):
+        mock_route.return_value = ROUTE
+
+        for _ in range(2):
+            r = self.client.get(
+                reverse("carpool:routing"), {"start": START, "end": END}
+            )
+            self.assertEqual(r.json(), ROUTE)
+        mock_route.assert_called_once_with(START, END, [])
@@ -0,0 +1,149 @@
+from django.contrib.auth.models import Permission
+from django.contrib.gis.geos import LineString
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.tests.factories import UserFactory
+from carpool.models.ride import Ride
+from carpool.models.statistics import MonthlyStatistics, Statistics
+from carpool.tasks import compute_daily_statistics
+from carpool.tests.factories import RideFactory, VehicleFactory
+
+# About 111 km along a meridian
+GEOMETRY = LineString((-1.5, 47.0), (-1.5, 48.0), srid=4326)
+
+
+class DailyStatisticsTestCase(TestCase):
+    def setUp(self):
+        self.start_dt = timezone.now() - timezone.timedelta(days=1)
+        self.driver = UserFactory()
+        vehicle = VehicleFactory(driver=self.driver, geqCO2_per_km=100)
+        self.ride = RideFactory(
+            driver=self.driver,
+            vehicle=vehicle,
+            geometry=GEOMETRY,
+            start_dt=self.start_dt,
+            end_dt=self.start_dt + timezone.timedelta(hours=2),
+        )
+        self.ride.rider.add(UserFactory(), UserFactory())
+
+    def test_ended_rides_are_counted_once(self):
+        # Upcoming rides are not counted yet
+        RideFactory(driver=self.driver, geometry=GEOMETRY)
+
+        compute_daily_statistics()
+        compute_daily_statistics()
+
+        self.ride.refresh_from_db()
+        self.assertTrue(self.ride.counted_in_statistics)
+        self.assertAlmostEqual(self.ride.distance_km, 111.2, places=0)
+        # 2 riders * 111.2 km * 100 g/km
+        self.assertAlmostEqual(self.ride.co2_saved_kg, 22.2, places=0)
+
+        statistics = Statistics.objects.get()
+        self.assertEqual(statistics.total_rides, 1)
+        self.assertEqual(statistics.total_users, 3)
+        self.assertAlmostEqual(statistics.total_co2, self.ride.co2_saved_kg)
+
+        start_dt = timezone.localtime(self.start_dt)
+        month = MonthlyStatistics.objects.get(year=start_dt.year, month=start_dt.month)
+        self.assertEqual(month.total_rides, 1)
+        self.assertAlmostEqual(month.total_distance, self.ride.distance_km)
+
+    def test_rebuild_month(self):
+        compute_daily_statistics()
+        # The route was changed after the ride was counted
+        Ride.objects.filter(pk=self.ride.pk).update(
+            geometry=LineString((-1.5, 47.0), (-1.5, 47.5), srid=4326)
+        )
+
+        start_dt = timezone.localtime(self.start_dt)
+        call_command("rebuild_statistics", f"{start_dt.year}-{start_dt.month:02d}")
+
+        month = MonthlyStatistics.objects.get(year=start_dt.year, month=start_dt.month)
+        self.assertAlmostEqual(month.total_distance, 55.6, places=0)
+        self.assertAlmostEqual(
+            Statistics.objects.get().total_distance, month.total_distance
+        )
+
+
+class RideStatisticsSyncTestCase(TestCase):
+    def setUp(self):
+        self.driver = UserFactory()
+        self.vehicle = VehicleFactory(driver=self.driver, geqCO2_per_km=100)
+        self.ride = RideFactory(
+            driver=self.driver, vehicle=self.vehicle, geometry=GEOMETRY
+        )
+
+    def test_distance_stored_on_save(self):
+        self.ride.refresh_from_db()
+        self.assertAlmostEqual(self.ride.distance_km, 111.2, places=0)
+        self.assertEqual(self.ride.co2_saved_kg, 0)
+
+    def test_co2_follows_riders_and_vehicle(self):
+        self.ride.rider.add(UserFactory())
+        self.ride.refresh_from_db()
+        self.assertAlmostEqual(self.ride.co2_saved_kg, 11.1, places=0)
+
+        self.vehicle.geqCO2_per_km = 200
+        self.vehicle.save()
+        self.ride.refresh_from_db()
+        self.assertAlmostEqual(self.ride.co2_saved_kg, 22.2, places=0)
+
+        self.ride.rider.clear()
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.co2_saved_kg, 0)
+
+    def test_riders_change_reuses_stored_distance(self):
+        # The route length is not computed again when only the riders change
+        Ride.objects.filter(pk=self.ride.pk).update(distance_km=50)
+        self.ride.rider.add(UserFactory())
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.distance_km, 50)
+        self.assertAlmostEqual(self.ride.co2_saved_kg, 5)
+
+    def test_counted_rides_are_frozen(self):
+        Ride.objects.filter(pk=self.ride.pk).update(counted_in_statistics=True)
+        self.ride.refresh_from_db()
+        self.ride.rider.add(UserFactory())
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.co2_saved_kg, 0)
+
+    def test_backfill_command(self):
+        Ride.objects.update(distance_km=None, co2_saved_kg=None)
+        call_command("backfill_ride_statistics", batch_size=1)
+        self.ride.refresh_from_db()
+        self.assertAlmostEqual(self.ride.distance_km, 111.2, places=0)
+
+
+class StatisticsViewsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = UserFactory()
+        user.user_permissions.add(Permission.objects.get(codename="view_statistics"))
+        self.client.force_login(user)
+
+    def test_etag_revalidation(self):
+        for name in ("carpool:bo_statistics", "carpool:bo_statistics_json_monthly"):
+            r = self.client.get(reverse(name))
+            self.assertEqual(r.status_code, 200)
+
+            r = self.client.get(reverse(name), headers={"if-none-match": r["ETag"]})
+            self.assertEqual(r.status_code, 304)
+
+    def test_snapshot_refreshed_by_daily_statistics(self):
+        url = reverse("carpool:bo_statistics_json_monthly")
+        etag = self.client.get(url)["ETag"]
+
+        # Served from the snapshot until the next run
+        Statistics.objects.update(total_rides=42)
+        r = self.client.get(reverse("carpool:bo_statistics"))
+        self.assertEqual(r.context["total_rides"], 0)
+
+        compute_daily_statistics()
+        r = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.json()["labels"]), 12)
@@ -1,12 +1,18 @@
 from accounts.tests.factories import UserFactory
 
 from django.conf import settings
-from django.test import TestCase
+from django.core.cache import cache
+from django.contrib.gis.geos import LineString
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.test import Client, RequestFactory, TestCase
 from django.urls import reverse
 
 from carpool.tests.factories import RideFactory, VehicleFactory
 from carpool.models.reservation import Reservation
 from chat.models import ChatRequest
+from project.cache import cache_anonymous_page
 
 
 class AnonymousAccessTestCase(TestCase):
@@ -26,8 +32,9 @@ class AnonymousAccessTestCase(TestCase):
         settings.ANONYMOUS_ACCESS_RIDES_LIST = True
         r = self.client.get(reverse("carpool:list"))
         self.assertEqual(r.status_code, 200)
-        self.assertIn(self.r1, r.context["rides"])
-        self.assertIn(self.r2, r.context["rides"])
+        ride_pks = [ride.pk for ride in r.context["rides"]]
+        self.assertIn(self.r1.pk, ride_pks)
+        self.assertIn(self.r2.pk, ride_pks)
 
     def test_login_required_map_view(self):
         # Test that rides map view requires login
@@ -215,4 +222,143 @@ class RideSubscriptionTestCase(TestCase):
         self.assertEqual(ride.rider.count(), 1)
 
 
-        
\ No newline at end of file
+        
+
+class RidesListCorridorTestCase(TestCase):
+    def setUp(self):
+        driver = UserFactory(email_verified=True)
+        # Rennes -> Laval -> Le Mans
+        self.ride = RideFactory(
+            driver=driver,
+            seats_offered=1,
+            geometry=LineString(
+                (-1.6778, 48.1173), (-0.7700, 48.0700), (0.1996, 48.0061), srid=4326
+            ),
+        )
+        self.url = reverse("carpool:list")
+
+    def ride_pks(self, response):
+        return [ride.pk for ride in response.context["rides"]]
+
+    def test_departure_and_arrival_along_the_route(self):
+        r = self.client.get(
+            self.url, {"d_latlng": "48.11,-1.68", "a_latlng": "48.07,-0.77"}
+        )
+        self.assertEqual(r.status_code, 200)
+        self.assertIn(self.ride.pk, self.ride_pks(r))
+
+    def test_departure_only(self):
+        r = self.client.get(self.url, {"d_latlng": "48.07,-0.77"})
+        self.assertIn(self.ride.pk, self.ride_pks(r))
+
+    def test_arrival_before_departure_is_excluded(self):
+        r = self.client.get(
+            self.url, {"d_latlng": "48.00,0.20", "a_latlng": "48.11,-1.68"}
+        )
+        self.assertNotIn(self.ride.pk, self.ride_pks(r))
+
+    def test_arrival_far_from_the_route_is_excluded(self):
+        # Brest is far away from the route
+        r = self.client.get(
+            self.url, {"d_latlng": "48.11,-1.68", "a_latlng": "48.39,-4.49"}
+        )
+        self.assertNotIn(self.ride.pk, self.ride_pks(r))
+
+    def test_invalid_coordinates(self):
+        r = self.client.get(self.url, {"a_latlng": "not,coordinates"})
+        self.assertEqual(r.status_code, 400)
+        r = self.client.get(self.url, {"d_latlng": "123.0,-1.68"})
+        self.assertEqual(r.status_code, 400)
+
+
+class RidesListCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.driver = UserFactory(email_verified=True)
+        self.ride = RideFactory(driver=self.driver)
+        self.url = reverse("carpool:list")
+
+    def test_anonymous_page_cached_until_rides_change(self):
+        r = self.client.get(self.url)
+        self.assertEqual(r.status_code, 200)
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url)
+        self.assertEqual(cached.content, r.content)
+
+        ride = RideFactory(driver=self.driver)
+        r = self.client.get(self.url)
+        self.assertIn(ride.pk, [entry.pk for entry in r.context["rides"]])
+
+    def test_anonymous_page_carries_no_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        r = client.get(self.url)
+        self.assertNotIn(b"csrfmiddlewaretoken", r.content)
+        self.assertNotIn(settings.CSRF_COOKIE_NAME, r.cookies)
+
+        # The language can still be changed from the cached page
+        r = client.post(reverse("set_user_language"), {"language": "en"})
+        self.assertEqual(r.status_code, 302)
+
+    def test_page_rendering_a_csrf_token_not_cached(self):
+        @cache_anonymous_page("test", 60)
+        def view(request):
+            return HttpResponse(get_token(request))
+
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        request.LANGUAGE_CODE = "fr"
+        first = view(request).content
+
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        request.LANGUAGE_CODE = "fr"
+        self.assertNotEqual(view(request).content, first)
+
+    def test_authenticated_page_not_cached(self):
+        self.client.get(self.url)
+        self.client.force_login(self.driver)
+        r = self.client.get(self.url)
+        self.assertIsNotNone(r.context)
+
+
+class RidesMapTestCase(TestCase):
+    def setUp(self):
+        driver = UserFactory(email_verified=True)
+        # Rennes -> Laval -> Le Mans
+        self.ride = RideFactory(
+            driver=driver,
+            geometry=LineString(
+                (-1.6778, 48.1173), (-0.7700, 48.0700), (0.1996, 48.0061), srid=4326
+            ),
+        )
+        self.client.force_login(UserFactory(email_verified=True))
+
+    def test_index_returns_rides_in_bbox(self):
+        r = self.client.get(reverse("carpool:map_index"), {"bbox": "-2,47.5,1,48.5"})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(
+            [ride["uuid"] for ride in r.json()["rides"]], [str(self.ride.pk)]
+        )
+
+        # Around Brest
+        r = self.client.get(reverse("carpool:map_index"), {"bbox": "-5,48,-4,49"})
+        self.assertEqual(r.json()["rides"], [])
+
+    def test_index_invalid_bbox(self):
+        r = self.client.get(reverse("carpool:map_index"), {"bbox": "-2,47.5,1"})
+        self.assertEqual(r.status_code, 400)
+
+    def test_tiles(self):
+        r = self.client.get(reverse("carpool:map_tiles", args=[0, 0, 0]))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r["Content-Type"], "application/vnd.mapbox-vector-tile")
+        self.assertGreater(len(r.content), 0)
+
+        # Tile over Australia, without any ride
+        r = self.client.get(reverse("carpool:map_tiles", args=[4, 14, 9]))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.content), 0)
+
+    def test_tiles_out_of_range(self):
+        r = self.client.get(reverse("carpool:map_tiles", args=[1, 2, 0]))
+        self.assertEqual(r.status_code, 400)
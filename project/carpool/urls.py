@@ -12,6 +12,7 @@ from carpool.views import (
 )
 from carpool.views import api as api_views
 from carpool.views import backoffice as bo_views
+from carpool.views import map as map_views
 from carpool.views import vehicle as vehicle_views
 from carpool.views import rides as rides_views
 from chat.views import request_chat
@@ -24,6 +25,12 @@ urlpatterns = [
     path("<uuid:pk>/", rides_detail, name="detail"),
     path("<uuid:pk>/delete/", rides_delete, name="delete"),
     path("map/", rides_map, name="map"),
+    path("map/rides/", map_views.rides_map_index, name="map_index"),
+    path(
+        "map/tiles/<int:z>/<int:x>/<int:y>.pbf",
+        map_views.rides_tiles,
+        name="map_tiles",
+    ),
     path("<uuid:ride_pk>/chat/", request_chat, name="chat"),
     path("<uuid:ride_pk>/subscribe/", rides_subscribe, name="subscribe"),
 ]
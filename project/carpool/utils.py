@@ -1,12 +1,65 @@
-from carpool.models import Location
+from django.contrib.gis.geos import Point
+
+from carpool.models import Location, location_hash
+
+
+def location_fields(data):
+    """The Location fields of the cleaned data of a LocationForm."""
+    return {
+        "fulltext": data["fulltext"],
+        "street": data.get("street") or "",
+        "zipcode": data["zipcode"],
+        "city": data["city"],
+        "lat": data["latitude"],
+        "lng": data["longitude"],
+    }
 
 
 def get_or_create_location(data):
-    return Location.objects.get_or_create(
-        fulltext=data["fulltext"],
-        street=data.get("street"),
-        zipcode=data["zipcode"],
-        city=data["city"],
-        lat=data["latitude"],
-        lng=data["longitude"],
-    )[0]
+    """Return the location of an address, created if it is not known yet.
+
+    Looked up by its hash, on a unique index.
+    """
+    return get_or_create_locations([data])[0]
+
+
+def get_or_create_locations(data_list):
+    """Return the locations of several addresses, in the same order.
+
+    The known locations are fetched in one query and the missing ones are
+    created with a single bulk_create, so the number of queries does not
+    depend on the number of addresses.
+    """
+    fields_list = [location_fields(data) for data in data_list]
+    hashes = [location_hash(**fields) for fields in fields_list]
+    locations = Location.objects.in_bulk(hashes, field_name="address_hash")
+
+    missing = {
+        address_hash: Location(
+            address_hash=address_hash,
+            # bulk_create does not call Location.save, which sets the point and hash
+            point=Point(float(fields["lng"]), float(fields["lat"]), srid=4326),
+            **fields,
+        )
+        for address_hash, fields in zip(hashes, fields_list)
+        if address_hash not in locations
+    }
+    if missing:
+        # A concurrent request may have created the same location meanwhile
+        Location.objects.bulk_create(missing.values(), ignore_conflicts=True)
+        locations.update(
+            Location.objects.in_bulk(list(missing), field_name="address_hash")
+        )
+
+    return [locations[address_hash] for address_hash in hashes]
+
+
+def parse_latlng(value):
+    """Parse a "latitude,longitude" string into a WGS84 point.
+
+    Raise ValueError if the string is malformed or out of bounds.
+    """
+    lat, lng = map(float, value.split(","))
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError(f"Coordinates out of bounds: {value}")
+    return Point(lng, lat, srid=4326)  # (lng, lat) — correct order for GEOS
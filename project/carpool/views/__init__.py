@@ -1,5 +1,4 @@
 import datetime
-import json
 
 from chat.models import ChatRequest
 from carpool.tasks import (
@@ -10,30 +9,34 @@ from carpool.tasks import (
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.contrib.gis.db.models.functions import Distance
-from django.contrib.gis.geos import Point
-from django.contrib.gis.measure import D
 from django.core.paginator import Paginator
-from django.db.models import Count, ExpressionWrapper, F, IntegerField
-from django.db.models.functions import TruncDate
+from django.db import transaction
+from django.db.models import Prefetch
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
-from django.utils.timezone import localtime
 from django.utils.translation import gettext as _
 from django.views.decorators.http import require_http_methods
-from carpool.templatetags.duration import duration
+from carpool.utils import parse_latlng
 
 from carpool.models.reservation import Reservation
 from carpool.models.ride import Ride
+from carpool.models.search import CACHE_NAMESPACE, RideSearchEntry
+from project.cache import cache_anonymous_page, namespace_version
 
 import logging
 
 
 @login_required
 def list_my_rides(request):
-    p_rides = Ride.objects.filter(driver=request.user).order_by("-start_dt")
-    s_rides = Reservation.objects.filter(user=request.user).order_by("-ride__start_dt")
+    p_rides = (
+        Ride.objects.filter(driver=request.user).with_card_data().order_by("-start_dt")
+    )
+    s_rides = (
+        Reservation.objects.filter(user=request.user)
+        .prefetch_related(Prefetch("ride", queryset=Ride.objects.with_card_data()))
+        .order_by("-ride__start_dt")
+    )
 
     s_paginator = Paginator(s_rides, 3)
     p_paginator = Paginator(p_rides, 3)
@@ -47,6 +50,8 @@ def list_my_rides(request):
     context = {
         "s_page_obj": s_page_obj,
         "p_page_obj": p_page_obj,
+        "rides_cache_version": namespace_version(CACHE_NAMESPACE),
+        "ride_card_cache_timeout": settings.RIDE_CARD_CACHE_TIMEOUT,
     }
 
     return render(request, "rides/my_rides.html", context)
@@ -54,34 +59,8 @@ def list_my_rides(request):
 
 @login_required
 def rides_map(request):
-    rides = Ride.objects.filter_upcoming()
-    rides_geo = []
-
-    for ride in rides:
-        if ride.geometry:
-            start_dt_local = localtime(ride.start_dt)
-            rides_geo.append(
-                {
-                    "start": [ride.start_loc.lat, ride.start_loc.lng],
-                    "end": [ride.end_loc.lat, ride.end_loc.lng],
-                    "geometry": json.loads(
-                        ride.geometry.geojson
-                    ),  # supposé être une chaîne GeoJSON valide
-                    "uuid": str(ride.uuid),
-                    "start_name": ride.start_loc.fulltext,
-                    "start_lat": ride.start_loc.lat,
-                    "start_lon": ride.start_loc.lng,
-                    "end_name": ride.end_loc.fulltext,
-                    "end_lat": ride.end_loc.lat,
-                    "end_lon": ride.end_loc.lng,
-                    "start_dt": start_dt_local.isoformat(),
-                    "price": ride.price,
-                    "duration": duration(ride.duration),
-                }
-            )
-
-    context = {"rides_geo": rides_geo}
-    return render(request, "rides/map.html", context)
+    # Routes and rides are loaded by the page from the tiles and index endpoints
+    return render(request, "rides/map.html")
 
 
 @require_http_methods(["POST"])
@@ -121,32 +100,37 @@ def update_reservation(request):
     if request.user != reservation.ride.driver:
         return HttpResponse("You are not the driver of this ride.", status=403)
 
-    if reservation.status == Reservation.Status.CANCELED:
-        return HttpResponse("This reservation is already canceled.", status=400)
-
     action = request.POST.get("action")
 
-    if action == "accept":
-        if (
-            reservation.ride.is_full
-            and reservation.status != Reservation.Status.ACCEPTED
-        ):
-            return HttpResponse("This ride is fully booked.", status=409)
-        reservation.status = Reservation.Status.ACCEPTED
-        send_email_confirmed_ride.delay(reservation.pk)
-        reservation.ride.rider.add(reservation.user)
-
-    elif action == "decline":
-        reservation.status = Reservation.Status.DECLINED
-        if reservation.user in reservation.ride.rider.all():
-            # Check if the user is already in the ride's riders
-            reservation.ride.rider.remove(reservation.user)
-
-        send_email_declined_ride.delay(reservation.pk)
-    else:
+    if action not in ("accept", "decline"):
         return HttpResponse("Invalid action", status=400)
 
-    reservation.save()
+    # The email is queued in the outbox together with the status change
+    with transaction.atomic():
+        # Locked, so that concurrent clicks only handle the reservation once
+        reservation = Reservation.objects.select_for_update().get(pk=reservation.pk)
+        if reservation.status == Reservation.Status.CANCELED:
+            return HttpResponse("This reservation is already canceled.", status=400)
+
+        if action == "accept":
+            if reservation.status != Reservation.Status.ACCEPTED and (
+                not Ride.objects.book_seat(reservation.ride, reservation.user)
+            ):
+                return HttpResponse("This ride is fully booked.", status=409)
+            reservation.status = Reservation.Status.ACCEPTED
+        else:
+            reservation.status = Reservation.Status.DECLINED
+            if reservation.user in reservation.ride.rider.all():
+                # Check if the user is already in the ride's riders
+                reservation.ride.rider.remove(reservation.user)
+
+        reservation.save()
+
+        if action == "accept":
+            send_email_confirmed_ride(reservation.pk)
+        else:
+            send_email_declined_ride(reservation.pk)
+
     return redirect(next_url)
 
 
@@ -173,15 +157,15 @@ def rides_subscribe(request, ride_pk):
             messages.error(request, _("You have already booked this ride."))
             return redirect("carpool:detail", pk=ride.pk)
 
-        # Subscribe the user to the ride
-        reservation = ride.reservations.create(user=request.user)
-        logging.info(f"User {request.user} booked ride {ride.pk}")
-
+        # Subscribe the user to the ride, and notify the driver
         site_url = request.scheme + "://" + request.get_host()
-        send_email_incoming_reservation_to_driver.delay(
-            site_url,
-            reservation_pk=reservation.pk,
-        )
+        with transaction.atomic():
+            reservation = ride.reservations.create(user=request.user)
+            send_email_incoming_reservation_to_driver(
+                site_url,
+                reservation_pk=reservation.pk,
+            )
+        logging.info(f"User {request.user} booked ride {ride.pk}")
 
         messages.success(request, _("You have successfully booked this ride."))
 
@@ -205,11 +189,11 @@ def rides_detail(request, pk):
     ).first()
     chat_request = ChatRequest.objects.filter(user=request.user, ride__pk=pk).first()
 
-    ride = get_object_or_404(Ride, pk=pk)
-    steps = ride.steps.order_by("order")
+    ride = get_object_or_404(Ride.objects.with_detail_data(), pk=pk)
 
     steps_json = [
-        {"lat": step.location.lat, "lng": step.location.lng} for step in steps
+        {"lat": step.location.lat, "lng": step.location.lng}
+        for step in ride.steps.all()
     ]
 
     context = {
@@ -225,7 +209,7 @@ def rides_detail(request, pk):
 
 @login_required
 def rides_delete(request, pk):
-    ride = get_object_or_404(Ride, pk=pk)
+    ride = get_object_or_404(Ride.objects.with_detail_data(), pk=pk)
     # Check if user has permission
     if ride.driver != request.user:
         return HttpResponse("You are not the driver of this ride", status=403)
@@ -251,9 +235,13 @@ def rides_list(request):
     if not settings.ANONYMOUS_ACCESS_RIDES_LIST and not request.user.is_authenticated:
         # We have a global setting that disable anonymous access to the rides list
         return redirect(f"{reverse('accounts:login')}?next={request.path}")
+    return render_rides_list(request)
 
-    # Get all rides that are whether today's date or in the future
-    rides = Ride.objects.filter_upcoming()
+
+@cache_anonymous_page(CACHE_NAMESPACE, settings.RIDES_LIST_CACHE_TIMEOUT)
+def render_rides_list(request):
+    # Get all rides that are whether today's date or in the future and not full
+    rides = RideSearchEntry.objects.filter_upcoming().filter_available()
 
     # ====================================================== #
     # Filters
@@ -262,45 +250,33 @@ def rides_list(request):
     filter_start = request.GET.get("d_latlng", "")
     filter_end = request.GET.get("a_latlng", "")
 
-    rides = rides.annotate(
-        booked_seats_count=Count("rider", distinct=True),
-        remaining_seats_count=ExpressionWrapper(
-            F("vehicle__seats") - Count("rider", distinct=True),
-            output_field=IntegerField(),
-        ),
-    ).exclude(remaining_seats_count__lte=0)
-
     if filter_date:
         # Get rides for a specific date
         filter_date = datetime.datetime.strptime(filter_date, "%Y-%m-%d").date()
-        rides = rides.filter(start_dt__date=filter_date)
-
-    if filter_start:
-        # Do the postgis check if the location is within 10km of the geometry
-        # Check if filter_start is in the format "longitude,latitude"
-        try:
-            lat, lng = map(float, filter_start.split(","))
-            point = Point(lng, lat, srid=4326)  # (lng, lat) — correct order for GEOS
-            # Annotate rides with distance from the point
-            rides = rides.annotate(distance=Distance("geometry", point))
-            rides = rides.filter(distance__lte=D(km=10))
-        except ValueError:
-            print("Invalid coordinates :", filter_start)
-            return HttpResponse(
-                "Invalid coordinates format for start location",
-                status=400,
-            )
+        rides = rides.filter(start_date=filter_date)
 
-    if filter_end:
-        # Do the postgis check if the location is within 10km of the geometry
-        # Do nothing for now (or it will be to exclusive to the rides)
-        # TODO: implement it properly
-        pass
+    # Keep only rides whose route passes near the departure and/or arrival
+    try:
+        departure = parse_latlng(filter_start) if filter_start else None
+    except ValueError:
+        logging.warning(f"Invalid coordinates for start location: {filter_start}")
+        return HttpResponse(
+            "Invalid coordinates format for start location",
+            status=400,
+        )
+    try:
+        arrival = parse_latlng(filter_end) if filter_end else None
+    except ValueError:
+        logging.warning(f"Invalid coordinates for end location: {filter_end}")
+        return HttpResponse(
+            "Invalid coordinates format for end location",
+            status=400,
+        )
 
-    rides = rides.annotate(ride_date=TruncDate("start_dt")).order_by(
-        "ride_date",
-        "start_dt",
-    )
+    if departure is not None or arrival is not None:
+        rides = rides.filter_corridor(departure=departure, arrival=arrival)
+
+    rides = rides.order_by("start_date", "start_dt")
 
     paginator = Paginator(rides, 8)  # Show 4 rides per page.
 
@@ -321,5 +297,7 @@ def rides_list(request):
         "rides": page_obj.object_list,
         "page_obj": page_obj,
         "querystring": querystring,
+        "rides_cache_version": namespace_version(CACHE_NAMESPACE),
+        "ride_card_cache_timeout": settings.RIDE_CARD_CACHE_TIMEOUT,
     }
     return render(request, "rides/list.html", context)
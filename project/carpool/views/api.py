@@ -1,7 +1,10 @@
+import logging
+
+import httpx
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from asgiref.sync import sync_to_async
-from carpool.tasks import get_autocompletion, get_routing
+from carpool import geocoding, ign, route_cache
 
 
 @login_required
@@ -14,8 +17,17 @@ async def autocompletion(request) -> JsonResponse:
     if not text:
         return JsonResponse({"status": "NOK"}, status=400)
 
-    task = get_autocompletion.delay(text)
-    result = await sync_to_async(task.get)(timeout=5)  # blocking I/O offloaded
+    # Answered in-process when possible, then from the database caches
+    result = geocoding.lookup_memory(text)
+    if result is None:
+        result = await sync_to_async(geocoding.lookup)(text)
+    if result is None:
+        try:
+            result = await ign.autocomplete(text)
+        except httpx.HTTPError as e:
+            logging.warning(f"Autocompletion failed for {text!r}: {e}")
+            return JsonResponse({"status": "NOK"}, status=502)
+        await sync_to_async(geocoding.store)(text, result)
     return JsonResponse({"status": "OK", "results": result}, safe=False, status=200)
 
 
@@ -27,10 +39,11 @@ async def routing(request) -> JsonResponse:
     start = request.GET.get("start", "")
     end = request.GET.get("end", "")
     intermediates = request.GET.getlist("intermediates", [])
-    print(intermediates)
 
     if not start or not end:
         return JsonResponse({"status": "NOK"}, status=400)
-    task = get_routing.delay(start, end, intermediates)
-    res = await sync_to_async(task.get)(timeout=5)  # blocking I/O offloaded
+    res = await sync_to_async(route_cache.lookup)(start, end, intermediates)
+    if res is None:
+        res = await ign.route(start, end, intermediates)
+        await sync_to_async(route_cache.store)(start, end, intermediates, res)
     return JsonResponse(res, safe=False)
@@ -1,52 +1,49 @@
+from django.contrib.auth.decorators import permission_required
 from django.http import JsonResponse
 from django.shortcuts import render
-from django.utils import timezone
-from django.contrib.auth.decorators import permission_required
-from carpool.models.statistics import Statistics, MonthlyStatistics
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from carpool import dashboard
+
+
+def get_snapshot(request):
+    """The statistics snapshot, read from the cache once per request."""
+    if not hasattr(request, "_statistics_snapshot"):
+        request._statistics_snapshot = dashboard.get_snapshot()
+    return request._statistics_snapshot
+
+
+def statistics_last_modified(request):
+    return get_snapshot(request)["updated_at"]
+
+
+def statistics_json_etag(request):
+    return get_snapshot(request)["version"]
+
+
+def statistics_etag(request):
+    # The page also shows the logged in user, in their language
+    return "-".join(
+        [get_snapshot(request)["version"], str(request.user.pk), request.LANGUAGE_CODE]
+    )
 
 
 @permission_required(["carpool.view_statistics"])
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=statistics_json_etag, last_modified_func=statistics_last_modified)
 def statistics_json_monthly(request):
-    # Get labels for the current academic year (from September to August)
-    now = timezone.now()
-    if now.month >= 9:
-        start_year = now.year
-    else:
-        start_year = now.year - 1
-    labels = []
-    for month in range(9, 13):
-        labels.append(f"{month:02d}-{start_year}")
-    for month in range(1, 9):
-        labels.append(f"{month:02d}-{start_year + 1}")
-    monthly_stats = MonthlyStatistics.objects.filter_by_academic_year(start_year)
-    monthly_total_rides = [stat.total_rides for stat in monthly_stats]
-    monthly_total_users = [stat.total_users for stat in monthly_stats]
-    monthly_total_distance = [stat.total_distance for stat in monthly_stats]
-    monthly_total_co2 = [stat.total_co2 for stat in monthly_stats]
-
-    data = {
-        "labels": labels,
-        "monthly_total_rides": monthly_total_rides,
-        "monthly_total_users": monthly_total_users,
-        "monthly_total_distance": monthly_total_distance,
-        "monthly_total_co2": monthly_total_co2,
-    }
-
-    return JsonResponse(data)
+    return JsonResponse(get_snapshot(request)["monthly"])
 
 
 @permission_required(["carpool.view_statistics"])
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=statistics_etag, last_modified_func=statistics_last_modified)
 def statistics(request):
-    if Statistics.objects.count() == 0:
-        # Create the Statistics object if it does not exist
-        Statistics.objects.create()
-
+    snapshot = get_snapshot(request)
     context = {
-        "last_updated_at": Statistics.objects.first().updated_at,
-        "total_users": Statistics.objects.first().total_users,
-        "total_rides": Statistics.objects.first().total_rides,
-        "total_distance": Statistics.objects.first().total_distance,
-        "total_co2": Statistics.objects.first().total_co2,
+        "last_updated_at": snapshot["updated_at"],
+        **snapshot["totals"],
     }
 
     return render(request, "rides/back-office/statistics.html", context)
@@ -0,0 +1,134 @@
+import datetime
+
+from django.contrib.auth.decorators import login_required
+from django.contrib.gis.geos import Polygon
+from django.db import connection
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.timezone import localtime
+from django.views.decorators.cache import cache_control
+
+from carpool.models.search import RideSearchEntry
+from carpool.templatetags.duration import duration
+
+# Vector tiles are generated from zoom 0 (whole world) up to this zoom
+MAX_TILE_ZOOM = 20
+# Resolution of the generated tiles, the Mapbox Vector Tile default
+TILE_EXTENT = 4096
+# Width of the world in Web Mercator (EPSG:3857) meters
+WEB_MERCATOR_WORLD_SIZE = 40075016.68557849
+# Maximum number of rides returned by the map index endpoint
+MAP_INDEX_MAX_RIDES = 500
+
+TILE_SQL = f"""
+WITH bounds AS (
+    SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom
+),
+rides AS (
+    SELECT
+        ST_AsMVTGeom(
+            ST_SimplifyPreserveTopology(
+                ST_Transform(entry.geometry, 3857), %(tolerance)s
+            ),
+            bounds.geom,
+            %(extent)s
+        ) AS geom,
+        entry.ride_id::text AS uuid
+    FROM {RideSearchEntry._meta.db_table} AS entry, bounds
+    WHERE entry.geometry && ST_Transform(bounds.geom, 4326)
+      AND entry.start_date BETWEEN %(min_date)s AND %(max_date)s
+)
+SELECT ST_AsMVT(rides.*, 'rides', %(extent)s, 'geom')
+FROM rides
+WHERE rides.geom IS NOT NULL
+"""
+
+
+def tile_tolerance(z):
+    """Size in meters of a screen pixel at zoom z, used to simplify the routes.
+
+    Details smaller than a pixel are not visible, so the routes sent in a tile
+    do not need to be more precise than that.
+    """
+    return WEB_MERCATOR_WORLD_SIZE / (256 * 2**z)
+
+
+def get_date_range(request):
+    """Return the (min, max) start dates of the rides to display on the map.
+
+    Defaults to the upcoming rides, or the rides of a single day when the
+    `start_dt` query parameter is given. Raises ValueError if it is invalid.
+    """
+    filter_date = request.GET.get("start_dt", "")
+    if filter_date:
+        day = datetime.datetime.strptime(filter_date, "%Y-%m-%d").date()
+        return day, day
+    return timezone.localdate(), datetime.date.max
+
+
+@login_required
+@cache_control(private=True, max_age=60)
+def rides_tiles(request, z, x, y):
+    """Mapbox Vector Tile of the upcoming rides routes in the given tile."""
+    if z > MAX_TILE_ZOOM or x >= 2**z or y >= 2**z:
+        return HttpResponse("Invalid tile coordinates", status=400)
+    try:
+        min_date, max_date = get_date_range(request)
+    except ValueError:
+        return HttpResponse("Invalid date format", status=400)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            TILE_SQL,
+            {
+                "z": z,
+                "x": x,
+                "y": y,
+                "tolerance": tile_tolerance(z),
+                "extent": TILE_EXTENT,
+                "min_date": min_date,
+                "max_date": max_date,
+            },
+        )
+        tile = cursor.fetchone()[0]
+
+    return HttpResponse(
+        bytes(tile or b""), content_type="application/vnd.mapbox-vector-tile"
+    )
+
+
+@login_required
+def rides_map_index(request):
+    """Lightweight list of the upcoming rides whose route crosses a bbox.
+
+    The bbox is given as `min_lng,min_lat,max_lng,max_lat`. Only the data shown
+    in the map markers and ride card are returned, the routes come from tiles.
+    """
+    try:
+        bbox = [float(value) for value in request.GET.get("bbox", "").split(",")]
+        polygon = Polygon.from_bbox(bbox)
+        polygon.srid = 4326
+        min_date, max_date = get_date_range(request)
+    except ValueError:
+        return HttpResponse("Invalid bbox or date format", status=400)
+
+    rides = RideSearchEntry.objects.filter(
+        geometry__bboverlaps=polygon,
+        start_date__range=(min_date, max_date),
+    ).order_by("start_dt")[:MAP_INDEX_MAX_RIDES]
+
+    rides_geo = []
+    for ride in rides:
+        rides_geo.append(
+            {
+                "uuid": str(ride.pk),
+                "start": [ride.start_point.y, ride.start_point.x],
+                "end": [ride.end_point.y, ride.end_point.x],
+                "start_name": ride.start_fulltext,
+                "end_name": ride.end_fulltext,
+                "start_dt": localtime(ride.start_dt).isoformat(),
+                "price": ride.price,
+                "duration": duration(ride.duration) if ride.duration else "",
+            }
+        )
+    return JsonResponse({"rides": rides_geo})
@@ -4,15 +4,15 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.gis.geos import GEOSGeometry
 from django.shortcuts import redirect, render, get_object_or_404
 from django.core.exceptions import PermissionDenied
+from django.db import transaction
 from django.utils import timezone
 from django.utils.timezone import timedelta, datetime
 from django.contrib import messages
 from django.utils.translation import gettext as _
 
 from carpool.forms.ride import CreateRideStep1Form, CreateRideStep2Form, EditRideForm
-from carpool.models import Step
 from carpool.models.ride import Ride
-from carpool.utils import get_or_create_location
+from carpool.utils import get_or_create_locations
 
 
 @login_required
@@ -63,13 +63,6 @@ def create_step2(request):
     if request.method == "POST":
         form = CreateRideStep2Form(request.POST)
         if form.is_valid():
-            # Create or get locations
-            d_data = step1_data.pop("departure")
-            departure = get_or_create_location(d_data)
-            a_data = step1_data.pop("arrival")
-            arrival = get_or_create_location(a_data)
-            stopovers_data = step1_data.pop("stopovers", [])
-
             # Compute datetime and geometry fields
             start_dt = datetime.fromisoformat(step1_data.pop("departure_datetime"))
             duration = timedelta(hours=step1_data.pop("r_duration", 0))
@@ -81,20 +74,22 @@ def create_step2(request):
             step1_data["start_dt"] = start_dt
             step1_data["end_dt"] = start_dt + duration
             step1_data["duration"] = duration
-            step1_data["start_loc"] = departure
-            step1_data["end_loc"] = arrival
-
-            ride_data = {**step1_data, **form.cleaned_data}
-            ride = Ride.objects.create(**ride_data)
-
-            # Handle stopovers
-            for index, stepover in enumerate(stopovers_data):
-                so_location = get_or_create_location(stepover)
-                step = Step.objects.create(
-                    order=index + 1,
-                    location=so_location,
+
+            with transaction.atomic():
+                # Create or get the locations, stopovers included, all at once
+                departure, arrival, *stopovers = get_or_create_locations(
+                    [
+                        step1_data.pop("departure"),
+                        step1_data.pop("arrival"),
+                        *step1_data.pop("stopovers", []),
+                    ]
                 )
-                ride.steps.add(step)
+                step1_data["start_loc"] = departure
+                step1_data["end_loc"] = arrival
+
+                ride_data = {**step1_data, **form.cleaned_data}
+                ride = Ride.objects.create(**ride_data)
+                Ride.objects.set_steps(ride, stopovers)
 
             return redirect("carpool:detail", pk=ride.pk)
 
@@ -0,0 +1,125 @@
+"""
+Write-behind buffer of the chat messages.
+
+When CHAT_WRITE_BEHIND is enabled, ChatConsumer broadcasts a message as soon
+as it is received and hands it to this buffer, which saves the messages of
+all the connections of the process with one bulk_create every
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL milliseconds, or as soon as
+CHAT_WRITE_BEHIND_BATCH_SIZE messages are waiting. A callback is called for
+each message once it is saved (or could not be), so the consumer can
+acknowledge it.
+
+The buffer is flushed when a websocket disconnects and on the ASGI lifespan
+shutdown, so no message is lost on a graceful shutdown.
+"""
+
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+
+class MessageBuffer:
+    def __init__(self):
+        self._pending = []
+        self._flusher = None
+        self._full = None
+
+    @property
+    def flush_interval(self):
+        """In seconds."""
+        return settings.CHAT_WRITE_BEHIND_FLUSH_INTERVAL / 1000
+
+    @property
+    def batch_size(self):
+        return settings.CHAT_WRITE_BEHIND_BATCH_SIZE
+
+    def add(self, message, callback):
+        """Queue an unsaved ChatMessage.
+
+        `callback(message, error)` is awaited once the message is saved,
+        with `error` set to the exception if it could not be.
+        """
+        self._pending.append((message, callback))
+        if self._flusher is None or self._flusher.done():
+            self._full = asyncio.Event()
+            self._flusher = asyncio.get_running_loop().create_task(self._run())
+        elif len(self._pending) >= self.batch_size:
+            self._full.set()
+
+    async def _run(self):
+        # Nothing can be added between the last check and the end of the task,
+        # as there is no await in between
+        while self._pending:
+            if len(self._pending) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except TimeoutError:
+                    pass
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Save the waiting messages now."""
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        errors = await sync_to_async(self._save)([message for message, _ in batch])
+        for message, callback in batch:
+            try:
+                await callback(message, errors.get(id(message)))
+            except Exception:
+                logger.exception("Chat message callback failed.")
+
+    @staticmethod
+    def _save(messages):
+        """Save the messages, one by one if the batch fails.
+
+        Returns the errors by id() of the messages that could not be saved.
+        """
+        from chat.models import ChatMessage
+
+        try:
+            ChatMessage.objects.bulk_create(messages)
+            return {}
+        except DatabaseError:
+            logger.exception(
+                f"Failed to save a batch of {len(messages)} chat messages, "
+                "saving them one by one."
+            )
+
+        errors = {}
+        for message in messages:
+            try:
+                message.save()
+            except DatabaseError as e:
+                logger.exception("Failed to save a chat message.")
+                errors[id(message)] = e
+        return errors
+
+    async def close(self):
+        """Save everything that is waiting, used on shutdown."""
+        if self._flusher is not None and not self._flusher.done():
+            self._full.set()
+            await self._flusher
+        await self.flush()
+
+
+message_buffer = MessageBuffer()
+
+
+async def lifespan(scope, receive, send):
+    """ASGI lifespan application, flushes the buffered messages on shutdown."""
+    while True:
+        event = await receive()
+        if event["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif event["type"] == "lifespan.shutdown":
+            await message_buffer.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -1,209 +1,305 @@
 import json
 import logging
+from datetime import datetime
+from uuid import UUID, uuid4
 
 from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.db.models import F
 from django.utils import timezone
 
+from chat.buffer import message_buffer
 
-class ChatConsumer(AsyncWebsocketConsumer):
-    # TODO: simplify the logic by using external functions for permission checks and message retrieval
-    async def connect(self):
-        from chat.models import ChatMessage, ChatRequest
+# Number of messages sent on connection and for each load_more action
+HISTORY_PAGE_SIZE = 50
 
-        self.user = self.scope["user"]
-        self.room_name = self.scope["url_route"]["kwargs"]["jr_pk"]
-        self.room_group_name = f"chat_{self.room_name}"
 
-        self.chat_request = await sync_to_async(ChatRequest.objects.filter)(
-            pk=self.room_name,
-        )
+def serialize_message(message, is_moderator):
+    """Message of the history, the content of hidden messages is only sent to moderators."""
+    return {
+        "id": message["pk"],
+        "message": "This message has been removed."
+        if message["hidden"] and not is_moderator
+        else message["content"],
+        "timestamp": message["timestamp"].isoformat(),
+        "user_uuid": str(message["sender__uuid"]),
+        "hidden": message["hidden"],
+        "read": message["read_at"] is not None,
+    }
 
-        if not await self.chat_request.aexists():
-            logging.error(f"ChatRequest with pk {self.room_name} does not exist.")
-            await self.close()
-            return
 
-        self.chat_request = await self.chat_request.afirst()
+def parse_client_id(client_id):
+    """The message ID generated by the client, or a new one if it is not valid."""
+    try:
+        return UUID(client_id)
+    except (TypeError, ValueError, AttributeError):
+        return uuid4()
+
+
+def parse_cursor(cursor):
+    """Return the (timestamp, id) of a history cursor sent by a client, or None."""
+    try:
+        return datetime.fromisoformat(cursor["timestamp"]), int(cursor["id"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def parse_room(room):
+    """Return the chat request UUID of a room sent by a client, or None."""
+    try:
+        return UUID(room)
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def room_group_name(chat_request_pk):
+    """Channel layer group of the connections to a chat room."""
+    return f"chat_{chat_request_pk}"
+
+
+def user_group_name(user_pk):
+    """Channel layer group of all the chat connections of a user.
+
+    Used to tell them that the role of the user must be computed again, or
+    that they were sent a new chat request.
+    """
+    return f"chat_user_{user_pk}"
+
+
+class BaseChatConsumer(AsyncWebsocketConsumer):
+    """Handling of the actions and events of chat rooms.
+
+    The frames are tagged with the room (chat request UUID) they belong to, so
+    one connection can be subscribed to several rooms. The chat requests are
+    loaded with ChatRequest.objects.with_role, their `is_moderator` and
+    `is_blocked` annotations are the role of the user in the room.
+    """
+
+    async def send_json(self, data):
+        await self.send(text_data=json.dumps(data))
 
-        is_participant = await sync_to_async(
-            lambda: self.user
-            in [self.chat_request.user, self.chat_request.ride.driver],
-        )()
+    async def send_history(self, chat_request, before=None):
+        """Send a page of the newest messages (before the cursor) in one frame."""
+        from chat.models import ChatMessage
 
-        is_moderator = await sync_to_async(self.user.has_perm)(
-            "chat.can_moderate_messages",
+        messages = await sync_to_async(list)(
+            ChatMessage.objects.history(chat_request, before).values(
+                "pk", "sender__uuid", "content", "timestamp", "hidden", "read_at"
+            )[: HISTORY_PAGE_SIZE + 1]
+        )
+        has_more = len(messages) > HISTORY_PAGE_SIZE
+        # Oldest first, as they are displayed
+        messages = messages[:HISTORY_PAGE_SIZE][::-1]
+
+        await self.send_json(
+            {
+                "type": "chat.history",
+                "room": str(chat_request.pk),
+                "messages": [
+                    serialize_message(message, chat_request.is_moderator)
+                    for message in messages
+                ],
+                "has_more": has_more,
+                # Cursor of the next page, sent back with the load_more action
+                "cursor": {
+                    "timestamp": messages[0]["timestamp"].isoformat(),
+                    "id": messages[0]["pk"],
+                }
+                if messages
+                else None,
+            },
         )
 
-        if self.user.is_anonymous or (not is_participant and not is_moderator):
-            logging.error(
-                f"User {self.user.username} attempted to join chat room {self.room_name} without permission. (Anonymous: {self.user.is_anonymous}, "
-                f"Participant: {is_participant}, Moderator: {is_moderator})",
-            )
-            await self.close()
-            return
+    async def count_unread(self, chat_request):
+        """Count a new message of the user as unread by the other participants."""
+        from chat.models import ChatRequest
 
-        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
+        await ChatRequest.objects.filter(pk=chat_request.pk).aupdate(
+            **{
+                field: F(field) + 1
+                for user_pk, field in chat_request.unread_counters().items()
+                if user_pk != self.user.pk
+            }
+        )
 
-        # Send previous messages with user UUIDs
-        previous_messages = await sync_to_async(list)(
-            ChatMessage.objects.filter(chat_request=self.chat_request)
-            .select_related("sender")
-            .order_by("timestamp")[:50]
-            .values("pk", "sender__uuid", "content", "timestamp", "hidden"),
+    async def mark_read(self, chat_request):
+        """Mark the messages of the room as read by the user, and tell the room."""
+        from chat.models import ChatMessage, ChatRequest
+
+        field = chat_request.unread_counters().get(self.user.pk)
+        if field is None:
+            # Moderators don't read the messages for the participants
+            return
+
+        logging.debug(
+            f"User {self.user.username} is marking messages as read in chat {chat_request.pk}.",
+        )
+        # Reset first: a message sent in between may stay counted, but is never missed
+        await ChatRequest.objects.filter(pk=chat_request.pk).aupdate(**{field: 0})
+        chats = await (
+            ChatMessage.objects.filter(
+                chat_request=chat_request,
+                read_at__isnull=True,
+            )
+            .exclude(sender=self.user)
+            .aupdate(read_at=timezone.now())
+        )
+        logging.debug(f"Marked {chats} messages as read.")
+
+        await self.channel_layer.group_send(
+            room_group_name(chat_request.pk),
+            {
+                "type": "chat.action",
+                "room": str(chat_request.pk),
+                "action": "mark_read",
+                "user_uuid": str(self.user.uuid),
+            },
         )
 
-        for message in previous_messages:
-            # if user is not a moderator, hide the content of hidden messages
-            if is_moderator:
-                await self.send(
-                    text_data=json.dumps(
-                        {
-                            "type": "chat.message",
-                            "id": message["pk"],
-                            "message": message["content"],
-                            "timestamp": message["timestamp"].isoformat(),
-                            "user_uuid": str(message["sender__uuid"]),
-                            "hidden": message["hidden"],
-                        },
-                    ),
-                )
-            else:
-                await self.send(
-                    text_data=json.dumps(
-                        {
-                            "type": "chat.message",
-                            "id": message["pk"],
-                            "message": "This message has been removed."
-                            if message["hidden"]
-                            else message["content"],
-                            "timestamp": message["timestamp"].isoformat(),
-                            "user_uuid": str(message["sender__uuid"]),
-                            "hidden": message["hidden"],
-                        },
-                    ),
-                )
+    async def message_saved(self, message, error):
+        """Acknowledge a message saved by the write-behind buffer to the room.
 
-    async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        The room learns the ID of the message, and its sender that it was delivered.
+        """
+        if error is None:
+            await self.count_unread(message.chat_request)
+        await self.channel_layer.group_send(
+            room_group_name(message.chat_request_id),
+            {
+                "type": "chat.ack",
+                "room": str(message.chat_request_id),
+                "client_id": str(message.client_id),
+                "message_id": message.id,
+                "saved": error is None,
+            },
+        )
 
-    async def receive(self, text_data):
-        """Handle incoming messages from the WebSocket.
-        This method processes the received message, saves it to the database,
-        and broadcasts it to the chat room.
+    async def handle(self, chat_request, text_data):
+        """Process a message or an action received in a room.
+
+        Messages are saved to the database and broadcast to the chat room.
         """
         from chat.models import ChatMessage
 
-        logging.debug(f"Received message: {text_data}")
-
-        text_data = json.loads(text_data)
+        room = str(chat_request.pk)
         if "message" in text_data:
-            message = text_data["message"]
+            content = text_data["message"]
             timestamp = timezone.now()
 
-            if len(message.strip()) > 1000:
+            if chat_request.is_blocked and not chat_request.is_moderator:
+                logging.warning(
+                    f"Blocked user {self.user.username} attempted to send a message.",
+                )
+                return
+
+            if len(content.strip()) > 1000:
                 logging.warning(
                     f"User {self.user.username} attempted to send a message exceeding 1000 characters.",
                 )
                 return
 
-            message = await ChatMessage.objects.acreate(
-                chat_request=self.chat_request,
+            message = ChatMessage(
+                chat_request=chat_request,
                 sender=self.user,
-                content=message,
+                content=content,
                 timestamp=timestamp,
+                client_id=parse_client_id(text_data.get("client_id")),
             )
 
+            if not settings.CHAT_WRITE_BEHIND:
+                await message.asave()
+                await self.count_unread(chat_request)
+
             # Broadcast the message with user UUID
             data = {
                 "type": "chat.message",
+                "room": room,
                 "message": message.content,
                 "timestamp": timestamp.isoformat(),
-                "user_uuid": str(message.sender.uuid),
+                "user_uuid": str(self.user.uuid),
                 "message_id": message.id,
+                "client_id": str(message.client_id),
             }
 
             logging.debug(f"Broadcasting message: {data}")
 
-            await self.channel_layer.group_send(self.room_group_name, data)
+            await self.channel_layer.group_send(room_group_name(room), data)
+
+            if settings.CHAT_WRITE_BEHIND:
+                # Saved with the next batch, then acknowledged to the room
+                message_buffer.add(message, self.message_saved)
+            else:
+                await self.send_json(
+                    {
+                        "type": "chat.ack",
+                        "room": room,
+                        "client_id": str(message.client_id),
+                        "message_id": message.id,
+                        "saved": True,
+                    },
+                )
 
         elif "action" in text_data:
             action = text_data["action"]
             message_id = text_data.get("message_id")
 
-            if action == "hide" and message_id:
-                if not self.user.has_perm("chat.can_moderate_messages"):
+            if action in ("hide", "unhide") and message_id:
+                if not chat_request.is_moderator:
                     logging.warning(
-                        f"User {self.user.username} attempted to hide a message without permission.",
+                        f"User {self.user.username} attempted to {action} a message without permission.",
                     )
                     return
-                # Hide the message
-                _ = await sync_to_async(
-                    ChatMessage.objects.filter(pk=message_id).update,
-                )(hidden=True)
+                _ = await ChatMessage.objects.filter(
+                    pk=message_id, chat_request=chat_request
+                ).aupdate(hidden=action == "hide")
 
                 await self.channel_layer.group_send(
-                    self.room_group_name,
+                    room_group_name(room),
                     {
                         "type": "chat.action",
-                        "action": "hide",
+                        "room": room,
+                        "action": action,
                         "message_id": message_id,
                     },
                 )
 
-            elif action == "unhide" and message_id:
-                if not self.user.has_perm("chat.can_moderate_messages"):
+            elif action == "load_more":
+                before = parse_cursor(text_data.get("before"))
+                if before is None:
                     logging.warning(
-                        f"User {self.user.username} attempted to unhide a message without permission.",
+                        f"User {self.user.username} sent an invalid history cursor.",
                     )
                     return
-                _ = await sync_to_async(
-                    ChatMessage.objects.filter(pk=message_id).update,
-                )(hidden=False)
-
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        "type": "chat.action",
-                        "action": "unhide",
-                        "message_id": message_id,
-                    },
-                )
+                await self.send_history(chat_request, before)
 
             elif action == "mark_read":
-                logging.debug(
-                    f"User {self.user.username} is marking messages as read in chat {self.room_name}.",
-                )
-                # Mark all messages in this chat as read by the user
-
-                chats = await sync_to_async(
-                    ChatMessage.objects.filter(
-                        chat_request=self.chat_request,
-                        read_at__isnull=True,
-                    )
-                    .exclude(sender=self.user)
-                    .update
-                )(read_at=timezone.now())
-
-                logging.debug(f"Marked {chats} messages as read.")
+                await self.mark_read(chat_request)
 
     async def chat_message(self, event):
         """Handler for type 'chat.message'."""
-        message = event["message"]
-        timestamp = event["timestamp"]
-        user_uuid = event["user_uuid"]
+        await self.send_json(
+            {
+                "type": "chat.message",
+                "room": event.get("room"),
+                "message_id": event.get("message_id"),
+                "client_id": event.get("client_id"),
+                "message": event["message"],
+                "timestamp": event["timestamp"],
+                "user_uuid": event["user_uuid"],
+            },
+        )
 
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "chat.message",
-                    "message_id": event.get("message_id"),
-                    "message": message,
-                    "timestamp": timestamp,
-                    "user_uuid": user_uuid,
-                },
-            ),
+    async def chat_ack(self, event):
+        """Handler for type 'chat.ack'."""
+        await self.send_json(
+            {
+                "type": "chat.ack",
+                "room": event.get("room"),
+                "client_id": event["client_id"],
+                "message_id": event["message_id"],
+                "saved": event["saved"],
+            },
         )
 
     async def chat_action(self, event):
@@ -211,24 +307,219 @@ class ChatConsumer(AsyncWebsocketConsumer):
         action = event["action"]
 
         if action in ["hide", "unhide"]:
-            message_id = event["message_id"]
-
-            await self.send(
-                text_data=json.dumps(
-                    {
-                        "type": "chat.action",
-                        "action": action,
-                        "message_id": message_id,
-                    },
-                ),
+            await self.send_json(
+                {
+                    "type": "chat.action",
+                    "room": event.get("room"),
+                    "action": action,
+                    "message_id": event["message_id"],
+                },
             )
         if action == "mark_read":
-            await self.send(
-                text_data=json.dumps(
-                    {
-                        "type": "chat.action",
-                        "action": "mark_read",
-                        "user_uuid": event["user_uuid"],
-                    }
+            await self.send_json(
+                {
+                    "type": "chat.action",
+                    "room": event.get("room"),
+                    "action": "mark_read",
+                    "user_uuid": event["user_uuid"],
+                }
+            )
+
+    async def reservation_status(self, event):
+        """Handler for type 'reservation.status', sent when a reservation of the ride changes."""
+        await self.send_json(
+            {
+                "type": "reservation.status",
+                "room": event["room"],
+                "status": event["status"],
+            }
+        )
+
+    async def room_created(self, event):
+        """Handler for type 'room.created', only the per-user consumer subscribes to new rooms."""
+
+
+class ChatConsumer(BaseChatConsumer):
+    """Connection to a single chat room, used by the moderators."""
+
+    async def connect(self):
+        self.user = self.scope["user"]
+        self.room_name = self.scope["url_route"]["kwargs"]["jr_pk"]
+        self.room_group_name = room_group_name(self.room_name)
+        self.user_group_name = None
+
+        if self.user.is_anonymous:
+            logging.error(
+                f"Anonymous user attempted to join chat room {self.room_name}."
+            )
+            await self.close()
+            return
+
+        if not await self.load_role():
+            logging.error(
+                f"User {self.user.username} attempted to join chat room {self.room_name} without permission. "
+                f"(Participant: {self.is_participant}, Moderator: {self.is_moderator})",
+            )
+            await self.close()
+            return
+
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        self.user_group_name = user_group_name(self.user.pk)
+        await self.channel_layer.group_add(self.user_group_name, self.channel_name)
+        await self.accept()
+
+        await self.send_history(self.chat_request)
+
+    async def load_role(self):
+        """Compute the role of the user in the chat, once for the connection.
+
+        The permissions are not checked again for each message, a `role.changed`
+        event is sent to the user group when they change.
+        Return whether the user can still be in the chat.
+        """
+        from chat.models import ChatRequest
+
+        self.is_participant = self.is_moderator = False
+        self.chat_request = (
+            await ChatRequest.objects.with_role(self.user)
+            .filter(pk=self.room_name)
+            .afirst()
+        )
+        if self.chat_request is None:
+            logging.error(f"ChatRequest with pk {self.room_name} does not exist.")
+            return False
+
+        self.is_participant = self.user.pk in (
+            self.chat_request.user_id,
+            self.chat_request.ride.driver_id,
+        )
+        self.is_moderator = self.chat_request.is_moderator
+        return self.is_participant or self.is_moderator
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if self.user_group_name is not None:
+            await self.channel_layer.group_discard(
+                self.user_group_name, self.channel_name
+            )
+        if settings.CHAT_WRITE_BEHIND:
+            # Don't keep the messages of a closed connection waiting
+            await message_buffer.flush()
+
+    async def receive(self, text_data):
+        """Handle incoming messages from the WebSocket."""
+        logging.debug(f"Received message: {text_data}")
+        await self.handle(self.chat_request, json.loads(text_data))
+
+    async def role_changed(self, event):
+        """Handler for type 'role.changed', sent when the permissions or blocks of the user change."""
+        if not await self.load_role():
+            logging.info(
+                f"User {self.user.username} is no longer allowed in chat room {self.room_name}.",
+            )
+            await self.close()
+
+
+class UserChatConsumer(BaseChatConsumer):
+    """One connection per user, subscribed to all the chat rooms they take part in.
+
+    It is subscribed to the active rooms of the user on connection, and to the
+    other ones (e.g. of a past ride) when the client joins them. Every frame
+    sent by the client must name its room.
+    """
+
+    async def connect(self):
+        self.user = self.scope["user"]
+        self.rooms = {}
+
+        if self.user.is_anonymous:
+            logging.error("Anonymous user attempted to open a chat connection.")
+            await self.close()
+            return
+
+        await self.channel_layer.group_add(
+            user_group_name(self.user.pk), self.channel_name
+        )
+        await self.accept()
+
+        await self.load_rooms(self.user_rooms().active())
+        await self.send_json(
+            {
+                "type": "chat.rooms",
+                "rooms": list(self.rooms),
+                # Number of unread messages of the user in each room
+                "unread": {
+                    room: getattr(
+                        chat_request,
+                        chat_request.unread_counters()[self.user.pk],
+                    )
+                    for room, chat_request in self.rooms.items()
+                },
+            }
+        )
+
+    def user_rooms(self):
+        from chat.models import ChatRequest
+
+        return ChatRequest.objects.with_role(self.user).for_participant(self.user)
+
+    async def load_rooms(self, chat_requests):
+        """Subscribe to the rooms of `chat_requests` (or refresh their role)."""
+        async for chat_request in chat_requests:
+            room = str(chat_request.pk)
+            if room not in self.rooms:
+                await self.channel_layer.group_add(
+                    room_group_name(room), self.channel_name
                 )
+            self.rooms[room] = chat_request
+
+    async def get_room(self, room):
+        """Return the chat request of `room`, subscribing to it if needed.
+
+        None if the user does not take part in it.
+        """
+        room = parse_room(room)
+        if room is None:
+            return None
+        if str(room) not in self.rooms:
+            await self.load_rooms(self.user_rooms().filter(pk=room))
+        return self.rooms.get(str(room))
+
+    async def disconnect(self, close_code):
+        if not self.user.is_anonymous:
+            await self.channel_layer.group_discard(
+                user_group_name(self.user.pk), self.channel_name
+            )
+        for room in self.rooms:
+            await self.channel_layer.group_discard(
+                room_group_name(room), self.channel_name
             )
+        if settings.CHAT_WRITE_BEHIND:
+            # Don't keep the messages of a closed connection waiting
+            await message_buffer.flush()
+
+    async def receive(self, text_data):
+        """Handle incoming messages from the WebSocket, tagged with their room."""
+        logging.debug(f"Received message: {text_data}")
+
+        text_data = json.loads(text_data)
+        chat_request = await self.get_room(text_data.get("room"))
+        if chat_request is None:
+            logging.warning(
+                f"User {self.user.username} sent a message to a room they are not part of.",
+            )
+            return
+
+        if text_data.get("action") == "join":
+            await self.send_history(chat_request)
+        else:
+            await self.handle(chat_request, text_data)
+
+    async def role_changed(self, event):
+        """Handler for type 'role.changed', the roles of all the rooms are computed again."""
+        await self.load_rooms(self.user_rooms().filter(pk__in=self.rooms))
+
+    async def room_created(self, event):
+        """Handler for type 'room.created', sent to the driver of a ride on new chat requests."""
+        if await self.get_room(event["room"]) is not None:
+            await self.send_json({"type": "chat.room", "room": event["room"]})
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.13 on 2026-10-18 19:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0002_remove_chatrequest_status"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="chatmessage",
+            index=models.Index(
+                fields=["chat_request", "timestamp", "id"],
+                name="chat_message_history_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.13 on 2026-10-18 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0003_chatmessage_history_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmessage",
+            name="client_id",
+            field=models.UUIDField(
+                blank=True,
+                editable=False,
+                help_text="ID generated by the sender, used to acknowledge the message before it is saved",
+                null=True,
+                verbose_name="client ID",
+            ),
+        ),
+    ]
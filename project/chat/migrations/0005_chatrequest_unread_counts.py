@@ -0,0 +1,55 @@
+# Generated by Django 5.2.13 on 2026-10-18 20:01
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_unread_messages(apps, schema_editor):
+    ChatRequest = apps.get_model("chat", "ChatRequest")
+    ChatMessage = apps.get_model("chat", "ChatMessage")
+
+    def unread_count(reader):
+        messages = (
+            ChatMessage.objects.filter(
+                chat_request=OuterRef("pk"), read_at__isnull=True
+            )
+            .exclude(sender=F(reader))
+            .values("chat_request")
+            .annotate(count=Count("pk"))
+            .values("count")
+        )
+        return Coalesce(Subquery(messages), 0)
+
+    ChatRequest.objects.update(
+        requester_unread_count=unread_count("chat_request__user"),
+        driver_unread_count=unread_count("chat_request__ride__driver"),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0004_chatmessage_client_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatrequest",
+            name="driver_unread_count",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Number of messages the driver of the ride has not read",
+                verbose_name="driver unread count",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatrequest",
+            name="requester_unread_count",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Number of messages the user who made the request has not read",
+                verbose_name="requester unread count",
+            ),
+        ),
+        migrations.RunPython(count_unread_messages, migrations.RunPython.noop),
+    ]
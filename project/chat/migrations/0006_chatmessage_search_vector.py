@@ -0,0 +1,59 @@
+# Generated by Django 5.2.13 on 2026-10-18 20:03
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.operations import UnaccentExtension
+from django.db import migrations, models
+
+# The french and english configurations, with the accents removed before stemming
+CREATE_SEARCH_CONFIGS = """
+CREATE TEXT SEARCH CONFIGURATION french_unaccent (COPY = french);
+ALTER TEXT SEARCH CONFIGURATION french_unaccent
+    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, french_stem;
+CREATE TEXT SEARCH CONFIGURATION english_unaccent (COPY = english);
+ALTER TEXT SEARCH CONFIGURATION english_unaccent
+    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, english_stem;
+"""
+
+DROP_SEARCH_CONFIGS = """
+DROP TEXT SEARCH CONFIGURATION french_unaccent;
+DROP TEXT SEARCH CONFIGURATION english_unaccent;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0005_chatrequest_unread_counts"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        UnaccentExtension(),
+        migrations.RunSQL(CREATE_SEARCH_CONFIGS, DROP_SEARCH_CONFIGS),
+        migrations.AddField(
+            model_name="chatmessage",
+            name="search_vector",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.postgres.search.CombinedSearchVector(
+                    django.contrib.postgres.search.SearchVector(
+                        "content", config="french_unaccent"
+                    ),
+                    "||",
+                    django.contrib.postgres.search.SearchVector(
+                        "content", config="english_unaccent"
+                    ),
+                    django.contrib.postgres.search.SearchConfig("french_unaccent"),
+                ),
+                output_field=django.contrib.postgres.search.SearchVectorField(),
+                verbose_name="search vector",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="chatmessage",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="chat_message_search_idx"
+            ),
+        ),
+    ]
@@ -1,10 +1,73 @@
+from datetime import timedelta
 from uuid import uuid4
 
 from carpool.models.ride import Ride
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    SearchVectorField,
+)
 from django.urls import reverse
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+# Text search configurations of the messages, the french and english ones
+# without the accents (created by the 0006_chatmessage_search_vector migration)
+SEARCH_CONFIGS = ("french_unaccent", "english_unaccent")
+
+
+class ChatRequestQuerySet(models.QuerySet):
+    def for_participant(self, user):
+        """Chat requests made by `user` or about one of their rides."""
+        return self.filter(models.Q(user=user) | models.Q(ride__driver=user))
+
+    def active(self):
+        """Chat requests about rides that are not over, or ended less than a day ago."""
+        return self.filter(ride__end_dt__gte=timezone.now() - timedelta(days=1))
+
+    def with_unread_messages(self):
+        """Chat requests with messages unread by one of the participants."""
+        return self.filter(
+            models.Q(requester_unread_count__gt=0) | models.Q(driver_unread_count__gt=0)
+        )
+
+    def search_messages(self, text):
+        """Chat requests with messages matching `text`, once each.
+
+        Annotated with `search_rank`, the rank of their best matching message.
+        """
+        messages = ChatMessage.objects.search(text)
+        return self.filter(pk__in=messages.values("chat_request")).annotate(
+            search_rank=models.Subquery(
+                messages.filter(chat_request=models.OuterRef("pk"))
+                .order_by("-rank")
+                .values("rank")[:1]
+            )
+        )
+
+    def with_role(self, user):
+        """Chat requests with their ride, and the role of `user` in one query.
+
+        Annotates `is_moderator` (the user can moderate chat messages) and
+        `is_blocked` (a moderator blocked the user). Whether the user is a
+        participant is known from `user_id` and `ride.driver_id`.
+        """
+        from accounts.models import User
+
+        return self.select_related("ride").annotate(
+            is_moderator=models.Exists(
+                User.objects.with_perm("chat.can_moderate_messages").filter(pk=user.pk)
+            ),
+            is_blocked=models.Exists(
+                ModAction.objects.filter(
+                    on_user=user.pk, action=ModAction.Action.BLOCK_USER
+                )
+            ),
+        )
+
 
 class ChatRequest(models.Model):
     uuid = models.UUIDField(
@@ -36,6 +99,28 @@ class ChatRequest(models.Model):
         auto_now_add=True,
     )
 
+    # Kept up to date by the chat consumers when messages are sent and read
+    requester_unread_count = models.PositiveIntegerField(
+        verbose_name=_("requester unread count"),
+        help_text=_("Number of messages the user who made the request has not read"),
+        default=0,
+    )
+
+    driver_unread_count = models.PositiveIntegerField(
+        verbose_name=_("driver unread count"),
+        help_text=_("Number of messages the driver of the ride has not read"),
+        default=0,
+    )
+
+    objects = ChatRequestQuerySet.as_manager()
+
+    def unread_counters(self):
+        """Name of the unread messages counter of each participant, by user pk."""
+        return {
+            self.user_id: "requester_unread_count",
+            self.ride.driver_id: "driver_unread_count",
+        }
+
     def get_room_url(self):
         return reverse("chat:room", kwargs={"jr_pk": self.pk})
 
@@ -46,6 +131,39 @@ class ChatRequest(models.Model):
         return f"ChatRequest({self.user.username} for {self.ride.uuid})"
 
 
+def search_query(text):
+    """Web search like query (quoted phrases, -word, or) in all the configurations."""
+    query = None
+    for config in SEARCH_CONFIGS:
+        config_query = SearchQuery(text, config=config, search_type="websearch")
+        query = config_query if query is None else query | config_query
+    return query
+
+
+class ChatMessageQuerySet(models.QuerySet):
+    def search(self, text):
+        """Messages matching `text`, annotated with their `rank`."""
+        query = search_query(text)
+        return self.filter(search_vector=query).annotate(
+            rank=SearchRank(models.F("search_vector"), query)
+        )
+
+    def history(self, chat_request, before=None):
+        """Messages of a chat, newest first.
+
+        `before` is an optional (timestamp, id) cursor: only the messages sent
+        before it are returned, so the history can be paginated on the index.
+        """
+        messages = self.filter(chat_request=chat_request)
+        if before is not None:
+            timestamp, pk = before
+            messages = messages.filter(
+                models.Q(timestamp__lt=timestamp)
+                | models.Q(timestamp=timestamp, pk__lt=pk)
+            )
+        return messages.order_by("-timestamp", "-pk")
+
+
 class ChatMessage(models.Model):
     content = models.TextField()
     sender = models.ForeignKey(
@@ -88,9 +206,38 @@ class ChatMessage(models.Model):
         ),
     )
 
+    client_id = models.UUIDField(
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name=_("client ID"),
+        help_text=_(
+            "ID generated by the sender, used to acknowledge the message before it is saved"
+        ),
+    )
+
+    search_vector = models.GeneratedField(
+        expression=SearchVector("content", config=SEARCH_CONFIGS[0])
+        + SearchVector("content", config=SEARCH_CONFIGS[1]),
+        output_field=SearchVectorField(),
+        db_persist=True,
+        verbose_name=_("search vector"),
+    )
+
+    objects = ChatMessageQuerySet.as_manager()
+
     class Meta:
         # Custom permission to moderate chat messages
         permissions = (("can_moderate_messages", _("Can moderate chat messages")),)
+        indexes = [
+            # Chat history, paginated on (timestamp, id)
+            models.Index(
+                fields=["chat_request", "timestamp", "id"],
+                name="chat_message_history_idx",
+            ),
+            # Full text search of the moderation center
+            GinIndex(fields=["search_vector"], name="chat_message_search_idx"),
+        ]
 
 
 class ChatReport(models.Model):
@@ -4,5 +4,6 @@ from django.urls import path
 from . import consumers
 
 websocket_urlpatterns = [
+    path("ws/chat/", consumers.UserChatConsumer.as_asgi()),
     path("ws/chat/<uuid:jr_pk>/", consumers.ChatConsumer.as_asgi()),
 ]
@@ -0,0 +1,122 @@
+# Keep the open chat connections up to date: they compute the role of their
+# user again when its permissions or blocks change, as the consumers don't check
+# them per message, and learn about new chat requests and reservation changes
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from accounts.models import User
+from carpool.models.reservation import Reservation
+from chat.consumers import room_group_name, user_group_name
+from chat.models import ChatRequest, ModAction
+
+
+def send_on_commit(events):
+    """Send the (group, event) pairs to the chat connections once committed."""
+    if not events:
+        return
+
+    def send():
+        channel_layer = get_channel_layer()
+        try:
+            for group, event in events:
+                async_to_sync(channel_layer.group_send)(group, event)
+        except Exception as e:
+            # Not worth failing the change, the connections catch up on reconnection
+            logging.warning(f"Could not notify the chat connections: {e}")
+
+    transaction.on_commit(send)
+
+
+def send_role_changed(user_pks):
+    send_on_commit(
+        [
+            (user_group_name(user_pk), {"type": "role.changed"})
+            for user_pk in set(user_pks)
+        ]
+    )
+
+
+@receiver(post_save, sender=ChatRequest)
+def room_created_on_chat_request(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    send_on_commit(
+        [
+            (
+                user_group_name(instance.ride.driver_id),
+                {"type": "room.created", "room": str(instance.pk)},
+            )
+        ]
+    )
+
+
+@receiver(post_save, sender=Reservation)
+def reservation_status_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    send_on_commit(
+        [
+            (
+                room_group_name(room),
+                {
+                    "type": "reservation.status",
+                    "room": str(room),
+                    "status": instance.status,
+                },
+            )
+            for room in ChatRequest.objects.filter(
+                ride=instance.ride_id, user=instance.user_id
+            ).values_list("pk", flat=True)
+        ]
+    )
+
+
+@receiver(post_save, sender=ModAction)
+@receiver(post_delete, sender=ModAction)
+def role_changed_on_mod_action(sender, instance, raw=False, **kwargs):
+    if raw or instance.action != ModAction.Action.BLOCK_USER:
+        return
+    if instance.on_user_id is not None:
+        send_role_changed([instance.on_user_id])
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def role_changed_on_user_permissions(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        send_role_changed([instance.pk])
+    elif action == "pre_clear":
+        # From a permission or a group, pk_set is not set on clear
+        send_role_changed(instance.user_set.values_list("pk", flat=True))
+    else:
+        send_role_changed(pk_set)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def role_changed_on_group_permissions(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if reverse:
+        # From a permission, pk_set holds the groups
+        groups = (
+            instance.group_set.all()
+            if action == "pre_clear"
+            else Group.objects.filter(pk__in=pk_set)
+        )
+    else:
+        groups = [instance]
+    send_role_changed(
+        User.objects.filter(groups__in=groups).values_list("pk", flat=True)
+    )
@@ -1,11 +1,14 @@
 from collections import defaultdict
+from itertools import groupby
 
-from django.contrib.auth.models import Group, Permission
-from accounts.models import User
+from accounts.models import EmailOutbox, User
 from celery import shared_task
 from celery.utils.log import get_task_logger
 from django.conf import settings
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.cache import cache
 from django.core.mail import EmailMessage
+from django.db import transaction
 from django.db.models import Case, Count, F, When
 from django.db.models.fields import UUIDField
 from django.template.loader import render_to_string
@@ -24,10 +27,15 @@ def send_email_report_to_mods(chat_request_pk, site_base_url):
     Task to send an email report to moderators about a specific chat.
     """
     # A moderator is a User that is in a Group (mods) or has can_moderate permission
-    g = Group.objects.get(name="mods")
-    p = Permission.objects.get(codename="can_moderate_messages")
-    mods = User.objects.filter(groups=g) | User.objects.filter(user_permissions=p)
-    mod_emails = mods.values_list("email", flat=True).distinct()
+    mods = User.objects.filter(groups__name="mods") | User.objects.filter(
+        user_permissions__codename="can_moderate_messages"
+    )
+    mod_emails = list(mods.values_list("email", flat=True).distinct())
+    if not mod_emails:
+        logger.warning(
+            f"No moderator to notify about the report of chat request {chat_request_pk}."
+        )
+        return
 
     # List all the messages in the chat
     chat_messages = ChatMessage.objects.filter(
@@ -52,14 +60,31 @@ def send_email_report_to_mods(chat_request_pk, site_base_url):
     )
     email.content_subtype = "html"  # Main content is now text/html
 
-    email.send(fail_silently=False)
+    EmailOutbox.objects.enqueue(email)
     logger.info(
-        f"Sent chat report email to moderators about chat request {chat_request_pk}."
+        f"Queued chat report email to moderators about chat request {chat_request_pk}."
     )
 
 
+# Key of the lock preventing two runs of send_email_unread_messages at once,
+# and its timeout (seconds), in case a worker dies before releasing it
+UNREAD_MESSAGES_LOCK_KEY = "chat:send_email_unread_messages:lock"
+UNREAD_MESSAGES_LOCK_TIMEOUT = 25 * 60
+
+
 @shared_task
 def send_email_unread_messages():
+    # Started every 30 minutes, skip this run if the previous one is not over
+    if not cache.add(UNREAD_MESSAGES_LOCK_KEY, True, UNREAD_MESSAGES_LOCK_TIMEOUT):
+        logger.warning("Unread messages emails are already being sent, skipping.")
+        return
+    try:
+        notify_unread_messages()
+    finally:
+        cache.delete(UNREAD_MESSAGES_LOCK_KEY)
+
+
+def notify_unread_messages():
     # We want to notify users about unread messages that are older than a certain threshold
     # and haven't been notified yet, to avoid spamming them with immediate notifications.
     cutoff = timezone.now() - timezone.timedelta(
@@ -68,7 +93,11 @@ def send_email_unread_messages():
 
     unread_struct = (
         ChatMessage.objects.filter(
-            read_at__isnull=True, notified_at__isnull=True, timestamp__lt=cutoff
+            # Only look at the messages of the chats with unread messages
+            chat_request__in=ChatRequest.objects.with_unread_messages(),
+            read_at__isnull=True,
+            notified_at__isnull=True,
+            timestamp__lt=cutoff,
         )
         .annotate(
             recipient_id=Case(
@@ -94,10 +123,11 @@ def send_email_unread_messages():
             "chat_request__user__username",  # passenger
             "chat_request__ride__driver__username",  # driver
         )
-        .annotate(unread_count=Count("id"))
+        .annotate(unread_count=Count("id"), message_ids=ArrayAgg("id"))
     )
 
     chats_by_user = defaultdict(list)
+    message_ids_by_user = defaultdict(list)
 
     for row in unread_struct:
         chats_by_user[row["recipient_id"]].append(
@@ -111,33 +141,39 @@ def send_email_unread_messages():
                 "contact": row["contact"],
             }
         )
-
-    for user_id, chats in chats_by_user.items():
-        user = User.objects.get(pk=user_id)
-
-        context = {
-            "user": user,
-            "unread_count": sum(chat["unread_count"] for chat in chats),
-            "chats": chats,
-        }
-
-        with translation.override(user.preferred_language):
-            subject = "[INSAROULE]" + _("You have unread messages")
-            message = render_to_string("chat/emails/unread_messages.txt", context)
-
-        email = EmailMessage(
-            subject=subject,
-            body=message,
-            to=[user.email],
+        message_ids_by_user[row["recipient_id"]].extend(row["message_ids"])
+
+    users = User.objects.filter(pk__in=chats_by_user).order_by("preferred_language")
+
+    # Render the emails of each language together
+    emails = []
+    notified_ids = []
+    for language, language_users in groupby(
+        users, key=lambda user: user.preferred_language
+    ):
+        with translation.override(language):
+            for user in language_users:
+                chats = chats_by_user[user.pk]
+                notified_ids.extend(message_ids_by_user[user.pk])
+                context = {
+                    "user": user,
+                    "unread_count": sum(chat["unread_count"] for chat in chats),
+                    "chats": chats,
+                }
+                emails.append(
+                    EmailMessage(
+                        subject="[INSAROULE]" + _("You have unread messages"),
+                        body=render_to_string(
+                            "chat/emails/unread_messages.txt", context
+                        ),
+                        to=[user.email],
+                    )
+                )
+
+    # The messages are marked as notified together with the queuing of the emails
+    with transaction.atomic():
+        EmailOutbox.objects.enqueue_many(emails)
+        ChatMessage.objects.filter(pk__in=notified_ids).update(
+            notified_at=timezone.now()
         )
-
-        email.send(fail_silently=False)
-
-        logger.info(f"Sent email to {user.email} about {len(chats)} chats.")
-
-        # Update the notified_at timestamp for the messages that were included in the email
-        ChatMessage.objects.filter(
-            chat_request__uuid__in=[c["chat_request_id"] for c in chats],
-            read_at__isnull=True,
-            notified_at__isnull=True,
-        ).update(notified_at=timezone.now())
+    logger.info(f"Queued unread messages emails to {len(emails)} users.")
@@ -0,0 +1,96 @@
+import asyncio
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from channels.testing import ApplicationCommunicator
+from channels.testing import WebsocketCommunicator as WSCommunicator
+from django.test import TransactionTestCase, override_settings
+
+from accounts.tests.factories import UserFactory
+from carpool.tests.factories import RideFactory
+from chat.buffer import MessageBuffer, lifespan, message_buffer
+from chat.consumers import ChatConsumer
+from chat.models import ChatMessage
+from chat.tests.factories import ChatRequestFactory
+
+
+class MessageBufferTests(TransactionTestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.room = ChatRequestFactory(user=self.user, ride=RideFactory())
+        self.saved = []
+
+    async def callback(self, message, error):
+        self.saved.append((message, error))
+
+    def message(self, content):
+        return ChatMessage(chat_request=self.room, sender=self.user, content=content)
+
+    @override_settings(CHAT_WRITE_BEHIND_FLUSH_INTERVAL=10)
+    async def test_messages_are_saved_in_one_batch(self):
+        buffer = MessageBuffer()
+        buffer.add(self.message("Hello"), self.callback)
+        buffer.add(self.message("World"), self.callback)
+        self.assertEqual(await ChatMessage.objects.acount(), 0)
+
+        await asyncio.sleep(0.1)
+        self.assertEqual(await ChatMessage.objects.acount(), 2)
+        self.assertEqual([error for _, error in self.saved], [None, None])
+        self.assertTrue(all(message.pk for message, _ in self.saved))
+
+    @override_settings(
+        CHAT_WRITE_BEHIND_FLUSH_INTERVAL=60_000, CHAT_WRITE_BEHIND_BATCH_SIZE=2
+    )
+    async def test_full_batch_is_saved_right_away(self):
+        buffer = MessageBuffer()
+        buffer.add(self.message("Hello"), self.callback)
+        buffer.add(self.message("World"), self.callback)
+
+        await asyncio.wait_for(buffer._flusher, 1)
+        self.assertEqual(await ChatMessage.objects.acount(), 2)
+
+    @override_settings(CHAT_WRITE_BEHIND_FLUSH_INTERVAL=60_000)
+    async def test_lifespan_shutdown_saves_the_waiting_messages(self):
+        message_buffer.add(self.message("Hello"), self.callback)
+
+        communicator = ApplicationCommunicator(lifespan, {"type": "lifespan"})
+        await communicator.send_input({"type": "lifespan.startup"})
+        await communicator.receive_output()
+        await communicator.send_input({"type": "lifespan.shutdown"})
+        self.assertEqual(
+            await communicator.receive_output(),
+            {"type": "lifespan.shutdown.complete"},
+        )
+        self.assertEqual(await ChatMessage.objects.acount(), 1)
+
+
+@override_settings(CHAT_WRITE_BEHIND=True)
+class WriteBehindConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.user = UserFactory(email_verified=True)
+        self.room = ChatRequestFactory(user=self.user, ride=RideFactory())
+
+    async def test_message_is_broadcast_then_acknowledged(self):
+        communicator = WSCommunicator(ChatConsumer.as_asgi(), "/chat/")
+        communicator.scope["url_route"] = {"kwargs": {"jr_pk": self.room.pk}}
+        communicator.scope["user"] = self.user
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        client_id = str(uuid4())
+        await communicator.send_json_to({"message": "Hello", "client_id": client_id})
+
+        msg = await communicator.receive_json_from()
+        self.assertEqual(msg["type"], "chat.message")
+        self.assertEqual(msg["client_id"], client_id)
+        self.assertIsNone(msg["message_id"])
+
+        ack = await communicator.receive_json_from(timeout=2)
+        self.assertEqual(ack["type"], "chat.ack")
+        self.assertEqual(ack["client_id"], client_id)
+        self.assertTrue(ack["saved"])
+
+        message = await sync_to_async(ChatMessage.objects.get)(client_id=client_id)
+        self.assertEqual(ack["message_id"], message.pk)
+
+        await communicator.disconnect()
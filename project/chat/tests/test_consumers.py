@@ -1,29 +1,26 @@
+from unittest.mock import patch
+
 from channels.testing import WebsocketCommunicator as WSCommunicator
-from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.models import AnonymousUser, Permission
 from django.test import TransactionTestCase
 from asgiref.sync import sync_to_async
 
 from accounts.tests.factories import UserFactory
+from carpool.models.reservation import Reservation
 from carpool.tests.factories import RideFactory
-from chat.consumers import ChatConsumer
+from chat.consumers import ChatConsumer, UserChatConsumer
 from chat.tests.factories import ChatRequestFactory, ChatMessageFactory
-from chat.models import ChatMessage
+from chat.models import ChatMessage, ChatRequest, ModAction
 
 """
 TODO: Other tests to be added:
 - Test that a user can send and receive messages in the chat.
-- Test that previous messages are sent upon connection.
 - Test that a moderator can see hidden messages.
 - Test that a non-moderator sees a placeholder for hidden messages.
 - Test that chat are stored correctly in the database.
 - Test that actions like hiding messages work as expected.
 """
 
-# TODO: add a function for when a user connect to the ws chat room
-#   it gets all the messages on the connection instead of having
-#   to set u1c.receive_json_from() three times to get all the messages on
-#   the room. This will make the tests cleaner and easier to read.
-
 
 class ChatConsumerTests(TransactionTestCase):
     def setUp(self):
@@ -109,23 +106,22 @@ class ChatConsumerTests(TransactionTestCase):
         communicator.scope["user"] = self.user1
         await communicator.connect()
 
-        msg = await communicator.receive_json_from()
-        self.assertEqual(msg["type"], "chat.message")
-        self.assertEqual(msg["message"], self.c1.content)
-        self.assertEqual(msg["user_uuid"], str(self.c1.sender.uuid))
-        self.assertEqual(msg["hidden"], self.c1.hidden)
+        history = await communicator.receive_json_from()
+        self.assertEqual(history["type"], "chat.history")
+        self.assertFalse(history["has_more"])
+        msg1, msg2, msg3 = history["messages"]
 
-        msg = await communicator.receive_json_from()
-        self.assertEqual(msg["type"], "chat.message")
-        self.assertEqual(msg["message"], self.c2.content)
-        self.assertEqual(msg["user_uuid"], str(self.c2.sender.uuid))
-        self.assertEqual(msg["hidden"], self.c2.hidden)
+        self.assertEqual(msg1["message"], self.c1.content)
+        self.assertEqual(msg1["user_uuid"], str(self.c1.sender.uuid))
+        self.assertEqual(msg1["hidden"], self.c1.hidden)
 
-        msg = await communicator.receive_json_from()
-        self.assertEqual(msg["type"], "chat.message")
-        self.assertEqual(msg["message"], "This message has been removed.")
-        self.assertEqual(msg["user_uuid"], str(self.c3.sender.uuid))
-        self.assertEqual(msg["hidden"], self.c3.hidden)
+        self.assertEqual(msg2["message"], self.c2.content)
+        self.assertEqual(msg2["user_uuid"], str(self.c2.sender.uuid))
+        self.assertEqual(msg2["hidden"], self.c2.hidden)
+
+        self.assertEqual(msg3["message"], "This message has been removed.")
+        self.assertEqual(msg3["user_uuid"], str(self.c3.sender.uuid))
+        self.assertEqual(msg3["hidden"], self.c3.hidden)
 
         await communicator.disconnect()
 
@@ -139,23 +135,37 @@ class ChatConsumerTests(TransactionTestCase):
         communicator.scope["user"] = self.mod
         await communicator.connect()
 
-        msg = await communicator.receive_json_from()
-        self.assertEqual(msg["type"], "chat.message")
-        self.assertEqual(msg["message"], self.c1.content)
-        self.assertEqual(msg["user_uuid"], str(self.c1.sender.uuid))
-        self.assertEqual(msg["hidden"], self.c1.hidden)
+        history = await communicator.receive_json_from()
+        self.assertEqual(history["type"], "chat.history")
+        self.assertEqual(
+            [msg["message"] for msg in history["messages"]],
+            [self.c1.content, self.c2.content, self.c3.content],
+        )
+        self.assertTrue(history["messages"][2]["hidden"])
 
-        msg = await communicator.receive_json_from()
-        self.assertEqual(msg["type"], "chat.message")
-        self.assertEqual(msg["message"], self.c2.content)
-        self.assertEqual(msg["user_uuid"], str(self.c2.sender.uuid))
-        self.assertEqual(msg["hidden"], self.c2.hidden)
+        await communicator.disconnect()
 
-        msg = await communicator.receive_json_from()
-        self.assertEqual(msg["type"], "chat.message")
-        self.assertEqual(msg["message"], self.c3.content)
-        self.assertEqual(msg["user_uuid"], str(self.c3.sender.uuid))
-        self.assertEqual(msg["hidden"], self.c3.hidden)
+    @patch("chat.consumers.HISTORY_PAGE_SIZE", 2)
+    async def test_load_more_history(self):
+        """Test that the newest messages are sent first, then the older ones on demand."""
+        communicator = WSCommunicator(ChatConsumer.as_asgi(), "/chat/")
+        communicator.scope["url_route"] = {"kwargs": {"jr_pk": self.room.pk}}
+        communicator.scope["user"] = self.mod
+        await communicator.connect()
+
+        history = await communicator.receive_json_from()
+        self.assertEqual(
+            [msg["id"] for msg in history["messages"]], [self.c2.pk, self.c3.pk]
+        )
+        self.assertTrue(history["has_more"])
+
+        await communicator.send_json_to(
+            {"action": "load_more", "before": history["cursor"]}
+        )
+        history = await communicator.receive_json_from()
+        self.assertEqual(history["type"], "chat.history")
+        self.assertEqual([msg["id"] for msg in history["messages"]], [self.c1.pk])
+        self.assertFalse(history["has_more"])
 
         await communicator.disconnect()
 
@@ -171,17 +181,17 @@ class ChatConsumerTests(TransactionTestCase):
         # TODO simplify this by having a function that connects the user and receives all the messages
         await mdc.connect()
         await mdc.receive_json_from()
-        await mdc.receive_json_from()
-        await mdc.receive_json_from()
 
         await u1c.connect()
         await u1c.receive_json_from()
-        await u1c.receive_json_from()
-        await u1c.receive_json_from()
 
         # User send a message
         await u1c.send_json_to({"type": "chat.message", "message": "Censor me plz"})
         await u1c.receive_json_from()
+        # The sender also gets the acknowledgement of the message
+        ack = await u1c.receive_json_from()
+        self.assertEqual(ack["type"], "chat.ack")
+        self.assertTrue(ack["saved"])
 
         # Wait for the message to be received by the moderator
         msg = await mdc.receive_json_from()
@@ -207,18 +217,19 @@ class ChatConsumerTests(TransactionTestCase):
         u1c.scope["user"] = self.user1
 
         await mdc.connect()
-        await mdc.receive_json_from()
-        await mdc.receive_json_from()
+
         await mdc.receive_json_from()
 
         await u1c.connect()
         await u1c.receive_json_from()
-        await u1c.receive_json_from()
-        await u1c.receive_json_from()
 
         # User send a message
         await u1c.send_json_to({"type": "chat.message", "message": "Censor me plz"})
         msg = await u1c.receive_json_from()
+        # The sender also gets the acknowledgement of the message
+        ack = await u1c.receive_json_from()
+        self.assertEqual(ack["type"], "chat.ack")
+        self.assertTrue(ack["saved"])
 
         # Wait for the message to be received by the moderator
         msg = await mdc.receive_json_from()
@@ -257,8 +268,6 @@ class ChatConsumerTests(TransactionTestCase):
         # TODO: simplify also this with a simple
         await u1c.connect()
         await u1c.receive_json_from()
-        await u1c.receive_json_from()
-        await u1c.receive_json_from()
 
         # Try to send an action
         await u1c.send_json_to(
@@ -285,13 +294,9 @@ class ChatConsumerTests(TransactionTestCase):
         u2c.scope["user"] = self.user2
         await u1c.connect()
         await u1c.receive_json_from()
-        await u1c.receive_json_from()
-        await u1c.receive_json_from()
 
         await u2c.connect()
         await u2c.receive_json_from()
-        await u2c.receive_json_from()
-        await u2c.receive_json_from()
 
         # Send a new message as user1
         new_message = "Hello, this is a test message."
@@ -309,3 +314,206 @@ class ChatConsumerTests(TransactionTestCase):
 
         await u1c.disconnect()
         await u2c.disconnect()
+
+    async def test_moderator_disconnected_when_permission_removed(self):
+        """Test that the cached role is computed again when the permissions change."""
+        mdc = WSCommunicator(ChatConsumer.as_asgi(), "/chat/")
+        mdc.scope["url_route"] = {"kwargs": {"jr_pk": self.room.pk}}
+        mdc.scope["user"] = self.mod
+        await mdc.connect()
+        await mdc.receive_json_from()
+
+        permission = await Permission.objects.aget(codename="can_moderate_messages")
+        await sync_to_async(self.mod.user_permissions.remove)(permission)
+
+        output = await mdc.receive_output()
+        self.assertEqual(output["type"], "websocket.close")
+
+    async def test_blocked_user_cannot_send_messages(self):
+        """Test that a participant blocked during the connection cannot send messages."""
+        u1c = WSCommunicator(ChatConsumer.as_asgi(), "/chat/")
+        u1c.scope["url_route"] = {"kwargs": {"jr_pk": self.room.pk}}
+        u1c.scope["user"] = self.user1
+        await u1c.connect()
+        await u1c.receive_json_from()
+
+        await ModAction.objects.acreate(
+            performed_by=self.mod,
+            on_user=self.user1,
+            action=ModAction.Action.BLOCK_USER,
+        )
+        # Let the consumer handle the role change
+        self.assertTrue(await u1c.receive_nothing())
+
+        await u1c.send_json_to({"type": "chat.message", "message": "Still here?"})
+        self.assertTrue(await u1c.receive_nothing())
+        self.assertFalse(
+            await ChatMessage.objects.filter(content="Still here?").aexists()
+        )
+
+        await u1c.disconnect()
+
+
+class UserChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.user1 = UserFactory(email_verified=True)
+        self.user2 = UserFactory(email_verified=True)
+        self.user3 = UserFactory(email_verified=True)
+        self.ride = RideFactory(driver=self.user1)
+        self.room = ChatRequestFactory(user=self.user2, ride=self.ride)
+        self.message = ChatMessageFactory(sender=self.user1, chat_request=self.room)
+
+    async def connect(self, user):
+        communicator = WSCommunicator(UserChatConsumer.as_asgi(), "/ws/chat/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_anonymous_user_cannot_connect(self):
+        communicator = WSCommunicator(UserChatConsumer.as_asgi(), "/ws/chat/")
+        communicator.scope["user"] = AnonymousUser()
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+    async def test_subscribed_to_the_active_rooms(self):
+        """Test that the user is subscribed to the rooms they take part in."""
+        await ChatRequest.objects.filter(pk=self.room.pk).aupdate(
+            requester_unread_count=2
+        )
+        room = str(self.room.pk)
+        for user, rooms, unread in [
+            (self.user1, [room], {room: 0}),
+            (self.user2, [room], {room: 2}),
+            (self.user3, [], {}),
+        ]:
+            communicator = await self.connect(user)
+            frame = await communicator.receive_json_from()
+            self.assertEqual(
+                frame, {"type": "chat.rooms", "rooms": rooms, "unread": unread}
+            )
+            await communicator.disconnect()
+
+    async def test_messages_are_tagged_with_their_room(self):
+        """Test that the history and the messages of a room carry its UUID."""
+        room = str(self.room.pk)
+        u2c = await self.connect(self.user2)
+        await u2c.receive_json_from()
+
+        await u2c.send_json_to({"room": room, "action": "join"})
+        history = await u2c.receive_json_from()
+        self.assertEqual(history["type"], "chat.history")
+        self.assertEqual(history["room"], room)
+        self.assertEqual(
+            [msg["message"] for msg in history["messages"]], [self.message.content]
+        )
+
+        # From the connection of a single room
+        u1c = WSCommunicator(ChatConsumer.as_asgi(), "/chat/")
+        u1c.scope["url_route"] = {"kwargs": {"jr_pk": self.room.pk}}
+        u1c.scope["user"] = self.user1
+        await u1c.connect()
+        await u1c.receive_json_from()
+        await u1c.send_json_to({"message": "Hello"})
+
+        msg = await u2c.receive_json_from()
+        self.assertEqual(msg["type"], "chat.message")
+        self.assertEqual(msg["room"], room)
+        self.assertEqual(msg["message"], "Hello")
+
+        # And the other way around
+        await u2c.send_json_to({"room": room, "message": "Hi"})
+        await u1c.receive_json_from()  # Own message
+        await u1c.receive_json_from()  # Acknowledgement
+        msg = await u1c.receive_json_from()
+        self.assertEqual(msg["message"], "Hi")
+
+        await u1c.disconnect()
+        await u2c.disconnect()
+
+    async def test_cannot_join_other_rooms(self):
+        """Test that a user cannot send anything to the rooms of other users."""
+        u3c = await self.connect(self.user3)
+        await u3c.receive_json_from()
+
+        await u3c.send_json_to({"room": str(self.room.pk), "action": "join"})
+        await u3c.send_json_to({"room": str(self.room.pk), "message": "Spam"})
+        self.assertTrue(await u3c.receive_nothing())
+        self.assertFalse(await ChatMessage.objects.filter(content="Spam").aexists())
+
+        await u3c.disconnect()
+
+    async def test_reservation_status_changes(self):
+        """Test that the participants learn about the reservation changes."""
+        u1c = await self.connect(self.user1)
+        await u1c.receive_json_from()
+
+        reservation = await Reservation.objects.acreate(ride=self.ride, user=self.user2)
+        frame = await u1c.receive_json_from()
+        self.assertEqual(
+            frame,
+            {
+                "type": "reservation.status",
+                "room": str(self.room.pk),
+                "status": Reservation.Status.PENDING,
+            },
+        )
+
+        reservation.status = Reservation.Status.ACCEPTED
+        await reservation.asave()
+        frame = await u1c.receive_json_from()
+        self.assertEqual(frame["status"], Reservation.Status.ACCEPTED)
+
+        await u1c.disconnect()
+
+    async def test_subscribed_to_new_chat_requests(self):
+        """Test that the driver is subscribed to the new chat requests of their rides."""
+        u1c = await self.connect(self.user1)
+        await u1c.receive_json_from()
+
+        room = await sync_to_async(ChatRequestFactory)(user=self.user3, ride=self.ride)
+        frame = await u1c.receive_json_from()
+        self.assertEqual(frame, {"type": "chat.room", "room": str(room.pk)})
+
+        u3c = await self.connect(self.user3)
+        await u3c.receive_json_from()
+        await u3c.send_json_to({"room": str(room.pk), "message": "Hello"})
+        msg = await u1c.receive_json_from()
+        self.assertEqual(msg["room"], str(room.pk))
+
+        await u1c.disconnect()
+        await u3c.disconnect()
+
+    async def test_unread_counters(self):
+        """Test that the unread messages are counted, and the read receipts broadcast."""
+        room = str(self.room.pk)
+        u1c = await self.connect(self.user1)
+        await u1c.receive_json_from()
+        u2c = await self.connect(self.user2)
+        await u2c.receive_json_from()
+
+        for content in ["Hello", "Are you there?"]:
+            await u2c.send_json_to({"room": room, "message": content})
+            await u1c.receive_json_from()
+        await self.room.arefresh_from_db()
+        self.assertEqual(self.room.driver_unread_count, 2)
+        self.assertEqual(self.room.requester_unread_count, 0)
+
+        await u1c.send_json_to({"room": room, "action": "mark_read"})
+        for communicator in [u1c, u2c]:
+            frame = await communicator.receive_json_from()
+            while frame["type"] != "chat.action":
+                frame = await communicator.receive_json_from()
+            self.assertEqual(frame["action"], "mark_read")
+            self.assertEqual(frame["user_uuid"], str(self.user1.uuid))
+
+        await self.room.arefresh_from_db()
+        self.assertEqual(self.room.driver_unread_count, 0)
+        self.assertFalse(
+            await ChatMessage.objects.filter(
+                sender=self.user2, read_at__isnull=True
+            ).aexists()
+        )
+
+        await u1c.disconnect()
+        await u2c.disconnect()
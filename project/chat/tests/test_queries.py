@@ -0,0 +1,48 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from accounts.tests.factories import UserFactory
+from carpool.tests.factories import RideFactory
+from carpool.tests.test_queries import QueryBudgetMixin
+from chat.models import ChatReport
+from chat.tests.factories import ChatMessageFactory, ChatRequestFactory
+
+
+class ChatViewsQueriesTestCase(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = UserFactory(email_verified=True)
+        self.driver = UserFactory(email_verified=True)
+        self.client.force_login(self.user)
+
+    def seed_requests(self, count):
+        # Outgoing requests on other drivers rides
+        for ride in RideFactory.create_batch(count, driver=self.driver):
+            ChatRequestFactory(ride=ride, user=self.user)
+        # Incoming requests on the user rides
+        for ride in RideFactory.create_batch(count, driver=self.user):
+            ChatRequestFactory(ride=ride, user=UserFactory())
+
+    def test_index(self):
+        self.assertConstantQueries(reverse("chat:index"), self.seed_requests)
+
+    def test_room(self):
+        chat_request = ChatRequestFactory(
+            ride=RideFactory(driver=self.driver), user=self.user
+        )
+        url = reverse("chat:room", kwargs={"jr_pk": chat_request.pk})
+        self.assertConstantQueries(url, self.seed_requests)
+
+    def test_mod_center(self):
+        self.client.force_login(UserFactory(email_verified=True, is_mod=True))
+
+        def seed(count):
+            for ride in RideFactory.create_batch(count, driver=self.driver):
+                chat_request = ChatRequestFactory(ride=ride, user=self.user)
+                ChatMessageFactory.create_batch(
+                    2, chat_request=chat_request, sender=self.user
+                )
+                ChatReport.objects.create(
+                    chat_request=chat_request, reported_by=self.driver
+                )
+
+        self.assertConstantQueries(reverse("chat:mod_index"), seed)
@@ -0,0 +1,70 @@
+from django.core import mail
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from accounts.models import EmailOutbox
+from accounts.tasks import send_outbox_emails
+from accounts.tests.factories import UserFactory
+from carpool.tests.factories import RideFactory
+from chat import tasks
+from chat.models import ChatMessage, ChatRequest
+from chat.tests.factories import ChatMessageFactory, ChatRequestFactory
+
+
+class UnreadMessagesEmailTestCase(TestCase):
+    def setUp(self):
+        cache.delete(tasks.UNREAD_MESSAGES_LOCK_KEY)
+        self.driver = UserFactory(email_verified=True, preferred_language="fr")
+        self.passenger = UserFactory(email_verified=True, preferred_language="en")
+        self.chat_request = ChatRequestFactory(
+            ride=RideFactory(driver=self.driver), user=self.passenger
+        )
+
+    def unread_message(self, sender, minutes_ago=60):
+        message = ChatMessageFactory(chat_request=self.chat_request, sender=sender)
+        # The timestamp is set on creation
+        ChatMessage.objects.filter(pk=message.pk).update(
+            timestamp=timezone.now() - timezone.timedelta(minutes=minutes_ago)
+        )
+        return message
+
+    def test_emails_and_notified_messages(self):
+        to_driver = self.unread_message(self.passenger)
+        to_passenger = self.unread_message(self.driver)
+        too_recent = self.unread_message(self.driver, minutes_ago=0)
+        ChatRequest.objects.update(requester_unread_count=2, driver_unread_count=1)
+
+        tasks.send_email_unread_messages()
+        send_outbox_emails()
+
+        self.assertEqual(
+            sorted(email.to[0] for email in mail.outbox),
+            sorted([self.driver.email, self.passenger.email]),
+        )
+        self.assertEqual(
+            set(
+                ChatMessage.objects.filter(notified_at__isnull=False).values_list(
+                    "pk", flat=True
+                )
+            ),
+            {to_driver.pk, to_passenger.pk},
+        )
+        too_recent.refresh_from_db()
+        self.assertIsNone(too_recent.notified_at)
+
+        # Already notified
+        tasks.send_email_unread_messages()
+        self.assertEqual(EmailOutbox.objects.count(), 2)
+
+    def test_overlapping_runs_are_skipped(self):
+        self.unread_message(self.passenger)
+        ChatRequest.objects.update(driver_unread_count=1)
+
+        cache.add(tasks.UNREAD_MESSAGES_LOCK_KEY, True)
+        tasks.send_email_unread_messages()
+        self.assertEqual(EmailOutbox.objects.count(), 0)
+
+        cache.delete(tasks.UNREAD_MESSAGES_LOCK_KEY)
+        tasks.send_email_unread_messages()
+        self.assertEqual(EmailOutbox.objects.count(), 1)
@@ -192,3 +192,23 @@ class ModeratorChatViewTest(TestCase):
         self.assertEqual(r.status_code, 403)
 
         # TODO: Test that the reported chats  apperas
+
+    def test_mod_index_search_by_content(self):
+        """Test the full text search of the messages, without accents."""
+        matching = ChatRequestFactory(ride=self.ride, user=self.user2)
+        matching.messages.create(content="Rendez-vous à la gare", sender=self.user1)
+        matching.messages.create(content="La gare de Rennes ?", sender=self.user2)
+        other = ChatRequestFactory(ride=self.ride)
+        other.messages.create(content="Je serai en retard", sender=self.user1)
+
+        self.client.force_login(self.mod)
+        r = self.client.get(
+            reverse("chat:mod_index"), {"search_by_content": "à la GARE", "past": "1"}
+        )
+        # Each chat once, even with several matching messages
+        self.assertEqual(list(r.context["page_obj"]), [matching])
+
+        r = self.client.get(
+            reverse("chat:mod_index"), {"search_by_content": "rendez vous", "past": "1"}
+        )
+        self.assertEqual(list(r.context["page_obj"]), [matching])
@@ -6,7 +6,9 @@ from carpool.models.ride import Ride
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, permission_required
 from django.core.paginator import Paginator
-from django.db.models import OuterRef, Q, Subquery
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.utils.translation import gettext as _
@@ -56,16 +58,15 @@ def report(request, jr_pk):
             messages.error(request, _("You have already reported this chat request."))
             return redirect("chat:room", jr_pk=jr_pk)
 
-        # Handle the report submission
-        ChatReport.objects.create(
-            chat_request=join_request,
-            reported_by=request.user,
-            reason=request.POST.get("reason", ""),
-        )
-
-        # Notify moderators via email (asynchronous task)
+        # Handle the report submission, and notify the moderators via email
         site_base_url = request.scheme + "://" + get_current_site(request).domain
-        send_email_report_to_mods.delay(join_request.pk, site_base_url)
+        with transaction.atomic():
+            ChatReport.objects.create(
+                chat_request=join_request,
+                reported_by=request.user,
+                reason=request.POST.get("reason", ""),
+            )
+            send_email_report_to_mods(join_request.pk, site_base_url)
 
     messages.info(request, _("The chat request has been reported."))
     return redirect("chat:room", jr_pk=jr_pk)
@@ -109,7 +110,9 @@ def unhide_message(request, id):
 
 @permission_required("chat.can_moderate_messages", raise_exception=True)
 def mod_room(request, jr_pk):
-    join_request = get_object_or_404(ChatRequest, pk=jr_pk)
+    join_request = get_object_or_404(
+        ChatRequest.objects.select_related("ride__driver", "user"), pk=jr_pk
+    )
     context = {"join_request": join_request}
     return render(request, "chat/moderation/room.html", context)
 
@@ -121,7 +124,16 @@ def mod_center(request):
     query_content = request.GET.get("search_by_content", "")
     past_rides = request.GET.get("past", "")
 
-    reports = ChatRequest.objects.all()
+    messages_count = (
+        ChatMessage.objects.filter(chat_request=OuterRef("pk"))
+        .values("chat_request")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    reports = ChatRequest.objects.annotate(
+        has_reports=Exists(ChatReport.objects.filter(chat_request=OuterRef("pk"))),
+        messages_count=Coalesce(Subquery(messages_count), 0),
+    )
 
     if not past_rides == "1":
         reports = reports.filter(
@@ -138,7 +150,10 @@ def mod_center(request):
         )
     if query_content:
         print(f"Searching by content: {query_content}")
-        reports = reports.filter(Q(messages__content__icontains=query_content))
+        # Full text search, the best matching chats first
+        reports = reports.search_messages(query_content).order_by(
+            "-search_rank", "-created_at"
+        )
 
     if query_ride:
         print(f"Filtering by ride: {query_ride}")
@@ -171,6 +186,7 @@ def get_sidebar_context(request):
 
     outgoing_requests = (
         ChatRequest.objects.filter(user=request.user)
+        .select_related("ride__start_loc", "ride__end_loc", "ride__driver")
         .annotate(
             last_reservation_status=Subquery(last_reservation.values("status")[:1])
         )
@@ -178,7 +194,8 @@ def get_sidebar_context(request):
     )
 
     incoming_requests = (
-        ChatRequest.objects.filter(ride__in=request.user.rides_as_driver.all())
+        ChatRequest.objects.filter(ride__driver=request.user)
+        .select_related("ride__start_loc", "ride__end_loc", "user")
         .annotate(
             last_reservation_status=Subquery(last_reservation.values("status")[:1])
         )
@@ -226,7 +243,12 @@ def index(request):
 
 @login_required
 def room(request, jr_pk):
-    join_request = get_object_or_404(ChatRequest, pk=jr_pk)
+    join_request = get_object_or_404(
+        ChatRequest.objects.select_related(
+            "ride__driver", "ride__start_loc", "ride__end_loc", "user"
+        ),
+        pk=jr_pk,
+    )
 
     if request.user not in [join_request.user, join_request.ride.driver]:
         return HttpResponse("You are not allowed to access this room", status=403)
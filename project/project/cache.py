@@ -0,0 +1,91 @@
+"""
+Helpers around the shared (Redis) Django cache.
+
+The keys are grouped in namespaces, each with a version stored in the cache.
+Bumping the version of a namespace invalidates all its keys at once, without
+having to know or scan them: the old keys are no longer read and expire on
+their own.
+"""
+
+import hashlib
+from functools import wraps
+
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import transaction
+
+
+def version_key(namespace):
+    return f"{namespace}:version"
+
+
+def namespace_version(namespace):
+    """Current version of `namespace`, initialized to 1."""
+    cache.add(version_key(namespace), 1, None)
+    return cache.get(version_key(namespace), 1)
+
+
+def make_key(namespace, *parts):
+    """Key of `parts` in the current version of `namespace`."""
+    return ":".join([namespace, f"v{namespace_version(namespace)}", *map(str, parts)])
+
+
+def bump_version(namespace):
+    try:
+        cache.incr(version_key(namespace))
+    except ValueError:
+        # The version was evicted, start again from a new one
+        cache.set(version_key(namespace), namespace_version(namespace) + 1, None)
+
+
+def invalidate(namespace):
+    """Invalidate all the keys of `namespace`.
+
+    The version is bumped right away, and again once the transaction is
+    committed: concurrent requests may have cached the old data meanwhile.
+    """
+    bump_version(namespace)
+    transaction.on_commit(lambda: bump_version(namespace))
+
+
+def is_request_specific(request):
+    """Whether the response to `request` will carry a CSRF or session cookie."""
+    session = getattr(request, "session", None)
+    return bool(
+        request.META.get("CSRF_COOKIE_NEEDS_UPDATE")
+        or (session is not None and session.modified)
+    )
+
+
+def cache_anonymous_page(namespace, timeout):
+    """Cache the responses of a view to the anonymous users in `namespace`.
+
+    Unlike cache_page, the responses are not varied on the cookies (all the
+    anonymous users share them), and are only cached when nothing is specific
+    to the request: no pending messages, no CSRF token rendered in the page and
+    no session changed. The cookies are only set later by the middlewares, so
+    they are checked on the request rather than on the response.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (
+                request.method not in ("GET", "HEAD")
+                or request.user.is_authenticated
+                or len(messages.get_messages(request))
+            ):
+                return view(request, *args, **kwargs)
+
+            path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            key = make_key(namespace, "page", request.LANGUAGE_CODE, path)
+            response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200 and not is_request_specific(request):
+                    cache.set(key, response, timeout)
+            return response
+
+        return wrapper
+
+    return decorator
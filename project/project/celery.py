@@ -19,6 +19,10 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
 
 app.conf.beat_schedule = {
+    "send-outbox-emails": {
+        "task": "accounts.tasks.send_outbox_emails",  # Every minute
+        "schedule": crontab(),
+    },
     "send-unread-messages-emails": {
         "task": "chat.tasks.send_email_unread_messages",
         "schedule": crontab(
@@ -29,6 +33,26 @@ app.conf.beat_schedule = {
         "task": "carpool.tasks.compute_daily_statistics",  # Every day at 5:00 AM
         "schedule": crontab(hour=5, minute=0),
     },
+    "evict-geocoding-cache": {
+        "task": "carpool.tasks.evict_geocoding_cache",  # Every day at 4:00 AM
+        "schedule": crontab(hour=4, minute=0),
+    },
+    "evict-route-cache": {
+        "task": "carpool.tasks.evict_route_cache",  # Every day at 4:15 AM
+        "schedule": crontab(hour=4, minute=15),
+    },
+    "delete-orphaned-steps": {
+        "task": "carpool.tasks.delete_orphaned_steps",  # Every day at 4:30 AM
+        "schedule": crontab(hour=4, minute=30),
+    },
+    "delete-expired-data-exports": {
+        "task": "accounts.tasks.delete_expired_data_exports",  # Every day at 6:30 AM
+        "schedule": crontab(hour=6, minute=30),
+    },
+    "delete-old-outbox-emails": {
+        "task": "accounts.tasks.delete_old_outbox_emails",  # Every day at 6:15 AM
+        "schedule": crontab(hour=6, minute=15),
+    },
     "delete-non-verified-accounts": {
         "task": "accounts.tasks.delete_non_verified_accounts",  # Every day at 6:00 AM
         "schedule": crontab(hour=6, minute=0),
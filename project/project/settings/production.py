@@ -48,6 +48,7 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "django.contrib.gis",
+    "django.contrib.postgres",
     "multiselectfield",
     "channels",
     "accounts",
@@ -204,6 +205,57 @@ CELERY_RESULT_SERIALIZER = "json"
 GEOCODAGE_TASK_RATE_LIMIT = env("GEOCODAGE_TASK_RATE_LIMIT", default="50/s")
 ROUTING_TASK_RATE_LIMIT = env("ROUTING_TASK_RATE_LIMIT", default="5/s")
 
+# Tasks queues, so that a large batch of emails cannot delay the other tasks
+CELERY_TASK_ROUTES = {
+    "accounts.tasks.send_outbox_emails": {"queue": "emails"},
+}
+
+# Emails sent per minute to a same recipient domain by the outbox workers
+EMAIL_OUTBOX_DOMAIN_RATE_LIMIT = env.int("EMAIL_OUTBOX_DOMAIN_RATE_LIMIT", default=60)
+
+# Days the sent and the failed outbox emails are kept before being deleted
+EMAIL_OUTBOX_SENT_RETENTION_DAYS = env.int(
+    "EMAIL_OUTBOX_SENT_RETENTION_DAYS", default=7
+)
+EMAIL_OUTBOX_FAILED_RETENTION_DAYS = env.int(
+    "EMAIL_OUTBOX_FAILED_RETENTION_DAYS", default=30
+)
+
+# IGN circuit breaker settings: failures before failing fast, and for how long (in seconds)
+IGN_CIRCUIT_BREAKER_THRESHOLD = env.int("IGN_CIRCUIT_BREAKER_THRESHOLD", default=5)
+IGN_CIRCUIT_BREAKER_RESET_TIMEOUT = env.int(
+    "IGN_CIRCUIT_BREAKER_RESET_TIMEOUT", default=60
+)
+
+# Geocoding cache settings
+GEOCODING_CACHE_TTL_DAYS = env.int("GEOCODING_CACHE_TTL_DAYS", default=30)
+GEOCODING_CACHE_MAX_ENTRIES = env.int("GEOCODING_CACHE_MAX_ENTRIES", default=20000)
+
+# Route cache settings (precision in decimal places of the waypoints coordinates)
+ROUTE_CACHE_PRECISION = env.int("ROUTE_CACHE_PRECISION", default=4)
+ROUTE_CACHE_TTL_DAYS = env.int("ROUTE_CACHE_TTL_DAYS", default=90)
+ROUTE_CACHE_MAX_ENTRIES = env.int("ROUTE_CACHE_MAX_ENTRIES", default=10000)
+
+# Cache settings, on the Redis server already used by Celery and Channels (in
+# its own database), so that the cache is shared by all the workers
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": env("CACHE_REDIS_URL", default="redis://localhost:6379/1"),
+        "KEY_PREFIX": env("CACHE_KEY_PREFIX", default="insaroule"),
+        # Bump to invalidate all the keys at once, e.g. when their format changes
+        "VERSION": env.int("CACHE_VERSION", default=1),
+        "TIMEOUT": env.int("CACHE_DEFAULT_TIMEOUT", default=300),
+    }
+}
+
+# Sessions are read from the cache, the database is only used to persist them
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+
+# Cache timeouts (in seconds) of the anonymous rides list and of the ride cards
+RIDES_LIST_CACHE_TIMEOUT = env.int("RIDES_LIST_CACHE_TIMEOUT", default=60)
+RIDE_CARD_CACHE_TIMEOUT = env.int("RIDE_CARD_CACHE_TIMEOUT", default=600)
+
 # Cooldown settings
 COOLDOWN_EMAIL_VERIFY = env.int(
     "COOLDOWN_EMAIL_VERIFY",
@@ -211,6 +263,14 @@ COOLDOWN_EMAIL_VERIFY = env.int(
 )  # in seconds (default 5 minutes)
 
 # Channels settings
+# Chat write-behind settings: when enabled, messages are broadcast before being
+# saved, in batches (flush interval in milliseconds)
+CHAT_WRITE_BEHIND = env.bool("CHAT_WRITE_BEHIND", default=False)
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL = env.int(
+    "CHAT_WRITE_BEHIND_FLUSH_INTERVAL", default=20
+)
+CHAT_WRITE_BEHIND_BATCH_SIZE = env.int("CHAT_WRITE_BEHIND_BATCH_SIZE", default=100)
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
@@ -234,9 +294,17 @@ EMAIL_NOTIFICATION_THRESHOLD_MINUTES = env.int(
     "EMAIL_NOTIFICATION_THRESHOLD_MINUTES", default=30
 )
 
+# Personal data exports: directory of the archives, and how long (in seconds)
+# their download links are valid
+DATA_EXPORT_ROOT = env("DATA_EXPORT_ROOT", default=str(BASE_DIR / "exports"))
+DATA_EXPORT_MAX_AGE = env.int("DATA_EXPORT_MAX_AGE", default=7 * 24 * 3600)
+
 # Anonymous access settings
 ANONYMOUS_ACCESS_RIDES_LIST = env.bool("ANONYMOUS_ACCESS_RIDES_LIST", default=True)
 
+# Maximum distance (in km) between a searched location and a ride's route
+RIDE_SEARCH_RADIUS_KM = env.float("RIDE_SEARCH_RADIUS_KM", default=10)
+
 # The email that users can use to contact support
 # You can use GitLab Service Desk feature to handle incoming emails
 SUPPORT_EMAIL = env("SUPPORT_EMAIL")
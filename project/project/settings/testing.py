@@ -22,6 +22,13 @@ LOGGING = {
     },
 }
 
+# Tests don't need a running Redis server
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
 TESTING = "test" in sys.argv or "PYTEST_VERSION" in os.environ
 
 if not TESTING: